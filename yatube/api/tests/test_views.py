@@ -0,0 +1,122 @@
+from http import HTTPStatus
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from core.query_budget import query_budget
+from posts.consts import LIMIT_COMMENTS, LIMIT_POSTS
+from posts.models import Comment, Follow, Group, Post, User
+from posts.tests.consts import TEST_COMMENT, TEST_SLUG, TEST_TEXT, TEST_TITLE
+
+
+class ApiViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='writer')
+        cls.group = Group.objects.create(title=TEST_TITLE, slug=TEST_SLUG)
+        Follow.objects.create(user=cls.user, author=cls.author)
+        for i in range(LIMIT_POSTS + 1):
+            cls.post = Post.objects.create(
+                author=cls.author, text=f'{TEST_TEXT} {i}', group=cls.group)
+        for i in range(LIMIT_COMMENTS + 1):
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text=f'{TEST_COMMENT} {i}')
+        cls.urls = {
+            'api:index': reverse('api:index'),
+            'api:group_list': reverse('api:group_list', args=[TEST_SLUG]),
+            'api:profile': reverse('api:profile', args=['writer']),
+            'api:follow_index': reverse('api:follow_index'),
+            'api:post_detail': reverse('api:post_detail', args=[cls.post.pk]),
+        }
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def test_feeds_paginate_with_cursor(self):
+        """Ленты отдаются страницами, курсор ведёт на следующую"""
+        expected = list(Post.objects.order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+        for name, url in self.urls.items():
+            if name == 'api:post_detail':
+                continue
+            with self.subTest(name=name):
+                first = self.authorized_client.get(url).json()
+                self.assertEqual([post['id'] for post in first['results']],
+                                 expected[:LIMIT_POSTS])
+                self.assertIsNone(first['previous_cursor'])
+                second = self.authorized_client.get(
+                    url, {'cursor': first['next_cursor']}).json()
+                self.assertEqual([post['id'] for post in second['results']],
+                                 expected[LIMIT_POSTS:])
+                self.assertIsNone(second['next_cursor'])
+
+    def test_post_detail_with_comments(self):
+        """Пост приходит с первой пачкой комментариев"""
+        data = self.authorized_client.get(
+            self.urls['api:post_detail']).json()
+        self.assertEqual(data['post']['id'], self.post.pk)
+        self.assertEqual(data['post']['author'], 'writer')
+        self.assertEqual(data['post']['group'], TEST_SLUG)
+        self.assertEqual(data['post']['comments_count'], LIMIT_COMMENTS + 1)
+        self.assertIsNone(data['post']['image'])
+        self.assertEqual(len(data['comments']['results']), LIMIT_COMMENTS)
+        rest = self.authorized_client.get(
+            self.urls['api:post_detail'],
+            {'cursor': data['comments']['next_cursor']}).json()
+        self.assertEqual(rest['comments']['results'][0]['text'],
+                         f'{TEST_COMMENT} 0')
+
+    def test_sparse_fields(self):
+        """fields оставляет в ответе только перечисленные поля"""
+        data = self.authorized_client.get(
+            self.urls['api:index'], {'fields': 'id,author'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'author'})
+        self.assertIsNotNone(data['next_cursor'])
+        data = self.authorized_client.get(
+            self.urls['api:post_detail'],
+            {'fields': 'text', 'comment_fields': 'author'}).json()
+        self.assertEqual(set(data['post']), {'text'})
+        self.assertEqual(set(data['comments']['results'][0]), {'author'})
+        response = self.authorized_client.get(
+            self.urls['api:index'], {'fields': 'id,password'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn('password', response.json()['detail'])
+
+    def test_errors(self):
+        """Ошибки приходят в JSON с подходящим кодом"""
+        errors = {
+            reverse('api:group_list', args=['missing']): HTTPStatus.NOT_FOUND,
+            reverse('api:profile', args=['missing']): HTTPStatus.NOT_FOUND,
+            reverse('api:post_detail', args=[0]): HTTPStatus.NOT_FOUND,
+            self.urls['api:follow_index']: HTTPStatus.UNAUTHORIZED,
+        }
+        for url, status in errors.items():
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, status)
+                self.assertIn('detail', response.json())
+        self.assertEqual(
+            self.client.post(self.urls['api:index']).status_code,
+            HTTPStatus.METHOD_NOT_ALLOWED)
+
+    def test_head(self):
+        """HEAD отвечает теми же заголовками, что и GET, без тела"""
+        for name, url in self.urls.items():
+            with self.subTest(name=name):
+                etag = self.authorized_client.get(url).get('ETag')
+                response = self.authorized_client.head(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(response.get('ETag'), etag)
+                self.assertEqual(response.content, b'')
+
+    def test_views_fit_query_budget(self):
+        """Число запросов не зависит от числа постов и комментариев"""
+        for name, url in self.urls.items():
+            with self.subTest(name=name):
+                with query_budget(settings.QUERY_BUDGETS[name]):
+                    self.authorized_client.get(url)
@@ -0,0 +1,183 @@
+"""API первой версии только для чтения: ленты и пост с комментариями.
+
+Строки берутся из .values() и сериализуются без создания моделей
+и отрисовки шаблонов. Ленты листаются курсором, как KeysetPaginator
+HTML-страниц, а параметр fields оставляет в ответе только нужные поля.
+"""
+from functools import wraps
+
+from django.db.models import F
+from django.http import JsonResponse
+from django.views.decorators.http import require_safe
+
+from posts import feed_cache
+from posts.consts import (COMMENTS_ORDERING, KEYSET_ORDERING, LIMIT_COMMENTS,
+                          LIMIT_POSTS)
+from posts.models import Comment, Group, Post, User
+from posts.utils import KeysetPaginator
+from posts.views import TIMELINE_ORDERING, latest_post, post_state
+
+# поле ответа -> колонка .values()
+POST_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+    'comments_count': 'comments_count',
+}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'author': 'author__username',
+    'text': 'text',
+    'created': 'created',
+}
+
+
+class ApiError(Exception):
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class ValuesPaginator(KeysetPaginator):
+    """Курсорный паджинатор по словарям из .values()."""
+
+    def key(self, obj):
+        return [obj[field] for field in self.fields]
+
+
+def api_view(view):
+    """Отдаёт результат представления в JSON, а ApiError — ответом
+    {"detail": ...} с её кодом."""
+    @require_safe
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return JsonResponse(view(request, *args, **kwargs))
+        except ApiError as error:
+            return JsonResponse(dict(detail=error.detail),
+                                status=error.status)
+    return wrapper
+
+
+def parse_fields(request, available, param='fields'):
+    """Поля ответа из параметра запроса через запятую, по умолчанию
+    все."""
+    requested = request.GET.get(param, '')
+    names = tuple(dict.fromkeys(
+        name.strip() for name in requested.split(',') if name.strip()))
+    if not names:
+        return tuple(available)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(400, f'Неизвестные поля в {param}: '
+                            f'{", ".join(unknown)}. '
+                            f'Доступны: {", ".join(available)}.')
+    return names
+
+
+def image_url(name):
+    return Post._meta.get_field('image').storage.url(name) if name else None
+
+
+def serialize(rows, fields, available):
+    """Переименовывает колонки строк в поля ответа."""
+    results = []
+    for row in rows:
+        item = {name: row[available[name]] for name in fields}
+        if 'image' in item:
+            item['image'] = image_url(item['image'])
+        results.append(item)
+    return results
+
+
+def get_page(request, queryset, available, per_page,
+             ordering=KEYSET_ORDERING, param='fields'):
+    """Страница строк от курсора из запроса; поля ключа выбираются,
+    даже если их нет в ответе."""
+    fields = parse_fields(request, available, param)
+    paginator = ValuesPaginator(queryset, per_page, ordering)
+    columns = dict.fromkeys(
+        [available[name] for name in fields] + list(paginator.fields))
+    paginator.object_list = queryset.values(*columns)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    return dict(
+        results=serialize(page_obj, fields, available),
+        next_cursor=page_obj.next_cursor,
+        previous_cursor=page_obj.previous_cursor,
+    )
+
+
+def get_pk_or_error(queryset, detail, **lookup):
+    pk = queryset.filter(**lookup).values_list('pk', flat=True).first()
+    if pk is None:
+        raise ApiError(404, detail)
+    return pk
+
+
+@feed_cache.conditional_feed(
+    lambda: ('all', 'names'),
+    lambda request: latest_post(Post.objects.all()))
+@feed_cache.cache_feed(lambda: ('all', 'names'))
+@api_view
+def index(request):
+    return get_page(request, Post.objects.all(), POST_FIELDS, LIMIT_POSTS)
+
+
+@feed_cache.conditional_feed(
+    lambda slug: (f'group:{slug}', 'names'),
+    lambda request, slug: latest_post(
+        Post.objects.filter(group__slug=slug)))
+@feed_cache.cache_feed(lambda slug: (f'group:{slug}', 'names'))
+@api_view
+def group_posts(request, slug):
+    group = get_pk_or_error(Group.objects, 'Группа не найдена.', slug=slug)
+    return get_page(request, Post.objects.filter(group_id=group),
+                    POST_FIELDS, LIMIT_POSTS)
+
+
+@feed_cache.conditional_feed(
+    lambda username: (f'author:{username}', 'names'),
+    lambda request, username: latest_post(
+        Post.objects.filter(author__username=username)))
+@feed_cache.cache_feed(lambda username: (f'author:{username}', 'names'))
+@api_view
+def profile(request, username):
+    author = get_pk_or_error(
+        User.objects, 'Автор не найден.', username=username)
+    return get_page(request, Post.objects.filter(author_id=author),
+                    POST_FIELDS, LIMIT_POSTS)
+
+
+@api_view
+def follow_index(request):
+    if not request.user.is_authenticated:
+        raise ApiError(401, 'Лента подписок доступна после входа.')
+    posts = Post.objects.filter(timeline__user=request.user).annotate(
+        feed_date=F('timeline__pub_date'),
+        feed_post=F('timeline__post'),
+    )
+    return get_page(request, posts, POST_FIELDS, LIMIT_POSTS,
+                    ordering=TIMELINE_ORDERING)
+
+
+@feed_cache.conditional_feed(
+    lambda post_id: (f'post:{post_id}', 'names'), post_state)
+@feed_cache.cache_feed(lambda post_id: (f'post:{post_id}', 'names'))
+@api_view
+def post_detail(request, post_id):
+    """Пост и первая пачка комментариев; cursor листает комментарии,
+    comment_fields выбирает их поля."""
+    fields = parse_fields(request, POST_FIELDS)
+    post = Post.objects.filter(pk=post_id).values(
+        *(POST_FIELDS[name] for name in fields)).first()
+    if post is None:
+        raise ApiError(404, 'Пост не найден.')
+    comments = get_page(
+        request, Comment.objects.filter(post_id=post_id), COMMENT_FIELDS,
+        LIMIT_COMMENTS, ordering=COMMENTS_ORDERING, param='comment_fields')
+    return dict(post=serialize([post], fields, POST_FIELDS)[0],
+                comments=comments)
@@ -0,0 +1,104 @@
+from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.db.models import F
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.utils import timezone
+
+from . import jobs, mail, timing
+from .models import Email, Job, ViewTiming
+
+
+class ViewTimingAdmin(admin.ModelAdmin):
+    """Гистограммы времени ответа по представлениям вместо списка
+    строк; доступны всему персоналу, сбросить может суперпользователь."""
+
+    def has_module_permission(self, request):
+        return request.user.is_active and request.user.is_staff
+
+    def has_view_permission(self, request, obj=None):
+        return self.has_module_permission(request)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method == 'POST':
+            if not self.has_delete_permission(request):
+                raise PermissionDenied
+            ViewTiming.objects.all().delete()
+            return redirect(request.path)
+        # замеры этого процесса, ещё не сохранённые фоновым потоком
+        timing.recorder.flush()
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Время ответа представлений',
+            opts=self.model._meta,
+            views=timing.summarize(ViewTiming.objects.all()),
+            can_reset=self.has_delete_permission(request),
+        )
+        return TemplateResponse(
+            request, 'admin/core/viewtiming/change_list.html', context)
+
+
+admin.site.register(ViewTiming, ViewTimingAdmin)
+
+
+class JobAdmin(admin.ModelAdmin):
+    """Фоновые задачи только для просмотра; упавшие можно повторить."""
+    list_display = ('pk', 'name', 'status', 'attempts', 'max_attempts',
+                    'run_at', 'finished', 'worker')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'key')
+    actions = ('retry',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def retry(self, request, queryset):
+        retried = queryset.filter(status=Job.FAILED).update(
+            status=Job.QUEUED, run_at=timezone.now(), worker='',
+            max_attempts=F('attempts') + 1)
+        self.message_user(request, f'Повторно поставлено задач: {retried}')
+    retry.short_description = 'Повторить упавшие задачи'
+    retry.allowed_permissions = ('delete',)
+
+
+admin.site.register(Job, JobAdmin)
+
+
+class EmailAdmin(admin.ModelAdmin):
+    """Исходящие письма только для просмотра; неотправленные можно
+    поставить в очередь заново."""
+    list_display = ('pk', 'subject', 'to', 'status', 'attempts',
+                    'created', 'sent')
+    list_filter = ('status',)
+    search_fields = ('to', 'subject')
+    actions = ('retry',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def retry(self, request, queryset):
+        retried = queryset.filter(status=Email.FAILED).update(
+            status=Email.QUEUED, worker='', attempts=0)
+        if retried:
+            jobs.enqueue(mail.send_outbox, key='outbox')
+        self.message_user(request, f'Повторно поставлено писем: {retried}')
+    retry.short_description = 'Отправить неотправленные письма ещё раз'
+    retry.allowed_permissions = ('delete',)
+
+
+admin.site.register(Email, EmailAdmin)
@@ -0,0 +1,397 @@
+"""Двухуровневый кэш: LRU в памяти процесса поверх общего SQLite-файла.
+
+Первый уровень ограничен по числу записей и по времени жизни, чтобы
+изменения из других процессов становились видны быстро. Второй уровень —
+файл SQLite, доступный всем процессам на машине. get_or_set выполняет
+вычисление в одном процессе, остальные ждут его результата. Попадания и
+промахи считаются по префиксу ключа (часть до первого «:» или «|»).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': '/path/to/cache.sqlite3',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 5,
+            'L1_SKIP_PREFIXES': ('feed_generation',),
+        },
+    }
+}
+"""
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from . import timing
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    'key TEXT PRIMARY KEY, value BLOB, expires REAL)',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+    'CREATE TABLE IF NOT EXISTS cache_locks ('
+    'key TEXT PRIMARY KEY, expires REAL)',
+    'CREATE TABLE IF NOT EXISTS cache_stats ('
+    'prefix TEXT, kind TEXT, count INTEGER, PRIMARY KEY (prefix, kind))',
+)
+STAT_KINDS = ('l1_hits', 'l2_hits', 'misses')
+PREFIX_SEPARATOR = re.compile(r'[:|]')
+
+_missing = object()
+
+
+def key_prefix(key):
+    return PREFIX_SEPARATOR.split(str(key), 1)[0]
+
+
+def encode(value):
+    # целые храним как INTEGER, чтобы incr работал одним UPDATE
+    if type(value) is int:
+        return value
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def decode(value):
+    if isinstance(value, int):
+        return value
+    return pickle.loads(value)
+
+
+class TieredCache(BaseCache):
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.location = location
+        self.l1_max_entries = int(options.get('L1_MAX_ENTRIES', 1000))
+        self.l1_timeout = float(options.get('L1_TIMEOUT', 5))
+        self.l1_skip_prefixes = tuple(options.get('L1_SKIP_PREFIXES', ()))
+        self.lock_timeout = float(options.get('LOCK_TIMEOUT', 30))
+        self.lock_poll = float(options.get('LOCK_POLL', 0.05))
+        self.stats_interval = float(options.get('STATS_FLUSH_INTERVAL', 10))
+        self._l1 = OrderedDict()
+        self._l1_lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._stats_flushed = time.monotonic()
+        self._sets = 0
+
+    # второй уровень: SQLite
+
+    @property
+    def _db(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # после fork соединение родителя использовать нельзя
+            directory = os.path.dirname(self.location)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.location, timeout=self.lock_timeout,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                db.execute(statement)
+            local.db, local.pid = db, os.getpid()
+        return local.db
+
+    def _l2_get_many(self, keys):
+        if not keys:
+            return {}
+        rows = self._db.execute(
+            'SELECT key, value FROM cache WHERE key IN (%s) '
+            'AND (expires IS NULL OR expires > ?)'
+            % ','.join('?' * len(keys)),
+            [*keys, time.time()],
+        )
+        return {key: value for key, value in rows}
+
+    def _l2_set_many(self, items, timeout):
+        expires = self.get_backend_timeout(timeout)
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                [(key, value, expires) for key, value in items],
+            )
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        self._sets += len(items)
+        if self._sets >= self._max_entries // self._cull_frequency:
+            self._sets = 0
+            self._cull()
+
+    def _cull(self):
+        db = self._db
+        db.execute('DELETE FROM cache WHERE expires <= ?', [time.time()])
+        (count,) = db.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count > self._max_entries:
+            db.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY expires IS NULL, expires LIMIT ?)',
+                [count // self._cull_frequency],
+            )
+
+    def get_backend_timeout(self, timeout=DEFAULT_TIMEOUT):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return None
+        return time.time() + timeout
+
+    # первый уровень: LRU в памяти процесса
+
+    def _l1_allowed(self, raw_key):
+        return (self.l1_max_entries > 0
+                and not str(raw_key).startswith(self.l1_skip_prefixes))
+
+    def _l1_get(self, key):
+        with self._l1_lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return _missing
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._l1[key]
+                return _missing
+            self._l1.move_to_end(key)
+            return value
+
+    def _l1_set(self, key, value, timeout):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        lifetime = self.l1_timeout
+        if timeout is not None:
+            lifetime = min(lifetime, timeout)
+        if lifetime <= 0:
+            return
+        with self._l1_lock:
+            self._l1[key] = (value, time.monotonic() + lifetime)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_delete(self, *keys):
+        with self._l1_lock:
+            for key in keys:
+                self._l1.pop(key, None)
+
+    # статистика
+
+    def _record(self, raw_key, kind):
+        timing.record_cache(kind != 'misses')
+        with self._stats_lock:
+            self._stats[key_prefix(raw_key), kind] += 1
+        if time.monotonic() - self._stats_flushed >= self.stats_interval:
+            self.flush_stats()
+
+    def flush_stats(self):
+        with self._stats_lock:
+            stats, self._stats = self._stats, Counter()
+            self._stats_flushed = time.monotonic()
+        if stats:
+            self._db.executemany(
+                'INSERT INTO cache_stats (prefix, kind, count) '
+                'VALUES (?, ?, ?) ON CONFLICT (prefix, kind) '
+                'DO UPDATE SET count = count + excluded.count',
+                [(prefix, kind, count)
+                 for (prefix, kind), count in stats.items()],
+            )
+
+    def stats(self):
+        """{префикс: {'l1_hits': …, 'l2_hits': …, 'misses': …}}
+        по всем процессам, которые пишут в этот файл."""
+        self.flush_stats()
+        result = {}
+        rows = self._db.execute('SELECT prefix, kind, count FROM cache_stats')
+        for prefix, kind, count in rows:
+            result.setdefault(prefix, dict.fromkeys(STAT_KINDS, 0))
+            result[prefix][kind] = count
+        return result
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats.clear()
+        self._db.execute('DELETE FROM cache_stats')
+
+    # API кэша Django
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        made = {}
+        for key in keys:
+            made_key = self.make_key(key, version=version)
+            self.validate_key(made_key)
+            made[made_key] = key
+        found = {}
+        remote = []
+        for made_key, key in made.items():
+            value = _missing
+            if self._l1_allowed(key):
+                value = self._l1_get(made_key)
+            if value is _missing:
+                remote.append(made_key)
+            else:
+                found[key] = decode(value)
+                self._record(key, 'l1_hits')
+        for made_key, value in self._l2_get_many(remote).items():
+            key = made[made_key]
+            found[key] = decode(value)
+            self._record(key, 'l2_hits')
+            if self._l1_allowed(key):
+                self._l1_set(made_key, value, DEFAULT_TIMEOUT)
+        for made_key in remote:
+            if made[made_key] not in found:
+                self._record(made[made_key], 'misses')
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        items = []
+        for key, value in data.items():
+            made_key = self.make_key(key, version=version)
+            self.validate_key(made_key)
+            encoded = encode(value)
+            items.append((made_key, encoded))
+            if self._l1_allowed(key):
+                self._l1_set(made_key, encoded, timeout)
+        self._l2_set_many(items, timeout)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        made_key = self.make_key(key, version=version)
+        self.validate_key(made_key)
+        now = time.time()
+        cursor = self._db.execute(
+            'INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+            'expires = excluded.expires WHERE cache.expires <= ?',
+            [made_key, encode(value), self.get_backend_timeout(timeout), now],
+        )
+        self._l1_delete(made_key)
+        return cursor.rowcount == 1
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        made_key = self.make_key(key, version=version)
+        self.validate_key(made_key)
+        cursor = self._db.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            [self.get_backend_timeout(timeout), made_key, time.time()],
+        )
+        return cursor.rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        made_key = self.make_key(key, version=version)
+        self.validate_key(made_key)
+        self._l1_delete(made_key)
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            updated = db.execute(
+                "UPDATE cache SET value = value + ? WHERE key = ? "
+                "AND typeof(value) = 'integer' "
+                "AND (expires IS NULL OR expires > ?)",
+                [delta, made_key, time.time()],
+            ).rowcount
+            row = db.execute(
+                'SELECT value FROM cache WHERE key = ?', [made_key]
+            ).fetchone()
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        if not updated:
+            raise ValueError("Key '%s' not found" % key)
+        return row[0]
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        made_keys = []
+        for key in keys:
+            made_key = self.make_key(key, version=version)
+            self.validate_key(made_key)
+            made_keys.append(made_key)
+        if not made_keys:
+            return
+        self._l1_delete(*made_keys)
+        self._db.execute(
+            'DELETE FROM cache WHERE key IN (%s)'
+            % ','.join('?' * len(made_keys)),
+            made_keys,
+        )
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def clear(self):
+        with self._l1_lock:
+            self._l1.clear()
+        self._db.execute('DELETE FROM cache')
+        self._db.execute('DELETE FROM cache_locks')
+
+    def close(self, **kwargs):
+        # соединение живёт весь поток: файл открывается один раз
+        pass
+
+    # вычисление в одном экземпляре
+
+    def _acquire(self, lock_key):
+        now = time.time()
+        cursor = self._db.execute(
+            'INSERT INTO cache_locks (key, expires) VALUES (?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET expires = excluded.expires '
+            'WHERE cache_locks.expires <= ?',
+            [lock_key, now + self.lock_timeout, now],
+        )
+        return cursor.rowcount == 1
+
+    def _release(self, lock_key):
+        self._db.execute('DELETE FROM cache_locks WHERE key = ?', [lock_key])
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """Как в BaseCache, но при промахе default() вызывает только один
+        процесс; остальные ждут, пока значение появится в кэше."""
+        value = self.get(key, _missing, version=version)
+        if value is not _missing:
+            return value
+        if not callable(default):
+            return super().get_or_set(key, default, timeout, version)
+        made_key = self.make_key(key, version=version)
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            if self._acquire(made_key):
+                try:
+                    value = self.get(key, _missing, version=version)
+                    if value is _missing:
+                        value = default()
+                        if value is not None:
+                            self.set(key, value, timeout, version=version)
+                    return value
+                finally:
+                    self._release(made_key)
+            time.sleep(self.lock_poll)
+            value = self._l2_get_many([made_key]).get(made_key, _missing)
+            if value is not _missing:
+                self._record(key, 'l2_hits')
+                return decode(value)
+            if time.monotonic() >= deadline:
+                # вычисляющий процесс завис — не ждём его бесконечно
+                return default()
@@ -0,0 +1,52 @@
+"""Поля и выражения для полнотекстового поиска SQLite FTS5.
+
+Скрытый столбец FTS5 называется так же, как таблица; FullTextField
+описывает его в модели, чтобы запросы строились через ORM:
+
+    Post.objects.filter(search__document__match='"слово"')
+        .annotate(rank=BM25('search__document'))
+"""
+from django.db import models
+from django.db.models import FloatField, Func, Lookup, TextField, Value
+
+
+class FullTextField(models.TextField):
+    """Скрытый столбец таблицы FTS5 (db_column — имя таблицы)."""
+
+
+@FullTextField.register_lookup
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class BM25(Func):
+    """Релевантность документа: чем меньше, тем лучше."""
+    function = 'bm25'
+    output_field = FloatField()
+
+
+class Snippet(Func):
+    """Фрагмент текста вокруг найденных слов из любого столбца."""
+    function = 'snippet'
+    output_field = TextField()
+
+    def __init__(self, document, start, end, ellipsis='…', tokens=16):
+        super().__init__(document, Value(-1), Value(start), Value(end),
+                         Value(ellipsis), Value(tokens))
+
+
+def quote_query(text):
+    """Запрос FTS5 из пользовательского текста: все слова обязательны,
+    последнее может быть началом слова. Слова берутся в кавычки, поэтому
+    операторы FTS5 во вводе не действуют."""
+    words = [word.replace('"', '""') for word in text.split()]
+    if not words:
+        return ''
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
@@ -0,0 +1,238 @@
+"""Очередь фоновых задач в базе проекта, без внешнего брокера.
+
+Задача — функция, помеченная декоратором task, и её аргументы в JSON.
+enqueue записывает задачу в core.Job той же транзакцией, что и
+остальные изменения запроса: откат отменит и её. Обработчики команды
+run_workers забирают задачи пачками UPDATE по условию
+status='queued', поэтому одну задачу не выполнят двое; где база
+умеет SKIP LOCKED, занятые строки пропускаются сразу. Упавшая задача
+возвращается в очередь с растущей паузой, пока не кончатся попытки.
+
+    @jobs.task(max_attempts=3)
+    def resize(name): ...
+
+    jobs.enqueue(resize, 'posts/a.jpg', key='posts/a.jpg')
+"""
+import json
+import logging
+import math
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import (IntegrityError, OperationalError, connection,
+                       transaction)
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def task(func=None, *, max_attempts=None):
+    """Разрешает ставить функцию в очередь; имя задачи — путь
+    к функции для import_string."""
+    def decorator(func):
+        func.job_max_attempts = max_attempts or settings.JOB_MAX_ATTEMPTS
+        return func
+    return decorator(func) if func is not None else decorator
+
+
+def name_of(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def resolve(name):
+    func = import_string(name)
+    if not hasattr(func, 'job_max_attempts'):
+        raise ValueError(f'{name} не помечена декоратором jobs.task')
+    return func
+
+
+def enqueue(func, *args, key='', delay=0):
+    """Ставит func(*args) в очередь не раньше чем через delay секунд.
+
+    Задача с непустым key не ставится, пока такая же ждёт первой
+    попытки; тогда возвращается None, иначе — созданная задача.
+    """
+    if not hasattr(func, 'job_max_attempts'):
+        raise ValueError(f'{name_of(func)} не помечена декоратором jobs.task')
+    now = timezone.now()
+    job = Job(
+        name=name_of(func),
+        args=json.dumps(args),
+        key=key,
+        max_attempts=func.job_max_attempts,
+        created=now,
+        run_at=now + timedelta(seconds=delay),
+    )
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        return None
+    return job
+
+
+def enqueue_many(func, keyed_args):
+    """Ставит пачку задач func одним INSERT; keyed_args — словарь
+    {ключ: аргументы}. Задачи, такие же как ждущие первой попытки,
+    пропускаются тем же ограничением, что и в enqueue."""
+    if not hasattr(func, 'job_max_attempts'):
+        raise ValueError(f'{name_of(func)} не помечена декоратором jobs.task')
+    now = timezone.now()
+    Job.objects.bulk_create([
+        Job(name=name_of(func), args=json.dumps(args), key=key,
+            max_attempts=func.job_max_attempts, created=now, run_at=now)
+        for key, args in keyed_args.items()
+    ], ignore_conflicts=True)
+
+
+def worker_name(index=0):
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def claim(worker, limit):
+    """Забирает до limit готовых задач; их attempts уже увеличен."""
+    now = timezone.now()
+    ready = Job.objects.filter(
+        status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'pk')
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ready = list(ready.select_for_update(skip_locked=True)
+                         .values_list('pk', flat=True)[:limit])
+        else:
+            # один UPDATE с подзапросом: в SQLite два соединения,
+            # прочитавшие очередь заранее, не смогли бы обе начать запись
+            ready = ready.values('pk')[:limit]
+        # условие по состоянию повторяется: задачу, которую успел
+        # забрать другой обработчик, UPDATE пропустит
+        claimed = Job.objects.filter(pk__in=ready, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, started=now,
+            attempts=F('attempts') + 1)
+    if not claimed:
+        return []
+    return list(Job.objects.filter(
+        status=Job.RUNNING, worker=worker, started=now).order_by(
+            'run_at', 'pk'))
+
+
+def retry_delay(attempts):
+    """Экспоненциальная пауза перед повтором со случайной добавкой,
+    чтобы упавшие вместе задачи не повторялись тоже вместе."""
+    delay = min(settings.JOB_RETRY_DELAY * 2 ** (attempts - 1),
+                settings.JOB_RETRY_MAX_DELAY)
+    return delay * random.uniform(1, 1.5)
+
+
+def perform(job):
+    """Выполняет забранную задачу и записывает результат; True, если
+    она удалась."""
+    try:
+        resolve(job.name)(*json.loads(job.args))
+    except Exception:
+        logger.exception('Задача %s упала, попытка %s из %s',
+                         job, job.attempts, job.max_attempts)
+        fail(job, traceback.format_exc())
+        return False
+    Job.objects.filter(pk=job.pk, worker=job.worker).update(
+        status=Job.DONE, finished=timezone.now(), error='')
+    return True
+
+
+def fail(job, error):
+    now = timezone.now()
+    jobs = Job.objects.filter(pk=job.pk, worker=job.worker)
+    if job.attempts >= job.max_attempts:
+        jobs.update(status=Job.FAILED, finished=now, error=error)
+    else:
+        jobs.update(status=Job.QUEUED, worker='', error=error,
+                    run_at=now + timedelta(
+                        seconds=retry_delay(job.attempts)))
+
+
+def recover():
+    """Задачи обработчиков, которые не отчитались за JOB_TIMEOUT, —
+    упавшие попытки; выполненные старше JOB_KEEP_DONE удаляются."""
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        started__lt=now - timedelta(seconds=settings.JOB_TIMEOUT))
+    for job in stale:
+        fail(job, f'Обработчик {job.worker} не завершил задачу вовремя')
+    Job.objects.filter(
+        status=Job.DONE,
+        finished__lt=now - timedelta(seconds=settings.JOB_KEEP_DONE),
+    ).delete()
+
+
+def work(worker, batch_size, poll, stop, once=False):
+    """Цикл обработчика: забирает и выполняет задачи, пока не
+    установлен stop; с once — пока в очереди есть готовые задачи.
+    Возвращает число выполненных задач."""
+    done = 0
+    checked = None
+    while not stop.is_set():
+        now = timezone.now()
+        if checked is None or now - checked > timedelta(
+                seconds=settings.JOB_TIMEOUT / 10):
+            recover()
+            checked = now
+        try:
+            jobs = claim(worker, batch_size)
+        except OperationalError:
+            # например, база занята дольше её таймаута: попробуем позже
+            logger.warning('Не удалось забрать задачи', exc_info=True)
+            jobs = []
+        if not jobs and once:
+            break
+        for job in jobs:
+            done += perform(job)
+        if not jobs:
+            stop.wait(poll)
+    return done
+
+
+def work_in_thread(*args, **kwargs):
+    try:
+        return work(*args, **kwargs)
+    finally:
+        # у каждого потока своё соединение с базой
+        connection.close()
+
+
+def percentile(values, percent):
+    """Значение по методу ближайшего ранга; None для пустого списка."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def stats(sample=1000):
+    """Глубина очереди по состояниям, возраст старейшей готовой задачи
+    и перцентили ожидания и выполнения последних sample задач, с."""
+    now = timezone.now()
+    depth = dict.fromkeys((status for status, _ in Job.STATUSES), 0)
+    depth.update(Job.objects.order_by().values_list('status').annotate(
+        Count('pk')))
+    oldest = Job.objects.filter(
+        status=Job.QUEUED, run_at__lte=now).aggregate(
+            oldest=Min('run_at'))['oldest']
+    recent = Job.objects.filter(status=Job.DONE).order_by(
+        '-finished').values_list('run_at', 'started', 'finished')[:sample]
+    waits, runs = [], []
+    for run_at, started, finished in recent:
+        waits.append((started - run_at).total_seconds())
+        runs.append((finished - started).total_seconds())
+    return dict(
+        depth=depth,
+        lag=(now - oldest).total_seconds() if oldest else 0.0,
+        wait={f'p{p}': percentile(waits, p) for p in (50, 95, 99)},
+        run={f'p{p}': percentile(runs, p) for p in (50, 95, 99)},
+    )
@@ -0,0 +1,153 @@
+"""Очередь исходящих писем в базе проекта.
+
+OutboxBackend, указанный в EMAIL_BACKEND, не отправляет письма, а
+записывает их в core.Email той же транзакцией, что и остальные
+изменения запроса, и ставит задачу send_outbox. Задача забирает письма
+пачками по OUTBOX_BATCH_SIZE и отправляет их настоящим движком
+OUTBOX_EMAIL_BACKEND через одно соединение на весь проход. Если
+отправка не удалась, оставшиеся письма возвращаются в очередь, а сама
+задача падает и повторяется очередью core.jobs с растущей паузой.
+
+Письмо, отправленное перед падением обработчика, но не отмеченное
+отправленным, уйдёт повторно: доставка «хотя бы один раз».
+"""
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import jobs
+from .models import Email
+
+
+def dump(message):
+    """Письмо в JSON; вложения в очереди не поддерживаются."""
+    if message.attachments:
+        raise ValueError('Письма с вложениями нельзя поставить в очередь')
+    return json.dumps(dict(
+        subject=message.subject,
+        body=message.body,
+        from_email=message.from_email,
+        to=message.to,
+        cc=message.cc,
+        bcc=message.bcc,
+        reply_to=message.reply_to,
+        headers=message.extra_headers,
+        alternatives=getattr(message, 'alternatives', []),
+    ), ensure_ascii=False)
+
+
+def load(data):
+    fields = json.loads(data)
+    fields['alternatives'] = [
+        tuple(alternative) for alternative in fields['alternatives']]
+    return EmailMultiAlternatives(**fields)
+
+
+class OutboxBackend(BaseEmailBackend):
+    """Движок почты, который только ставит письма в очередь."""
+
+    def send_messages(self, email_messages):
+        emails = [
+            Email(to=', '.join(message.recipients()),
+                  subject=message.subject, message=dump(message))
+            for message in email_messages if message.recipients()
+        ]
+        if emails:
+            with transaction.atomic():
+                Email.objects.bulk_create(emails)
+                jobs.enqueue(send_outbox, key='outbox')
+        return len(emails)
+
+
+def claim(worker, limit):
+    """Забирает до limit писем из очереди, как jobs.claim задачи."""
+    now = timezone.now()
+    queued = Email.objects.filter(status=Email.QUEUED).order_by('pk')
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            queued = list(queued.select_for_update(skip_locked=True)
+                          .values_list('pk', flat=True)[:limit])
+        else:
+            queued = queued.values('pk')[:limit]
+        claimed = Email.objects.filter(
+            pk__in=queued, status=Email.QUEUED).update(
+                status=Email.SENDING, worker=worker, claimed=now,
+                attempts=F('attempts') + 1)
+    if not claimed:
+        return []
+    return list(Email.objects.filter(
+        status=Email.SENDING, worker=worker, claimed=now).order_by('pk'))
+
+
+def release(emails, error):
+    """Возвращает письма в очередь; исчерпавшие попытки — в упавшие."""
+    pks = [email.pk for email in emails]
+    claimed = Email.objects.filter(pk__in=pks, status=Email.SENDING)
+    claimed.filter(attempts__gte=settings.OUTBOX_MAX_ATTEMPTS).update(
+        status=Email.FAILED, error=error)
+    claimed.update(status=Email.QUEUED, worker='', error=error)
+
+
+def recover():
+    """Письма обработчиков, молчащих дольше JOB_TIMEOUT, возвращаются
+    в очередь; отправленные старше OUTBOX_KEEP_SENT удаляются."""
+    now = timezone.now()
+    stale = Email.objects.filter(
+        status=Email.SENDING,
+        claimed__lt=now - timedelta(seconds=settings.JOB_TIMEOUT))
+    release(stale, 'Обработчик не завершил отправку вовремя')
+    Email.objects.filter(
+        status=Email.SENT,
+        sent__lt=now - timedelta(seconds=settings.OUTBOX_KEEP_SENT),
+    ).delete()
+
+
+def deliver(backend, emails):
+    """Отправляет пачку через открытое соединение и отмечает
+    отправленные; при ошибке возвращает в очередь остаток пачки."""
+    sent = 0
+    try:
+        for email in emails:
+            backend.send_messages([load(email.message)])
+            sent += 1
+    except Exception as error:
+        release(emails[sent:], f'{type(error).__name__}: {error}')
+        raise
+    finally:
+        Email.objects.filter(
+            pk__in=[email.pk for email in emails[:sent]]).update(
+                status=Email.SENT, sent=timezone.now(), error='')
+    return sent
+
+
+@jobs.task
+def send_outbox():
+    """Отправляет очередь писем целиком через одно соединение."""
+    recover()
+    worker = jobs.worker_name()
+    sent = 0
+    backend = None
+    try:
+        while True:
+            emails = claim(worker, settings.OUTBOX_BATCH_SIZE)
+            if not emails:
+                break
+            if backend is None:
+                # соединение открывается, только когда есть что отправить
+                backend = get_connection(settings.OUTBOX_EMAIL_BACKEND)
+                try:
+                    backend.open()
+                except Exception as error:
+                    release(emails, f'{type(error).__name__}: {error}')
+                    raise
+            sent += deliver(backend, emails)
+    finally:
+        if backend is not None:
+            backend.close()
+    return sent
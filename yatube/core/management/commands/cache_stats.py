@@ -0,0 +1,30 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэша по префиксам ключей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Обнулить счётчики после вывода.',
+        )
+
+    def handle(self, *args, **options):
+        if not hasattr(cache, 'stats'):
+            raise CommandError('Кэш по умолчанию не ведёт статистику.')
+        rows = sorted(cache.stats().items())
+        width = max([len('prefix')] + [len(prefix) for prefix, _ in rows])
+        self.stdout.write(
+            f'{"prefix":<{width}} {"l1":>8} {"l2":>8} {"miss":>8} {"hit%":>6}')
+        for prefix, counts in rows:
+            hits = counts['l1_hits'] + counts['l2_hits']
+            total = hits + counts['misses']
+            ratio = 100 * hits / total if total else 0
+            self.stdout.write(
+                f'{prefix:<{width}} {counts["l1_hits"]:>8} '
+                f'{counts["l2_hits"]:>8} {counts["misses"]:>8} '
+                f'{ratio:>6.1f}')
+        if options['reset']:
+            cache.reset_stats()
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    help = ('Показывает глубину очереди фоновых задач, возраст старейшей '
+            'готовой задачи и перцентили ожидания и выполнения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sample', type=int, default=1000,
+            help='По скольким последним выполненным задачам считать '
+                 'перцентили.',
+        )
+
+    def handle(self, *args, **options):
+        stats = jobs.stats(options['sample'])
+        self.stdout.write('Очередь: ' + ', '.join(
+            f'{status} — {count}' for status, count in stats['depth'].items()))
+        self.stdout.write(
+            f'Старейшая готовая задача ждёт {stats["lag"]:.1f} с')
+        for title, key in (('Ожидание', 'wait'), ('Выполнение', 'run')):
+            values = stats[key]
+            if values['p50'] is None:
+                continue
+            self.stdout.write(f'{title}, с: ' + ', '.join(
+                f'{name} {value:.3f}' for name, value in values.items()))
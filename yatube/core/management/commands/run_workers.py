@@ -0,0 +1,87 @@
+import multiprocessing
+import signal
+import threading
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import jobs
+
+
+def work_in_process(*args, **kwargs):
+    # при запуске через spawn дочерний процесс начинает с чистого листа
+    django.setup()
+    # Ctrl+C получает вся группа процессов; остановку передаёт родитель
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    jobs.work(*args, **kwargs)
+
+
+class Command(BaseCommand):
+    help = ('Выполняет фоновые задачи из очереди core.Job в нескольких '
+            'потоках или процессах до SIGINT или SIGTERM.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=2,
+            help='Сколько обработчиков запустить.',
+        )
+        parser.add_argument(
+            '--processes', action='store_true',
+            help='Запускать обработчики процессами, а не потоками.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10,
+            help='Сколько задач обработчик забирает за раз.',
+        )
+        parser.add_argument(
+            '--poll', type=float, default=1.0,
+            help='Пауза между проверками пустой очереди, с.',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Завершиться, когда готовых задач не останется.',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError(
+                '--workers и --batch-size должны быть положительными.')
+        processes = options['processes']
+        stop = multiprocessing.Event() if processes else threading.Event()
+        handlers = {signum: signal.signal(signum, lambda *_: stop.set())
+                    for signum in (signal.SIGINT, signal.SIGTERM)}
+        work_args = dict(batch_size=options['batch_size'],
+                         poll=options['poll'], once=options['once'])
+        try:
+            if options['workers'] == 1 and not processes:
+                # единственный обработчик работает в основном потоке
+                done = jobs.work(jobs.worker_name(), stop=stop, **work_args)
+                self.stdout.write(f'Выполнено задач: {done}')
+            else:
+                self.run_pool(stop, work_args, options)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        call_command('job_stats', stdout=self.stdout)
+
+    def run_pool(self, stop, work_args, options):
+        if options['processes']:
+            # дочерние процессы не должны делить соединение родителя
+            connections.close_all()
+            workers = [multiprocessing.Process(
+                target=work_in_process, name=f'jobs-{index}',
+                args=(jobs.worker_name(index),),
+                kwargs=dict(stop=stop, **work_args),
+            ) for index in range(options['workers'])]
+        else:
+            workers = [threading.Thread(
+                target=jobs.work_in_thread, name=f'jobs-{index}',
+                args=(jobs.worker_name(index),),
+                kwargs=dict(stop=stop, **work_args),
+            ) for index in range(options['workers'])]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.16 on 2026-10-18 03:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewTiming',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view_name', models.CharField(max_length=200, verbose_name='Представление')),
+                ('bucket', models.PositiveSmallIntegerField(verbose_name='Корзина')),
+                ('requests', models.BigIntegerField(default=0, verbose_name='Запросов')),
+                ('total_time', models.FloatField(default=0, verbose_name='Время ответа, мс')),
+                ('db_time', models.FloatField(default=0, verbose_name='Время в базе, мс')),
+                ('template_time', models.FloatField(default=0, verbose_name='Время шаблонов, мс')),
+                ('queries', models.BigIntegerField(default=0, verbose_name='SQL-запросов')),
+                ('cache_hits', models.BigIntegerField(default=0, verbose_name='Попаданий в кэш')),
+                ('cache_misses', models.BigIntegerField(default=0, verbose_name='Промахов кэша')),
+            ],
+            options={
+                'verbose_name': 'замер представления',
+                'verbose_name_plural': 'замеры представлений',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='viewtiming',
+            constraint=models.UniqueConstraint(fields=('view_name', 'bucket'), name='unique_view_timing'),
+        ),
+    ]
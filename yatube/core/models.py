@@ -0,0 +1,210 @@
+from django.db import models
+from django.db.models import Q, UniqueConstraint
+from django.utils import timezone
+
+
+class ViewTiming(models.Model):
+    """Накопленные замеры запросов к представлению, попавших в одну
+    корзину гистограммы времени ответа (core.timing.BUCKETS)."""
+    view_name = models.CharField(
+        verbose_name='Представление',
+        max_length=200,
+    )
+    bucket = models.PositiveSmallIntegerField(
+        verbose_name='Корзина',
+    )
+    requests = models.BigIntegerField(
+        verbose_name='Запросов',
+        default=0,
+    )
+    total_time = models.FloatField(
+        verbose_name='Время ответа, мс',
+        default=0,
+    )
+    db_time = models.FloatField(
+        verbose_name='Время в базе, мс',
+        default=0,
+    )
+    template_time = models.FloatField(
+        verbose_name='Время шаблонов, мс',
+        default=0,
+    )
+    queries = models.BigIntegerField(
+        verbose_name='SQL-запросов',
+        default=0,
+    )
+    cache_hits = models.BigIntegerField(
+        verbose_name='Попаданий в кэш',
+        default=0,
+    )
+    cache_misses = models.BigIntegerField(
+        verbose_name='Промахов кэша',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'замер представления'
+        verbose_name_plural = 'замеры представлений'
+        constraints = [
+            UniqueConstraint(fields=['view_name', 'bucket'],
+                             name='unique_view_timing'),
+        ]
+
+    def __str__(self):
+        return f'{self.view_name} #{self.bucket}'
+
+
+class Job(models.Model):
+    """Задача фоновой очереди core.jobs: функция и её аргументы."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'в очереди'),
+        (RUNNING, 'выполняется'),
+        (DONE, 'выполнена'),
+        (FAILED, 'не удалась'),
+    )
+    name = models.CharField(
+        verbose_name='Функция',
+        max_length=200,
+    )
+    args = models.TextField(
+        verbose_name='Аргументы (JSON)',
+        default='[]',
+    )
+    key = models.CharField(
+        verbose_name='Ключ',
+        help_text='Одинаковые задачи с ключом не ставятся в очередь дважды',
+        max_length=200,
+        blank=True,
+    )
+    status = models.CharField(
+        verbose_name='Состояние',
+        max_length=10,
+        choices=STATUSES,
+        default=QUEUED,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='Попыток',
+        default=0,
+    )
+    max_attempts = models.PositiveSmallIntegerField(
+        verbose_name='Предел попыток',
+    )
+    created = models.DateTimeField(
+        verbose_name='Поставлена',
+        default=timezone.now,
+    )
+    run_at = models.DateTimeField(
+        verbose_name='Запустить после',
+        default=timezone.now,
+    )
+    started = models.DateTimeField(
+        verbose_name='Начата',
+        null=True,
+        blank=True,
+    )
+    finished = models.DateTimeField(
+        verbose_name='Завершена',
+        null=True,
+        blank=True,
+    )
+    worker = models.CharField(
+        verbose_name='Обработчик',
+        max_length=200,
+        blank=True,
+    )
+    error = models.TextField(
+        verbose_name='Последняя ошибка',
+        blank=True,
+    )
+
+    class Meta:
+        verbose_name = 'фоновая задача'
+        verbose_name_plural = 'фоновые задачи'
+        ordering = ('-created',)
+        indexes = [
+            models.Index(fields=['status', 'run_at'],
+                         name='job_status_run_at_idx'),
+        ]
+        constraints = [
+            # повторы упавшей задачи не мешают поставить её заново
+            UniqueConstraint(fields=['name', 'key'],
+                             condition=Q(status='queued', attempts=0)
+                             & ~Q(key=''),
+                             name='unique_queued_job'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
+
+
+class Email(models.Model):
+    """Письмо в очереди core.mail: его отправляет фоновая задача,
+    а не запрос, который его написал."""
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'в очереди'),
+        (SENDING, 'отправляется'),
+        (SENT, 'отправлено'),
+        (FAILED, 'не отправлено'),
+    )
+    to = models.TextField(
+        verbose_name='Кому',
+    )
+    subject = models.TextField(
+        verbose_name='Тема',
+    )
+    message = models.TextField(
+        verbose_name='Письмо (JSON)',
+    )
+    status = models.CharField(
+        verbose_name='Состояние',
+        max_length=10,
+        choices=STATUSES,
+        default=QUEUED,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='Попыток',
+        default=0,
+    )
+    created = models.DateTimeField(
+        verbose_name='Поставлено',
+        default=timezone.now,
+    )
+    claimed = models.DateTimeField(
+        verbose_name='Взято в отправку',
+        null=True,
+        blank=True,
+    )
+    sent = models.DateTimeField(
+        verbose_name='Отправлено',
+        null=True,
+        blank=True,
+    )
+    worker = models.CharField(
+        verbose_name='Обработчик',
+        max_length=200,
+        blank=True,
+    )
+    error = models.TextField(
+        verbose_name='Последняя ошибка',
+        blank=True,
+    )
+
+    class Meta:
+        verbose_name = 'письмо'
+        verbose_name_plural = 'исходящие письма'
+        ordering = ('-created',)
+        indexes = [
+            models.Index(fields=['status', 'created'],
+                         name='email_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} → {self.to}'
@@ -0,0 +1,23 @@
+"""Пулы процессов для команд управления.
+
+Процесс, запущенный через spawn (macOS, Windows), начинает с чистого
+листа: Django в нём не настроен, и первая же задача с ORM падает.
+Поэтому каждый процесс пула сначала вызывает django.setup(). Модуль не
+импортирует модели: пул загружает его в процессе раньше, чем настроен
+Django.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import connections
+
+
+def setup_process():
+    django.setup()
+
+
+def process_pool(workers):
+    """ProcessPoolExecutor, в процессах которого работает ORM."""
+    # дочерние процессы не должны делить соединение родителя
+    connections.close_all()
+    return ProcessPoolExecutor(workers, initializer=setup_process)
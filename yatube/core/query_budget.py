@@ -0,0 +1,98 @@
+"""Бюджет SQL-запросов на представление.
+
+query_budget — контекстный менеджер и декоратор для тестов,
+QueryBudgetMiddleware — учёт запросов по имени URL в работающем проекте.
+Бюджеты задаются в settings.QUERY_BUDGETS: {'posts:index': 6, ...}.
+"""
+import logging
+from collections import defaultdict
+from contextlib import ContextDecorator
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    """Считает запросы через execute_wrapper, поэтому работает и без DEBUG."""
+
+    def __init__(self):
+        self.count = 0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+
+class query_budget(ContextDecorator):
+    """Падает с QueryBudgetExceeded, если внутри блока выполнено
+    больше max_queries запросов."""
+
+    def __init__(self, max_queries, using='default'):
+        self.max_queries = max_queries
+        self.using = using
+
+    def __enter__(self):
+        self.counter = QueryCounter()
+        self._wrapper = connections[self.using].execute_wrapper(self.counter)
+        self._wrapper.__enter__()
+        return self.counter
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and self.counter.count > self.max_queries:
+            raise QueryBudgetExceeded(
+                f'{self.counter.count} queries executed, '
+                f'budget is {self.max_queries}:\n'
+                + '\n'.join(self.counter.queries)
+            )
+        return False
+
+
+# имя URL -> счётчики запросов по всем обработанным запросам
+stats = defaultdict(
+    lambda: dict.fromkeys(('requests', 'queries', 'max', 'exceeded'), 0))
+
+
+class QueryBudgetMiddleware:
+    """Записывает число запросов на каждое имя URL и сверяет его
+    с бюджетом из settings.QUERY_BUDGETS.
+
+    При QUERY_BUDGET_RAISE превышение бюджета — исключение,
+    иначе предупреждение в лог.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        self.raise_exceeded = getattr(settings, 'QUERY_BUDGET_RAISE', False)
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with connections['default'].execute_wrapper(counter):
+            response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return response
+        view_name = match.view_name
+        record = stats[view_name]
+        record['requests'] += 1
+        record['queries'] += counter.count
+        record['max'] = max(record['max'], counter.count)
+        budget = self.budgets.get(view_name)
+        if budget is not None and counter.count > budget:
+            record['exceeded'] += 1
+            message = (f'{view_name}: {counter.count} queries, '
+                       f'budget is {budget}')
+            if self.raise_exceeded:
+                raise QueryBudgetExceeded(
+                    message + ':\n' + '\n'.join(counter.queries))
+            logger.warning(message)
+        return response
@@ -1,4 +1,73 @@
-from django.test import Client, TestCase
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from functools import partial
+from io import StringIO
+from multiprocessing import get_context
+from unittest import mock
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail as outbox
+from django.core.cache import cache
+from django.core.mail import send_mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db import transaction
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import jobs, mail, pools, timing
+from .cache import TieredCache
+from .models import Email, Job, ViewTiming
+from .query_budget import QueryBudgetExceeded, query_budget, stats
+
+User = get_user_model()
+# аргументы, с которыми очередь вызвала record_call
+CALLS = []
+
+
+@jobs.task(max_attempts=2)
+def record_call(value):
+    CALLS.append(value)
+
+
+@jobs.task(max_attempts=2)
+def broken():
+    raise ValueError('сломано')
+
+
+def apps_ready():
+    return apps.ready
+
+
+BAD_ADDRESS = 'bad@example.com'
+
+
+class CountingBackend(locmem.EmailBackend):
+    """Почта в памяти, считающая открытые соединения; не принимает
+    адрес BAD_ADDRESS."""
+    opened = 0
+
+    def open(self):
+        CountingBackend.opened += 1
+
+    def send_messages(self, messages):
+        if any(BAD_ADDRESS in message.to for message in messages):
+            raise ConnectionError('адрес не принят')
+        return super().send_messages(messages)
+
+
+OUTBOX_SETTINGS = dict(
+    EMAIL_BACKEND='core.mail.OutboxBackend',
+    OUTBOX_EMAIL_BACKEND='core.tests.CountingBackend',
+    OUTBOX_BATCH_SIZE=2,
+)
 
 
 class CoreViewTest(TestCase):
@@ -13,3 +82,300 @@ class CoreViewTest(TestCase):
             with self.subTest(url=url):
                 response = self.guest_client.get(url)
                 self.assertTemplateUsed(response, template)
+
+
+class QueryBudgetTest(TestCase):
+    def test_query_budget_exceeded(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(1):
+                User.objects.count()
+                User.objects.exists()
+
+    @override_settings(QUERY_BUDGETS={'posts:group_list': 0},
+                       QUERY_BUDGET_RAISE=True)
+    def test_middleware_enforces_budget(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            Client().get('/group/missing/')
+        self.assertEqual(stats['posts:group_list']['exceeded'], 1)
+
+
+class TieredCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = os.path.join(directory.name, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        options.setdefault('L1_MAX_ENTRIES', 2)
+        options.setdefault('L1_SKIP_PREFIXES', ('generation',))
+        return TieredCache(self.location, {'OPTIONS': options})
+
+    def test_l1_is_lru_and_l2_is_shared(self):
+        other = self.make_cache()
+        for key in ('a:1', 'a:2', 'a:3'):
+            self.cache.set(key, {'key': key})
+        self.assertEqual(len(self.cache._l1), 2)
+        self.assertEqual(other.get('a:1'), {'key': 'a:1'})
+        self.assertEqual(other.get('a:3'), {'key': 'a:3'})
+        other.delete('a:3')
+        self.assertIsNone(self.make_cache().get('a:3'))
+
+    def test_skipped_prefixes_bypass_l1(self):
+        other = self.make_cache()
+        self.cache.set('generation:all', 1)
+        self.assertEqual(other.get('generation:all'), 1)
+        self.assertEqual(self.cache.incr('generation:all'), 2)
+        self.assertEqual(other.get('generation:all'), 2)
+        self.assertNotIn(self.cache.make_key('generation:all'), other._l1)
+
+    def test_expired_values_are_misses(self):
+        self.cache.set('a:1', 'value', 0.01)
+        time.sleep(0.05)
+        self.assertIsNone(self.make_cache().get('a:1'))
+        self.assertTrue(self.cache.add('a:1', 'new'))
+        self.assertFalse(self.cache.add('a:1', 'newer'))
+        self.assertEqual(self.cache.get('a:1'), 'new')
+
+    def test_get_or_set_computes_once(self):
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'page'
+
+        def worker():
+            results.append(self.make_cache().get_or_set('page:1', compute))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['page'] * 4)
+
+    def test_stats_by_prefix(self):
+        self.cache.set('post:1', 1)
+        self.cache.get('post:1')
+        other = self.make_cache()
+        other.get('post:1')
+        other.flush_stats()
+        self.cache.get('post:2')
+        self.cache.get('feed:1')
+        stats = self.cache.stats()
+        self.assertEqual(
+            stats['post'], {'l1_hits': 1, 'l2_hits': 1, 'misses': 1})
+        self.assertEqual(stats['feed']['misses'], 1)
+        out = StringIO()
+        with mock.patch(
+                'core.management.commands.cache_stats.cache', self.cache):
+            call_command('cache_stats', '--reset', stdout=out)
+        self.assertIn('post', out.getvalue())
+        self.assertEqual(self.cache.stats(), {})
+
+
+class ProcessPoolTest(SimpleTestCase):
+    def test_spawned_processes_set_up_django(self):
+        spawn = partial(ProcessPoolExecutor, mp_context=get_context('spawn'))
+        with mock.patch('core.pools.ProcessPoolExecutor', spawn):
+            with pools.process_pool(1) as pool:
+                self.assertTrue(pool.submit(apps_ready).result())
+
+
+class ServerTimingTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+        cls.user = User.objects.create_user(username='user')
+
+    def setUp(self):
+        cache.clear()
+        # замеры прошлых тестов не должны попасть в эту базу
+        timing.recorder.flush()
+        ViewTiming.objects.all().delete()
+
+    def server_timing(self, response):
+        return dict(
+            metric.split(';', 1)
+            for metric in response['Server-Timing'].split(', '))
+
+    def test_header_reports_db_templates_and_cache(self):
+        metrics = self.server_timing(Client().get('/'))
+        self.assertEqual(
+            set(metrics), {'total', 'db', 'tpl', 'cache'})
+        self.assertRegex(metrics['db'], r'dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertNotEqual(metrics['tpl'], 'dur=0.0')
+        # вторую страницу отдаёт кэш лент без отрисовки шаблонов
+        metrics = self.server_timing(Client().get('/'))
+        self.assertEqual(metrics['tpl'], 'dur=0.0')
+        self.assertNotIn('hits=0', metrics['cache'])
+
+    def test_histograms_are_aggregated_per_view(self):
+        for _ in range(3):
+            Client().get('/about/tech/')
+        Client().get('/missing/page/')
+        timing.recorder.flush()
+        summary = {view['view_name']: view for view in timing.summarize(
+            ViewTiming.objects.all())}
+        self.assertEqual(summary['about:tech']['requests'], 3)
+        self.assertEqual(
+            sum(count for _, count, _ in summary['about:tech']['histogram']),
+            3)
+        self.assertIn('unresolved', summary)
+
+    def test_admin_page_is_staff_only(self):
+        url = reverse('admin:core_viewtiming_changelist')
+        client = Client()
+        client.force_login(self.user)
+        self.assertEqual(client.get(url).status_code, 302)
+        client.force_login(self.staff)
+        client.get('/about/author/')
+        response = client.get(url)
+        self.assertContains(response, 'about:author')
+        self.assertNotContains(response, 'Сбросить замеры')
+        self.assertEqual(client.post(url).status_code, 403)
+        client.force_login(User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass'))
+        self.assertEqual(client.post(url).status_code, 302)
+        self.assertFalse(ViewTiming.objects.exists())
+
+    def test_percentile_uses_bucket_bounds(self):
+        counts = [0] * (len(timing.BUCKETS) + 1)
+        counts[0], counts[3], counts[-1] = 90, 9, 1
+        self.assertEqual(timing.percentile(counts, 50), 0)
+        self.assertEqual(timing.percentile(counts, 95), 3)
+        self.assertEqual(timing.percentile(counts, 100), len(counts) - 1)
+
+
+@override_settings(JOB_RETRY_DELAY=10)
+class JobQueueTest(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_enqueue_deduplicates_by_key(self):
+        self.assertIsNotNone(jobs.enqueue(record_call, 1, key='one'))
+        self.assertIsNone(jobs.enqueue(record_call, 1, key='one'))
+        self.assertIsNotNone(jobs.enqueue(record_call, 1))
+        with transaction.atomic():
+            jobs.enqueue(record_call, 2, key='two')
+            transaction.set_rollback(True)
+        self.assertEqual(Job.objects.count(), 2)
+        with self.assertRaises(ValueError):
+            jobs.enqueue(print, 1)
+
+    def test_enqueue_many_skips_queued_keys(self):
+        jobs.enqueue(record_call, 1, key='one')
+        jobs.enqueue_many(record_call, {'one': [1], 'two': [2]})
+        self.assertEqual(
+            sorted(Job.objects.values_list('key', 'args')),
+            [('one', '[1]'), ('two', '[2]')])
+
+    def test_claimed_jobs_are_not_claimed_again(self):
+        for value in range(3):
+            jobs.enqueue(record_call, value)
+        first = jobs.claim('first', 2)
+        second = jobs.claim('second', 5)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertEqual(jobs.claim('third', 5), [])
+        self.assertEqual({job.attempts for job in first + second}, {1})
+        for job in first + second:
+            self.assertTrue(jobs.perform(job))
+        self.assertEqual(sorted(CALLS), [0, 1, 2])
+
+    def test_failed_job_is_retried_with_backoff(self):
+        jobs.enqueue(broken)
+        [job] = jobs.claim('worker', 1)
+        started = timezone.now()
+        self.assertFalse(jobs.perform(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('ValueError', job.error)
+        delay = (job.run_at - started).total_seconds()
+        self.assertTrue(9 < delay < 16)
+        self.assertEqual(jobs.claim('worker', 1), [])
+        Job.objects.update(run_at=timezone.now())
+        [job] = jobs.claim('worker', 1)
+        jobs.perform(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_stale_jobs_are_recovered(self):
+        jobs.enqueue(record_call, 1)
+        jobs.claim('lost', 1)
+        Job.objects.update(started=timezone.now() - timedelta(
+            seconds=settings.JOB_TIMEOUT + 1))
+        jobs.recover()
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.worker), (Job.QUEUED, ''))
+
+    def test_run_workers_command_reports_metrics(self):
+        for value in range(3):
+            jobs.enqueue(record_call, value)
+        out = StringIO()
+        call_command('run_workers', '--workers', '1', '--once', stdout=out)
+        self.assertEqual(CALLS, [0, 1, 2])
+        self.assertIn('Выполнено задач: 3', out.getvalue())
+        self.assertIn('done — 3', out.getvalue())
+        self.assertIn('Выполнение, с: p50', out.getvalue())
+        stats = jobs.stats()
+        self.assertEqual(stats['depth'][Job.QUEUED], 0)
+        self.assertEqual(stats['lag'], 0.0)
+
+
+@override_settings(**OUTBOX_SETTINGS)
+class OutboxTest(TestCase):
+    def setUp(self):
+        CountingBackend.opened = 0
+
+    def send(self, *addresses):
+        for address in addresses:
+            send_mail('Тема', 'Текст', 'from@example.com', [address])
+
+    def test_mail_is_queued_and_sent_over_one_connection(self):
+        self.send('a@example.com', 'b@example.com', 'c@example.com')
+        self.assertEqual(outbox.outbox, [])
+        self.assertEqual(Email.objects.filter(
+            status=Email.QUEUED).count(), 3)
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 1)
+        jobs.work('worker', batch_size=10, poll=0,
+                  stop=threading.Event(), once=True)
+        self.assertEqual(sorted(message.to[0] for message in outbox.outbox),
+                         ['a@example.com', 'b@example.com', 'c@example.com'])
+        self.assertEqual(outbox.outbox[0].body, 'Текст')
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertEqual(Email.objects.filter(
+            status=Email.SENT).count(), 3)
+
+    def test_failed_message_is_retried_then_given_up(self):
+        self.send('a@example.com', BAD_ADDRESS, 'c@example.com')
+        with self.assertRaises(ConnectionError):
+            mail.send_outbox()
+        statuses = dict(Email.objects.values_list('to', 'status'))
+        self.assertEqual(statuses, {
+            'a@example.com': Email.SENT,
+            BAD_ADDRESS: Email.QUEUED,
+            'c@example.com': Email.QUEUED,
+        })
+        for _ in range(settings.OUTBOX_MAX_ATTEMPTS - 1):
+            with self.assertRaises(ConnectionError):
+                mail.send_outbox()
+        bad = Email.objects.get(to=BAD_ADDRESS)
+        self.assertEqual(bad.status, Email.FAILED)
+        self.assertIn('адрес не принят', bad.error)
+        self.assertEqual(mail.send_outbox(), 1)
+        self.assertEqual(len(outbox.outbox), 2)
+
+    def test_password_reset_mail_is_queued(self):
+        User.objects.create_user(
+            username='user', email='user@example.com', password='pass')
+        response = self.client.post(
+            reverse('users:reset'), {'email': 'user@example.com'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(outbox.outbox, [])
+        mail.send_outbox()
+        self.assertEqual(outbox.outbox[0].to, ['user@example.com'])
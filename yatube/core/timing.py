@@ -0,0 +1,250 @@
+"""Замеры каждого запроса: заголовок Server-Timing и гистограммы
+времени ответа по представлениям.
+
+ServerTimingMiddleware измеряет полное время ответа, время и число
+SQL-запросов, время отрисовки шаблонов (бэкенд TimedTemplates) и
+попадания в кэш (TieredCache сообщает их через record_cache). Замеры
+копятся в памяти процесса и раз в SERVER_TIMING_FLUSH_INTERVAL секунд
+фоновый поток добавляет их в таблицу core.ViewTiming — поэтому на
+странице администратора видны данные всех процессов, а сам запрос
+не делает лишних обращений к базе.
+"""
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+# верхние границы корзин гистограммы, мс; последняя корзина — всё больше
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+FIELDS = ('requests', 'total_time', 'db_time', 'template_time',
+          'queries', 'cache_hits', 'cache_misses')
+
+_local = threading.local()
+
+
+class Metrics:
+    __slots__ = ('queries', 'db_time', 'template_time', 'template_depth',
+                 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.queries = self.cache_hits = self.cache_misses = 0
+        self.db_time = self.template_time = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+
+def current():
+    return getattr(_local, 'metrics', None)
+
+
+def record_cache(hit):
+    metrics = current()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+
+def bucket_of(milliseconds):
+    return bisect.bisect_left(BUCKETS, milliseconds)
+
+
+class Recorder:
+    """Суммы замеров процесса по (представление, корзина)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(lambda: dict.fromkeys(FIELDS, 0))
+        self._thread = None
+
+    def add(self, view_name, total, metrics):
+        with self._lock:
+            row = self._pending[view_name, bucket_of(total * 1000)]
+            row['requests'] += 1
+            row['total_time'] += total * 1000
+            row['db_time'] += metrics.db_time * 1000
+            row['template_time'] += metrics.template_time * 1000
+            row['queries'] += metrics.queries
+            row['cache_hits'] += metrics.cache_hits
+            row['cache_misses'] += metrics.cache_misses
+        self._start()
+
+    def _start(self):
+        interval = getattr(settings, 'SERVER_TIMING_FLUSH_INTERVAL', 10)
+        if self._thread is not None or not interval:
+            return
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # общая база в памяти (тесты) не ждёт блокировок
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, args=(interval,), daemon=True,
+                    name='server-timing-flush')
+                self._thread.start()
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Не удалось сохранить замеры запросов')
+            finally:
+                connections.close_all()
+
+    def flush(self):
+        """Добавляет накопленное к строкам ViewTiming."""
+        from .models import ViewTiming
+
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(
+                lambda: dict.fromkeys(FIELDS, 0))
+        if not pending:
+            return
+        with transaction.atomic():
+            ViewTiming.objects.bulk_create(
+                [ViewTiming(view_name=view_name, bucket=bucket)
+                 for view_name, bucket in pending],
+                ignore_conflicts=True,
+            )
+            for (view_name, bucket), row in pending.items():
+                ViewTiming.objects.filter(
+                    view_name=view_name, bucket=bucket,
+                ).update(**{field: F(field) + value
+                            for field, value in row.items()})
+
+
+recorder = Recorder()
+
+
+class ServerTimingMiddleware:
+    """Должен стоять первым: тогда в замер попадают все остальные
+    промежуточные слои."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = _local.metrics = Metrics()
+        started = time.perf_counter()
+        try:
+            with connections['default'].execute_wrapper(metrics):
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+        total = time.perf_counter() - started
+        response['Server-Timing'] = ', '.join((
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={metrics.db_time * 1000:.1f};'
+            f'desc="{metrics.queries} queries"',
+            f'tpl;dur={metrics.template_time * 1000:.1f}',
+            f'cache;desc="hits={metrics.cache_hits} '
+            f'misses={metrics.cache_misses}"',
+        ))
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match is not None else 'unresolved'
+        recorder.add(view_name, total, metrics)
+        return response
+
+
+class Template:
+    """Шаблон, который засчитывает время отрисовки текущему запросу;
+    вложенные отрисовки уже входят во внешнюю."""
+
+    def __init__(self, template):
+        self.timed = template
+
+    def __getattr__(self, name):
+        # origin, template и прочее — как у обёрнутого шаблона
+        return getattr(self.timed, name)
+
+    def render(self, context=None, request=None):
+        metrics = current()
+        if metrics is None:
+            return self.timed.render(context, request)
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return self.timed.render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+
+class TimedTemplates(DjangoTemplates):
+    """DjangoTemplates, чьи шаблоны учитываются в Server-Timing."""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name))
+
+
+def bucket_label(bucket):
+    if bucket < len(BUCKETS):
+        return f'≤ {BUCKETS[bucket]} мс'
+    return f'> {BUCKETS[-1]} мс'
+
+
+def summarize(rows):
+    """Сводка по представлениям из строк ViewTiming: средние значения,
+    перцентили с точностью до корзины и гистограмма."""
+    views = defaultdict(list)
+    for row in rows:
+        views[row.view_name].append(row)
+    summary = []
+    for view_name, view_rows in sorted(views.items()):
+        totals = {field: sum(getattr(row, field) for row in view_rows)
+                  for field in FIELDS}
+        requests = totals['requests'] or 1
+        counts = [0] * (len(BUCKETS) + 1)
+        for row in view_rows:
+            counts[row.bucket] += row.requests
+        lookups = totals['cache_hits'] + totals['cache_misses']
+        summary.append(dict(
+            view_name=view_name,
+            requests=totals['requests'],
+            mean=totals['total_time'] / requests,
+            db_time=totals['db_time'] / requests,
+            template_time=totals['template_time'] / requests,
+            queries=totals['queries'] / requests,
+            cache_ratio=(100 * totals['cache_hits'] / lookups
+                         if lookups else None),
+            percentiles={
+                f'p{percent}': bucket_label(percentile(counts, percent))
+                for percent in (50, 95, 99)},
+            histogram=[(bucket_label(bucket), count,
+                        100 * count / max(counts))
+                       for bucket, count in enumerate(counts)],
+        ))
+    return summary
+
+
+def percentile(counts, percent):
+    """Корзина, в которую попадает percent-й перцентиль."""
+    rank = sum(counts) * percent / 100
+    seen = 0
+    for bucket, count in enumerate(counts):
+        seen += count
+        if seen >= rank:
+            return bucket
+    return len(counts) - 1
@@ -1,5 +1,8 @@
 from django.contrib import admin
 
+from core.fts import quote_query
+
+from . import search
 from .models import Comment, Follow, Group, Post
 
 
@@ -10,6 +13,14 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        """Ищет по индексу FTS5 вместо LIKE по всей таблице."""
+        query = quote_query(search_term)
+        if not query or not search.available():
+            return super().get_search_results(
+                request, queryset, search_term)
+        return queryset.filter(pk__in=search.matching(search_term)), False
+
 
 admin.site.register(Group)
 
@@ -0,0 +1,208 @@
+"""Автодополнение имён пользователей и групп по префиксу.
+
+Индекс — отсортированный список (ключ, вид, pk) в памяти процесса,
+поиск — bisect по префиксу. Ключи — имя пользователя, имя, фамилия и
+полное имя автора, слаг, название и слова названия группы без учёта
+регистра и «ё».
+
+Индекс строится при старте процесса (warm из yatube/wsgi.py), а не в
+первом запросе, и дальше обновляется сигналами после фиксации
+транзакции: меняются только ключи изменённой записи. Каждое изменение
+увеличивает общий счётчик поколения в кэше: процесс, который пропустил
+чужое изменение, видит расхождение поколений и перестраивает индекс
+из базы.
+"""
+import bisect
+import logging
+import sys
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.urls import reverse
+
+from .models import Group, User
+
+GENERATION_KEY = 'autocomplete_generation'
+USER, GROUP = 'user', 'group'
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text):
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def user_item(username, first_name, last_name):
+    full_name = ' '.join(filter(None, (first_name, last_name)))
+    terms = {username, first_name, last_name, full_name}
+    return username, full_name, terms
+
+
+def group_item(slug, title):
+    terms = {slug, title, *title.split()}
+    return slug, title, terms
+
+
+def deep_size(value, seen=None):
+    """Размер объекта вместе с вложенными; общие объекты — один раз."""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key, seen) + deep_size(item, seen)
+                    for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in value)
+    return size
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = []
+        # (вид, pk) -> (значение, подпись, ключи)
+        self._items = {}
+        self.generation = None
+        self.build_time = None
+
+    def current_generation(self):
+        generation = cache.get(GENERATION_KEY)
+        if generation is None:
+            cache.add(GENERATION_KEY, time.time_ns(), None)
+            generation = cache.get(GENERATION_KEY)
+        return generation
+
+    def invalidate(self):
+        """После изменений в обход сигналов индекс перестроят
+        все процессы."""
+        cache.delete(GENERATION_KEY)
+
+    def ensure_fresh(self):
+        generation = self.current_generation()
+        if generation != self.generation:
+            with self._lock:
+                if generation != self.generation:
+                    self.rebuild(generation)
+
+    def warm(self):
+        """Строит индекс до первого запроса. Если база ещё не готова,
+        индекс построит первый запрос."""
+        try:
+            self.ensure_fresh()
+        except DatabaseError:
+            logger.warning('Индекс автодополнения не построен при старте',
+                           exc_info=True)
+
+    def rebuild(self, generation):
+        # поколение прочитано до запросов: изменение во время построения
+        # снова разойдётся с ним и вызовет ещё одно построение
+        started = time.perf_counter()
+        items = {}
+        users = User.objects.values_list(
+            'pk', 'username', 'first_name', 'last_name')
+        for pk, *fields in users.iterator():
+            items[USER, pk] = user_item(*fields)
+        groups = Group.objects.values_list('pk', 'slug', 'title')
+        for pk, *fields in groups.iterator():
+            items[GROUP, pk] = group_item(*fields)
+        entries = [(term, *ref)
+                   for ref, (_, _, terms) in items.items()
+                   for term in self._terms(terms)]
+        entries.sort()
+        self._entries, self._items = entries, items
+        self.generation = generation
+        self.build_time = time.perf_counter() - started
+
+    @staticmethod
+    def _terms(terms):
+        return {normalize(term) for term in terms if term} - {''}
+
+    def _remove(self, ref):
+        item = self._items.pop(ref, None)
+        if item is None:
+            return
+        for term in self._terms(item[2]):
+            entry = (term, *ref)
+            position = bisect.bisect_left(self._entries, entry)
+            if (position < len(self._entries)
+                    and self._entries[position] == entry):
+                del self._entries[position]
+
+    def _put(self, ref, item):
+        self._remove(ref)
+        self._items[ref] = item
+        for term in self._terms(item[2]):
+            bisect.insort(self._entries, (term, *ref))
+
+    def _apply(self, change):
+        """Применяет изменение и сдвигает поколение; если сдвиг
+        не на единицу, значит, пропущены чужие изменения."""
+        with self._lock:
+            if self.generation is not None:
+                change()
+            try:
+                generation = cache.incr(GENERATION_KEY)
+            except ValueError:
+                generation = None
+            if (self.generation is not None and generation is not None
+                    and generation == self.generation + 1):
+                self.generation = generation
+            else:
+                self.generation = None
+
+    def put_user(self, user):
+        self._apply(lambda: self._put((USER, user.pk), user_item(
+            user.username, user.first_name, user.last_name)))
+
+    def put_group(self, group):
+        self._apply(lambda: self._put(
+            (GROUP, group.pk), group_item(group.slug, group.title)))
+
+    def remove(self, kind, pk):
+        self._apply(lambda: self._remove((kind, pk)))
+
+    def search(self, text, limit):
+        """До limit подсказок, ключ которых начинается с text."""
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        self.ensure_fresh()
+        with self._lock:
+            entries, items = self._entries, self._items
+            position = bisect.bisect_left(entries, (prefix,))
+            found = []
+            while len(found) < limit and position < len(entries):
+                term, *ref = entries[position]
+                if not term.startswith(prefix):
+                    break
+                ref = tuple(ref)
+                if ref not in found:
+                    found.append(ref)
+                position += 1
+            return [self.suggestion(ref, items[ref]) for ref in found]
+
+    @staticmethod
+    def suggestion(ref, item):
+        kind, _ = ref
+        value, label, _ = item
+        url = reverse('posts:profile' if kind == USER else
+                      'posts:group_list', args=[value])
+        return dict(type=kind, value=value, label=label, url=url)
+
+    def stats(self):
+        with self._lock:
+            kinds = [kind for kind, _ in self._items]
+            return dict(
+                entries=len(self._entries),
+                users=kinds.count(USER),
+                groups=kinds.count(GROUP),
+                bytes=deep_size((self._entries, self._items)),
+                build_time=self.build_time,
+            )
+
+
+index = PrefixIndex()
@@ -0,0 +1,51 @@
+"""Массовая загрузка в обход сигналов: bulk_import и generate_dataset,
+и общий для загрузки и выгрузки порядок моделей дампа."""
+from contextlib import contextmanager
+
+from django.core.management import call_command
+from django.db import connection
+
+from . import autocomplete, feed_cache
+from .models import Comment, Follow, Group, Post, User
+
+# порядок загрузки: каждая модель ссылается только на загруженные раньше
+STAGES = {
+    'auth.user': User,
+    'posts.group': Group,
+    'posts.post': Post,
+    'posts.comment': Comment,
+    'posts.follow': Follow,
+}
+
+
+def batch_size(model, requested):
+    """Django 2.2 передаёт заданный batch_size базе как есть, а SQLite
+    ограничивает и число параметров, и число строк одного INSERT."""
+    fields = model._meta.concrete_fields
+    return min(requested, connection.ops.bulk_batch_size(
+        fields, range(requested)))
+
+
+@contextmanager
+def keep_dates(models):
+    """bulk_create вызывает pre_save полей, и auto_now_add заменил бы
+    даты загружаемых записей текущим временем."""
+    fields = [field for model in models
+              for field in model._meta.concrete_fields
+              if getattr(field, 'auto_now_add', False)]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def rebuild_derived(stdout):
+    """Счётчики, ленты подписок и кэши, которые обычно ведут сигналы;
+    поисковый индекс обновляют триггеры базы."""
+    call_command('reconcile_counters', stdout=stdout)
+    call_command('rebuild_timelines', stdout=stdout)
+    feed_cache.bump('all', 'names', 'follows')
+    autocomplete.index.invalidate()
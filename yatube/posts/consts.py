@@ -1,3 +1,38 @@
 LIMIT_POSTS: int = 10  # лимит постов на странице
+LIMIT_COMMENTS: int = 20  # комментариев в одной пачке на странице поста
+COMMENTS_ORDERING: tuple = ('-created', '-id')  # ключ курсора комментариев
 POST_LENGTH: int = 15  # длина текста поста
 COMMENT_LENGTH: int = 200  # длина текста комментария
+POSTS_KEYSET: bool = True  # курсорная паджинация лент по умолчанию
+KEYSET_AFTER_PAGE: int = 10  # с этой номерной страницы дальше по курсору
+KEYSET_ORDERING: tuple = ('-pub_date', '-id')  # ключ курсора ленты
+PAGINATOR_ON_EACH_SIDE: int = 3  # номеров страниц по бокам от текущей
+PAGINATOR_ON_ENDS: int = 2  # номеров страниц в начале и в конце списка
+TIMELINE_BATCH_SIZE: int = 1000  # размер пачки при заполнении лент
+COUNTERS_BATCH_SIZE: int = 1000  # размер пачки при пересчёте счётчиков
+SEARCH_BATCH_SIZE: int = 1000  # постов в одной транзакции индексации
+POST_CARD_TIMEOUT: int = 60 * 60 * 24  # время жизни карточки поста в кэше
+POST_CARD_TEMPLATES: dict = {  # шаблоны карточек поста для лент
+    'feed': 'includes/description.html',
+    'profile': 'includes/profile_card.html',
+}
+FEED_CACHE_TIMEOUT: int = 60 * 60 * 6  # время жизни страницы ленты
+THUMBNAIL_WIDTHS: tuple = (480, 720, 960)  # ширины вариантов миниатюры
+THUMBNAIL_RATIO: float = 339 / 960  # отношение высоты миниатюры к ширине
+THUMBNAIL_OPTIONS: dict = {'crop': 'center', 'upscale': True}  # для sorl
+THUMBNAIL_QUEUE_TIMEOUT: int = 60 * 10  # пауза между постановками в очередь
+THUMBNAIL_PENDING_TIMEOUT: int = 60  # карточка без миниатюр в кэше
+IMAGE_MAX_PIXELS: int = 50 * 1000 * 1000  # предел пикселей по заголовку
+IMAGE_MAX_SIDE: int = 2560  # наибольшая сторона сохраняемой картинки
+IMAGE_MAX_DECODED: int = 96 * 1024 * 1024  # память под пиксели картинки
+IMAGE_JPEG_QUALITY: int = 85  # качество пересохранённых JPEG
+IMAGE_SPOOL_SIZE: int = 1024 * 1024  # сколько результата держать в памяти
+IMAGE_RELEASE_GRACE: int = 60 * 60  # не удалять файл после загрузки, с
+AUTOCOMPLETE_LIMIT: int = 10  # подсказок в ответе автодополнения
+IMPORT_BATCH_SIZE: int = 1000  # строк в одном INSERT при загрузке дампа
+IMPORT_TRANSACTION_SIZE: int = 20000  # записей дампа в одной транзакции
+EXPORT_CHUNK_SIZE: int = 2000  # строк, читаемых из базы за раз при выгрузке
+DIGEST_CHUNK_SIZE: int = 500  # подписчиков в одной пачке дайджестов
+DIGEST_MAX_POSTS: int = 20  # постов в одном письме дайджеста
+DIGEST_TEXT_LENGTH: int = 200  # символов текста поста в дайджесте
+FOLLOW_SET_TIMEOUT: int = 60 * 60 * 24  # время жизни подписок в кэше
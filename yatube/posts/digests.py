@@ -0,0 +1,102 @@
+"""Письма с новыми постами авторов для подписчиков, включивших их.
+
+Публикация поста ничего не рассылает: у автора могут быть десятки
+тысяч подписчиков. send_digests, запускаемая периодически, проходит
+подписчиков с включёнными письмами пачками по DIGEST_CHUNK_SIZE и
+пишет каждому одно письмо со всеми постами, вышедшими после
+Follow.notified. Письма пачки и сдвиг notified сохраняются одной
+транзакцией, поэтому прерванный проход ничего не потеряет и не
+пришлёт дважды.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Substr
+from django.template.loader import get_template
+from django.urls import reverse
+from django.utils import timezone
+
+from .consts import DIGEST_CHUNK_SIZE, DIGEST_MAX_POSTS, DIGEST_TEXT_LENGTH
+from .models import Follow, Post, User
+
+
+def subscribers(chunk_size):
+    """Пачки id подписчиков, включивших письма хотя бы по одному
+    автору."""
+    last = 0
+    while True:
+        chunk = list(Follow.objects.filter(
+            notify=True, user_id__gt=last).order_by('user_id').values_list(
+                'user_id', flat=True).distinct()[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
+
+
+def new_posts(users, until):
+    """Подписчик -> новые посты его авторов, от свежих к старым."""
+    posts = Post.objects.filter(
+        # условия в одном filter относятся к одной подписке
+        author__following__user_id__in=users,
+        author__following__notify=True,
+        author__following__notified__lt=F('pub_date'),
+        pub_date__lte=until,
+    ).values(
+        'id', 'pub_date', 'author__username',
+        user=F('author__following__user_id'),
+        snippet=Substr('text', 1, DIGEST_TEXT_LENGTH),
+    ).order_by('-pub_date', '-id')
+    result = defaultdict(list)
+    for post in posts:
+        result[post['user']].append(post)
+    return result
+
+
+def compose(user, posts, templates):
+    """Письмо подписчику; шаблоны загружаются один раз на проход."""
+    subject, body = templates
+    for post in posts:
+        post['text'] = post['snippet']
+        if len(post['snippet']) == DIGEST_TEXT_LENGTH:
+            post['text'] += '…'
+        post['url'] = settings.SITE_URL + reverse(
+            'posts:post_detail', args=[post['id']])
+    context = dict(
+        user=user,
+        posts=posts[:DIGEST_MAX_POSTS],
+        more=max(len(posts) - DIGEST_MAX_POSTS, 0),
+        total=len(posts),
+        follow_url=settings.SITE_URL + reverse('posts:follow_index'),
+    )
+    return EmailMessage(
+        subject=' '.join(subject.render(context).split()),
+        body=body.render(context),
+        to=[user.email],
+    )
+
+
+def send_digests(chunk_size=DIGEST_CHUNK_SIZE):
+    """Пишет дайджесты всех подписчиков; возвращает число писем."""
+    until = timezone.now()
+    templates = (get_template('posts/email/digest_subject.txt'),
+                 get_template('posts/email/digest.txt'))
+    sent = 0
+    # с OutboxBackend письма пачки попадают в очередь одним INSERT
+    connection = get_connection()
+    for chunk in subscribers(chunk_size):
+        with transaction.atomic():
+            posts = new_posts(chunk, until)
+            users = User.objects.filter(
+                pk__in=list(posts)).exclude(email='').only(
+                    'username', 'first_name', 'last_name', 'email')
+            sent += connection.send_messages(
+                [compose(user, posts[user.pk], templates) for user in users])
+            # без адреса письмо не отправить, но и копить посты незачем
+            Follow.objects.filter(
+                user_id__in=chunk, notify=True, notified__lt=until,
+            ).update(notified=until)
+    return sent
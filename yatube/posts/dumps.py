@@ -0,0 +1,108 @@
+"""Потоковое чтение дампов.
+
+Запись дампа — {"model": ..., "pk": ..., "fields": {...}}. Дамп dumpdata
+— JSON-массив таких записей, выгрузка export_stream — NDJSON, по записи
+на строку; любой из них может быть сжат gzip. Записи разбираются
+по одной, поэтому в памяти одновременно лежат только одна запись
+и один блок файла.
+"""
+import gzip
+import json
+
+READ_CHUNK = 64 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class DumpError(ValueError):
+    pass
+
+
+class Reader:
+    """Окно по текстовому потоку, которое дочитывается по мере нужды."""
+
+    def __init__(self, stream, chunk_size, buffer=''):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = buffer
+        self.position = 0
+
+    def read_more(self):
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            raise DumpError('Дамп оборвался до конца массива.')
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+
+    def next_char(self):
+        """Первый символ после пробелов и запятых между записями."""
+        while True:
+            while (self.position < len(self.buffer)
+                   and self.buffer[self.position] in ' \t\r\n,'):
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            self.read_more()
+
+    def decode(self, decoder):
+        while True:
+            try:
+                value, self.position = decoder.raw_decode(
+                    self.buffer, self.position)
+                return value
+            except json.JSONDecodeError as error:
+                try:
+                    self.read_more()
+                except DumpError:
+                    raise DumpError(f'Ошибка в дампе: {error}') from error
+
+
+def open_dump(path):
+    """Текстовый поток дампа; сжатие gzip узнаётся по сигнатуре."""
+    with open(path, 'rb') as probe:
+        compressed = probe.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    if compressed:
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def iter_records(stream, chunk_size=READ_CHUNK):
+    """Записи дампа любого формата: JSON-массив начинается с «[»."""
+    head = ''
+    while not head.strip():
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        head += chunk
+    if head.lstrip().startswith('['):
+        yield from iter_array(stream, chunk_size, head)
+    else:
+        # дочитываем строку, на которой оборвался первый блок
+        head += stream.readline()
+        yield from iter_lines(head.splitlines(), stream)
+
+
+def iter_lines(*sources):
+    """Записи NDJSON по одной на строку; пустые строки пропускаются."""
+    number = 0
+    for source in sources:
+        for line in source:
+            number += 1
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                raise DumpError(
+                    f'Ошибка в строке {number}: {error}') from error
+
+
+def iter_array(stream, chunk_size=READ_CHUNK, head=''):
+    """Записи JSON-массива из текстового потока по одной; head — уже
+    прочитанное начало потока."""
+    decoder = json.JSONDecoder()
+    reader = Reader(stream, chunk_size, head)
+    if reader.next_char() != '[':
+        raise DumpError('Дамп должен быть JSON-массивом.')
+    reader.position += 1
+    while reader.next_char() != ']':
+        yield reader.decode(decoder)
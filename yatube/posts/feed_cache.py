@@ -0,0 +1,117 @@
+"""Кэш страниц лент с инвалидацией по поколениям.
+
+У каждой области (вся лента, группа, автор, пост, имена) есть счётчик
+поколения. Ключ закэшированной страницы включает поколения областей,
+от которых она зависит, поэтому событие, меняющее счётчик, сразу делает
+старые страницы недостижимыми, а сами они доживают до истечения срока.
+
+Те же поколения вместе с последней записью ленты собираются в ETag:
+на совпавший If-None-Match представление отвечает 304, не выполняя
+запросов страницы.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+from .consts import FEED_CACHE_TIMEOUT
+from .models import Post
+
+GENERATION_KEY = 'feed_generation:{}'
+PAGE_KEY = 'feed_page:{}:{}'
+
+
+def initial_generation():
+    # после вытеснения счётчика нельзя начинать с 1: старые страницы
+    # с тем же поколением снова стали бы достижимы
+    return int(time.time() * 1000)
+
+
+def get_generations(scopes):
+    keys = [GENERATION_KEY.format(scope) for scope in scopes]
+    generations = cache.get_many(keys)
+    missing = {key: initial_generation()
+               for key in keys if key not in generations}
+    if missing:
+        cache.set_many(missing, None)
+        generations.update(missing)
+    return [generations[key] for key in keys]
+
+
+def bump(*scopes):
+    for scope in set(scopes):
+        key = GENERATION_KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, initial_generation(), None)
+
+
+def post_scopes(post_id):
+    """post_detail показывает число постов автора, поэтому зависит
+    и от поколения автора."""
+    username = Post.objects.filter(pk=post_id).values_list(
+        'author__username', flat=True).first()
+    return f'post:{post_id}', f'author:{username}', 'names'
+
+
+def cache_feed(scopes):
+    """Кэширует страницу для анонимных посетителей; scopes получает
+    аргументы представления и возвращает области, от которых она зависит.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            generations = get_generations(scopes(*args, **kwargs))
+            path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            key = PAGE_KEY.format(
+                path, '.'.join(str(generation) for generation in generations))
+            # при промахе страницу строит один процесс, остальные ждут его
+            return cache.get_or_set(
+                key, lambda: view(request, *args, **kwargs),
+                FEED_CACHE_TIMEOUT)
+        return wrapper
+    return decorator
+
+
+def conditional_feed(scopes, latest):
+    """Отвечает 304, если страница не изменилась с прошлого визита.
+
+    latest получает запрос и аргументы представления и одним запросом
+    возвращает кортеж с последней записью ленты. ETag собирается из этого
+    кортежа, поколений областей и пользователя. Last-Modified не
+    отправляется: правки и удаления старых записей меняют только
+    поколения, и по дате клиент получал бы устаревший ответ 304.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            user = request.user
+            feed_scopes = list(scopes(*args, **kwargs))
+            if user.is_authenticated:
+                feed_scopes.append(f'follows:{user.pk}')
+            state = latest(request, *args, **kwargs)
+            if state is None:
+                return view(request, *args, **kwargs)
+            validators = (user.pk, *get_generations(feed_scopes), *state)
+            etag = quote_etag(hashlib.md5(
+                '|'.join(map(str, validators)).encode()).hexdigest())
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code not in (200, 304):
+                return response
+            response.setdefault('ETag', etag)
+            # без no-cache браузер мог бы показывать ленту из своего кэша,
+            # не спрашивая сервер
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
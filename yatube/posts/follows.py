@@ -0,0 +1,75 @@
+"""Авторы, на которых подписан пользователь, одним значением в кэше.
+
+id авторов хранятся упакованным массивом 64-битных чисел, отдельно —
+те, о чьих постах пользователь просил писать. Ключ включает поколение
+области follows:<id пользователя>, которое сигналы Follow меняют при
+подписке, отписке и переключении писем, и общее поколение follows,
+которое меняет массовая загрузка. Устаревшее множество становится
+недостижимым сразу во всех процессах, а проверка «подписан ли
+пользователь на автора» для целой страницы обходится без запросов.
+"""
+from array import array
+
+from django.core.cache import cache
+
+from . import feed_cache
+from .consts import FOLLOW_SET_TIMEOUT
+from .models import Follow
+
+SET_KEY = 'follow_set:{}:{}'
+TYPECODE = 'q'
+
+
+class FollowSet:
+    """Неизменяемое множество id авторов подписок пользователя."""
+
+    def __init__(self, following=(), notify=()):
+        self.following = frozenset(following)
+        self.notify = frozenset(notify)
+
+    def __contains__(self, author_id):
+        return author_id in self.following
+
+    def __bool__(self):
+        return bool(self.following)
+
+    def __len__(self):
+        return len(self.following)
+
+    def among(self, author_ids):
+        """Те из author_ids, на кого пользователь подписан."""
+        return self.following.intersection(author_ids)
+
+    def pack(self):
+        return tuple(array(TYPECODE, sorted(ids)).tobytes()
+                     for ids in (self.following, self.notify))
+
+    @classmethod
+    def unpack(cls, packed):
+        return cls(*(array(TYPECODE, ids) for ids in packed))
+
+
+def load(user_id):
+    following, notify = [], []
+    rows = Follow.objects.filter(user_id=user_id).values_list(
+        'author_id', 'notify')
+    for author_id, notified in rows:
+        following.append(author_id)
+        if notified:
+            notify.append(author_id)
+    return FollowSet(following, notify)
+
+
+def get(user):
+    """Подписки пользователя; анонимный ни на кого не подписан."""
+    if not user.is_authenticated:
+        return FollowSet()
+    # одно множество на запрос, даже если его спросят несколько раз
+    if getattr(user, '_follow_set', None) is None:
+        generations = feed_cache.get_generations(
+            ('follows', f'follows:{user.pk}'))
+        key = SET_KEY.format(
+            user.pk, '.'.join(str(generation) for generation in generations))
+        user._follow_set = FollowSet.unpack(cache.get_or_set(
+            key, lambda: load(user.pk).pack(), FOLLOW_SET_TIMEOUT))
+    return user._follow_set
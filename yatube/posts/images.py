@@ -0,0 +1,97 @@
+"""Приём загруженных картинок постов с ограниченным расходом памяти.
+
+Размеры проверяются по заголовку, до распаковки. JPEG распаковывается
+сразу в уменьшенном масштабе (draft), картинка уменьшается до
+IMAGE_MAX_SIDE, поворачивается по EXIF и сохраняется без метаданных.
+Результат пишется во временный файл, который хранилище читает частями.
+Наибольший буфер пикселей оценивается до распаковки: картинку, которой
+нужно больше IMAGE_MAX_DECODED, не распаковывают. Большой JPEG проходит
+благодаря draft, а PNG или WebP на десятки мегапикселей отклоняются.
+"""
+import logging
+import math
+import os
+from tempfile import SpooledTemporaryFile
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from PIL import Image, ImageOps
+
+from .consts import (IMAGE_JPEG_QUALITY, IMAGE_MAX_DECODED, IMAGE_MAX_PIXELS,
+                     IMAGE_MAX_SIDE, IMAGE_SPOOL_SIZE)
+
+logger = logging.getLogger(__name__)
+
+ORIENTATION = 0x0112  # тег EXIF с поворотом снимка
+
+
+def decoded_bytes(image):
+    """Оценка памяти под пиксели: Pillow хранит многоканальные режимы
+    по 4 байта на пиксель."""
+    bands = len(image.getbands())
+    depth = 4 if bands > 1 or image.mode in ('I', 'F') else 1
+    return image.width * image.height * depth
+
+
+def check_decoded(image):
+    peak = decoded_bytes(image)
+    if peak > IMAGE_MAX_DECODED:
+        raise ValidationError(
+            'Картинка слишком большая для обработки.',
+            code='image_too_large',
+        )
+    return peak
+
+
+def save_options(image, image_format):
+    options = {}
+    for key in ('icc_profile', 'transparency'):
+        if key in image.info:
+            options[key] = image.info[key]
+    if image_format == 'JPEG':
+        options['quality'] = IMAGE_JPEG_QUALITY
+    return options
+
+
+def ingest(upload):
+    """Возвращает File с подготовленной картинкой вместо загруженной.
+
+    У результата есть атрибут decoded_bytes — оценка пикового буфера.
+    """
+    upload.seek(0)
+    image = Image.open(upload)
+    if image.width * image.height > IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Картинка слишком большая: %(width)s×%(height)s пикселей.',
+            code='image_too_large',
+            params={'width': image.width, 'height': image.height},
+        )
+    if getattr(image, 'is_animated', False):
+        # анимацию сохраняем как есть: кадры не перекодируем, но
+        # миниатюры распакуют их по одному
+        upload.decoded_bytes = check_decoded(image)
+        upload.seek(0)
+        return upload
+    image_format = image.format
+    if image_format == 'JPEG':
+        # распаковка в масштабе 1/2…1/8, но не меньше итогового размера
+        ratio = min(1, IMAGE_MAX_SIDE / max(image.size))
+        image.draft(image.mode, (math.ceil(image.width * ratio),
+                                 math.ceil(image.height * ratio)))
+    peak = check_decoded(image)
+    orientation = image.getexif().get(ORIENTATION, 1)
+    image.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.LANCZOS)
+    if orientation != 1:
+        # поворот делает копию, поэтому он идёт после уменьшения
+        image = ImageOps.exif_transpose(image)
+    output = SpooledTemporaryFile(max_size=IMAGE_SPOOL_SIZE)
+    # PNG записывает EXIF из info, даже если его не передать в save
+    image.info.pop('exif', None)
+    image.save(output, image_format, **save_options(image, image_format))
+    image.close()
+    output.seek(0)
+    logger.debug('Картинка %s: %s×%s, буфер до %s байт',
+                 upload.name, image.width, image.height, peak)
+    result = File(output, name=os.path.basename(upload.name))
+    result.decoded_bytes = peak
+    return result
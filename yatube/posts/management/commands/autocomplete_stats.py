@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts.autocomplete import index
+
+
+class Command(BaseCommand):
+    help = ('Строит индекс автодополнения и показывает его размер '
+            'в памяти процесса.')
+
+    def handle(self, *args, **options):
+        index.ensure_fresh()
+        stats = index.stats()
+        self.stdout.write(
+            f'Пользователей: {stats["users"]}, групп: {stats["groups"]}, '
+            f'ключей: {stats["entries"]}')
+        self.stdout.write(
+            f'Память: {stats["bytes"] / 1024:.1f} КиБ, '
+            f'построение: {stats["build_time"] * 1000:.1f} мс')
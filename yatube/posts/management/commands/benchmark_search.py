@@ -0,0 +1,48 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from posts import search
+from posts.consts import LIMIT_POSTS
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время поиска по индексу FTS5 и через LIKE '
+            'на текущей базе (первая страница результатов).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('terms', nargs='+', help='Поисковые запросы.')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Сколько раз повторить каждый запрос.',
+        )
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError('Полнотекстовый индекс есть только в SQLite.')
+        self.stdout.write(
+            f'Постов в базе: {Post.objects.count()}, повторов: '
+            f'{options["repeat"]}')
+        for term in options['terms']:
+            like = Post.objects.filter(
+                Q(text__icontains=term) | Q(comments__text__icontains=term)
+            ).distinct().order_by('-pub_date', '-id')
+            fts = search.search_posts(term).order_by(*search.SEARCH_ORDERING)
+            like_time = self.measure(like, options['repeat'])
+            fts_time = self.measure(fts, options['repeat'])
+            self.stdout.write(
+                f'{term!r}: LIKE {like_time * 1000:.1f} мс, '
+                f'FTS5 {fts_time * 1000:.1f} мс, '
+                f'ускорение ×{like_time / max(fts_time, 1e-9):.1f}')
+
+    def measure(self, queryset, repeat):
+        """Медиана времени выборки первой страницы."""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(queryset[:LIMIT_POSTS])
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
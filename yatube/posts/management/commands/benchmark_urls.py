@@ -0,0 +1,257 @@
+import json
+import math
+import platform
+import time
+from wsgiref.util import setup_testing_defaults
+
+import django
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlencode, urlsafe_base64_encode
+
+from core.query_budget import QueryCounter
+from posts.models import Comment, Follow, Group, Post, User
+
+NAMESPACES = ('posts', 'users', 'about', 'api')
+# URL, которым нужна строка запроса; слово берётся из текста поста
+QUERY_PARAMS = {'posts:search': 'q', 'posts:autocomplete': 'q'}
+PERCENTILES = (50, 95, 99)
+# рост p95 меньше этого, мс, — шум, а не регрессия
+MIN_REGRESSION_MS = 1.0
+
+
+def percentile(timings, percent):
+    """Значение по методу ближайшего ранга."""
+    ordered = sorted(timings)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет все URL приложений posts, users, about и api через '
+            'WSGI-приложение анонимно и от имени пользователя, '
+            'показывает перцентили времени ответа и число запросов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Сколько раз измерить каждый URL.',
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=2,
+            help='Сколько неучтённых запросов сделать перед измерением.',
+        )
+        parser.add_argument('--output', help='Записать результаты в JSON.')
+        parser.add_argument(
+            '--baseline', help='Сравнить с результатами из этого JSON.')
+        parser.add_argument(
+            '--threshold', type=float, default=20,
+            help='Рост p95 в процентах, который считается регрессией.',
+        )
+        parser.add_argument(
+            '--fail', action='store_true',
+            help='Завершиться с ошибкой, если найдены регрессии.',
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должен быть положительным.')
+        if settings.DEBUG:
+            self.stdout.write(self.style.WARNING(
+                'DEBUG включён: время ответа завышено.'))
+        self.application = WSGIHandler()
+        user, kwargs = self.sample()
+        client = Client()
+        client.force_login(user)
+        # вход меняет last_login, а с ним и токен сброса пароля
+        kwargs['token'] = default_token_generator.make_token(user)
+        sessions = {
+            'anonymous': '',
+            'user': f'{settings.SESSION_COOKIE_NAME}='
+                    f'{client.cookies[settings.SESSION_COOKIE_NAME].value}',
+        }
+        # как тестовый клиент: запрос не должен закрывать соединение,
+        # внутри транзакции которого он выполняется
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            results = {
+                f'{name} [{mode}]': self.measure(path, cookie, options)
+                for name, path in self.urls(kwargs)
+                for mode, cookie in sessions.items()
+            }
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+            client.logout()
+        self.report(results)
+        self.report_api(results)
+        report = dict(meta=self.meta(options), results=results)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+        if options['baseline']:
+            self.compare(results, options)
+
+    def sample(self):
+        """Самые тяжёлые объекты текущих данных и пользователь
+        с наибольшим числом подписок."""
+        user = User.objects.annotate(
+            total=Count('follower')).order_by('-total', 'pk').first()
+        if user is None:
+            raise CommandError('В базе нет пользователей: запустите '
+                               'generate_dataset.')
+        author = User.objects.annotate(
+            total=Count('posts')).order_by('-total', 'pk').first()
+        group = Group.objects.order_by('-posts_count', 'pk').first()
+        post = Post.objects.order_by('-comments_count', 'pk').first()
+        kwargs = dict(
+            username=author.username,
+            uidb64=urlsafe_base64_encode(force_bytes(user.pk)),
+        )
+        if group is not None:
+            kwargs['slug'] = group.slug
+        if post is not None:
+            kwargs['post_id'] = post.pk
+            words = [word for word in post.text.split() if word.isalpha()]
+            kwargs['q'] = max(words, key=len, default=post.text[:3])
+        return user, kwargs
+
+    def urls(self, samples):
+        resolver = get_resolver()
+        for namespace in NAMESPACES:
+            _, app_resolver = resolver.namespace_dict[namespace]
+            for pattern in app_resolver.url_patterns:
+                params = pattern.pattern.regex.groupindex
+                if not set(params) <= set(samples):
+                    self.stdout.write(
+                        f'{namespace}:{pattern.name}: нет данных для URL')
+                    continue
+                name = f'{namespace}:{pattern.name}'
+                path = reverse(
+                    name, kwargs={key: samples[key] for key in params})
+                if name in QUERY_PARAMS and 'q' in samples:
+                    path += '?' + urlencode(
+                        {QUERY_PARAMS[name]: samples['q'][:4]})
+                yield name, path
+
+    def request(self, path, cookie):
+        path, _, query = path.partition('?')
+        environ = {
+            'PATH_INFO': path.encode().decode('iso-8859-1'),
+            'QUERY_STRING': query,
+            'HTTP_COOKIE': cookie,
+        }
+        setup_testing_defaults(environ)
+        status = []
+
+        def start_response(line, headers, exc_info=None):
+            status.append(int(line.split()[0]))
+
+        response = self.application(environ, start_response)
+        try:
+            for _ in response:
+                pass
+        finally:
+            response.close()
+        return status[0]
+
+    def measure(self, path, cookie, options):
+        """Каждый запрос откатывается, поэтому подписки, комментарии
+        и выход из учётной записи не меняют данные следующих прогонов."""
+        timings, queries = [], []
+        for attempt in range(options['warmup'] + options['repeat']):
+            counter = QueryCounter()
+            with transaction.atomic():
+                with connection.execute_wrapper(counter):
+                    started = time.perf_counter()
+                    status = self.request(path, cookie)
+                    elapsed = time.perf_counter() - started
+                transaction.set_rollback(True)
+            if attempt >= options['warmup']:
+                timings.append(elapsed * 1000)
+                queries.append(counter.count)
+        result = dict(path=path, status=status, queries=max(queries))
+        for percent in PERCENTILES:
+            result[f'p{percent}'] = round(percentile(timings, percent), 3)
+        return result
+
+    def meta(self, options):
+        return dict(
+            created=timezone.now().isoformat(),
+            repeat=options['repeat'],
+            warmup=options['warmup'],
+            debug=settings.DEBUG,
+            python=platform.python_version(),
+            django=django.get_version(),
+            rows={model.__name__.lower(): model.objects.count()
+                  for model in (User, Group, Post, Comment, Follow)},
+        )
+
+    def report(self, results):
+        width = max(len(label) for label in results)
+        self.stdout.write(
+            f'{"url":<{width}} {"код":>4} {"запр.":>5} '
+            + ' '.join(f'{f"p{percent}, мс":>10}' for percent in PERCENTILES))
+        for label, result in results.items():
+            self.stdout.write(
+                f'{label:<{width}} {result["status"]:>4} '
+                f'{result["queries"]:>5} '
+                + ' '.join(f'{result[f"p{percent}"]:>10.2f}'
+                           for percent in PERCENTILES))
+
+    def report_api(self, results):
+        """p50 ответов JSON API против HTML-страниц с теми же данными."""
+        pairs = [(label, 'posts:' + label[len('api:'):])
+                 for label in results if label.startswith('api:')]
+        pairs = [(api, html) for api, html in pairs if html in results]
+        if not pairs:
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING('JSON API и HTML, p50'))
+        for api, html in pairs:
+            json_p50, html_p50 = results[api]['p50'], results[html]['p50']
+            self.stdout.write(
+                f'{api}: {json_p50:.2f} мс против {html_p50:.2f} мс, '
+                f'x{html_p50 / max(json_p50, 1e-9):.1f}')
+
+    def compare(self, results, options):
+        """Изменения p50 и p95 в процентах и числа запросов
+        относительно сохранённого прогона."""
+        try:
+            with open(options['baseline'], encoding='utf-8') as baseline:
+                baseline = json.load(baseline)['results']
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f'Не удалось прочитать базовый прогон: {error}')
+        regressions = []
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'Сравнение с {options["baseline"]}'))
+        for label, result in results.items():
+            before = baseline.get(label)
+            if before is None:
+                self.stdout.write(f'{label}: нет в базовом прогоне')
+                continue
+            change = {percent: 100 * (result[f'p{percent}'] / max(
+                before[f'p{percent}'], 1e-9) - 1) for percent in (50, 95)}
+            queries = result['queries'] - before['queries']
+            line = (f'{label}: p50 {change[50]:+.1f}%, '
+                    f'p95 {change[95]:+.1f}%, запросов {queries:+d}')
+            slower = result['p95'] - before['p95'] > MIN_REGRESSION_MS
+            if slower and change[95] > options['threshold'] or queries > 0:
+                regressions.append(label)
+                line = self.style.WARNING(line)
+            self.stdout.write(line)
+        if regressions:
+            message = f'Регрессий: {len(regressions)}'
+            if options['fail']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,187 @@
+import json
+import os
+import tempfile
+from contextlib import ExitStack
+from itertools import islice
+
+from django.contrib.auth.hashers import (UNUSABLE_PASSWORD_PREFIX,
+                                         identify_hasher, make_password)
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from core.pools import process_pool
+from posts.bulk import STAGES, batch_size, keep_dates, rebuild_derived
+from posts.consts import IMPORT_BATCH_SIZE, IMPORT_TRANSACTION_SIZE
+from posts.dumps import DumpError, iter_records, open_dump
+from posts.models import User
+
+
+def is_plaintext(password):
+    if not password or password.startswith(UNUSABLE_PASSWORD_PREFIX):
+        return False
+    try:
+        identify_hasher(password)
+    except ValueError:
+        return True
+    return False
+
+
+class Command(BaseCommand):
+    help = ('Загружает дамп dumpdata или NDJSON из export_stream, в том '
+            'числе сжатый gzip, потоково: пользователи, группы, посты, '
+            'комментарии и подписки пачками bulk_create, затем '
+            'пересчитывает счётчики и ленты.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к дампу JSON или NDJSON.')
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+            help='Сколько строк вставлять одним INSERT.',
+        )
+        parser.add_argument(
+            '--transaction-size', type=int, default=IMPORT_TRANSACTION_SIZE,
+            help='Сколько записей загружать за одну транзакцию.',
+        )
+        parser.add_argument(
+            '--hash-passwords', action='store_true',
+            help='Хешировать пароли, записанные в дампе открытым текстом.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Процессов для хеширования паролей; 1 — без пула.',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.user_ids = {}
+        with ExitStack() as stack:
+            spools = {label: stack.enter_context(
+                tempfile.TemporaryFile('w+', encoding='utf-8'))
+                for label in STAGES}
+            try:
+                skipped = self.spool(options['path'], spools)
+            except (OSError, DumpError) as error:
+                raise CommandError(error)
+            loaded, existing = {}, {}
+            with keep_dates(STAGES.values()):
+                for label, model in STAGES.items():
+                    spools[label].seek(0)
+                    # ignore_conflicts молча пропускает записи, которые
+                    # уже есть, поэтому вставленные считает сама база
+                    before = model.objects.count()
+                    processed = self.load(model, spools[label])
+                    loaded[label] = model.objects.count() - before
+                    if processed > loaded[label]:
+                        existing[label] = processed - loaded[label]
+        self.reset_sequences()
+        self.stdout.write(self.style.SUCCESS(
+            'Загружено: ' + ', '.join(
+                f'{label} — {count}' for label, count in loaded.items())))
+        if existing:
+            self.stdout.write('Уже были в базе: ' + ', '.join(
+                f'{label} — {count}' for label, count in existing.items()))
+        if skipped:
+            self.stdout.write('Пропущено: ' + ', '.join(
+                f'{label} — {count}' for label, count in skipped.items()))
+        rebuild_derived(self.stdout)
+
+    def spool(self, path, spools):
+        """Один проход по дампу: записи раскладываются по временным
+        файлам моделей, открытые пароли хешируются пачками."""
+        skipped = {}
+        pending = []
+        with ExitStack() as stack:
+            pool = None
+            workers = self.options['workers']
+            if self.options['hash_passwords'] and workers > 1:
+                pool = stack.enter_context(process_pool(workers))
+            dump = stack.enter_context(open_dump(path))
+            for record in iter_records(dump):
+                label = record.get('model')
+                if label not in STAGES:
+                    skipped[label] = skipped.get(label, 0) + 1
+                    continue
+                if label == 'auth.user' and self.options['hash_passwords']:
+                    pending.append(record)
+                    if len(pending) >= self.options['batch_size']:
+                        self.write_users(pending, spools[label], pool)
+                        pending = []
+                    continue
+                spools[label].write(json.dumps(record) + '\n')
+            self.write_users(pending, spools['auth.user'], pool)
+        return skipped
+
+    def write_users(self, records, spool, pool):
+        plain = [record['fields'] for record in records
+                 if is_plaintext(record['fields'].get('password'))]
+        passwords = [fields['password'] for fields in plain]
+        if pool is not None and len(passwords) > 1:
+            hashed = pool.map(make_password, passwords, chunksize=max(
+                1, len(passwords) // (self.options['workers'] * 4)))
+        else:
+            hashed = map(make_password, passwords)
+        for fields, password in zip(plain, hashed):
+            fields['password'] = password
+        for record in records:
+            spool.write(json.dumps(record) + '\n')
+
+    def load(self, model, spool):
+        records = (json.loads(line) for line in spool)
+        total = 0
+        while True:
+            chunk = list(islice(records, self.options['transaction_size']))
+            if not chunk:
+                return total
+            with transaction.atomic():
+                model.objects.bulk_create(
+                    [self.build(model, record) for record in chunk],
+                    batch_size=batch_size(model, self.options['batch_size']),
+                    ignore_conflicts=True,
+                )
+            if model is User:
+                self.remember_users(
+                    [record['fields']['username'] for record in chunk])
+            total += len(chunk)
+
+    def build(self, model, record):
+        obj = model(pk=record.get('pk'))
+        for name, value in record['fields'].items():
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise CommandError(
+                    f'{record["model"]}: в модели нет поля {name}')
+            if field.many_to_many:
+                continue
+            if field.is_relation:
+                if isinstance(value, list):
+                    # натуральный ключ: у дампов пользователей это username
+                    value = self.user_id(*value)
+            else:
+                value = field.to_python(value)
+            setattr(obj, field.attname, value)
+        return obj
+
+    def remember_users(self, usernames):
+        # bulk_create не возвращает первичные ключи в SQLite
+        batch_size = self.options['batch_size']
+        for start in range(0, len(usernames), batch_size):
+            self.user_ids.update(User.objects.filter(
+                username__in=usernames[start:start + batch_size],
+            ).values_list('username', 'pk'))
+
+    def user_id(self, username):
+        if username not in self.user_ids:
+            self.remember_users([username])
+        if username not in self.user_ids:
+            raise CommandError(f'Пользователь {username} не найден')
+        return self.user_ids[username]
+
+    def reset_sequences(self):
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), list(STAGES.values()))
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
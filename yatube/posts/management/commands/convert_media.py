@@ -0,0 +1,54 @@
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from sorl.thumbnail import delete as delete_thumbnails
+
+from posts import feed_cache
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Переименовывает картинки постов по хешу содержимого прямо '
+            'в media/posts: одинаковые файлы сливаются в один.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, сколько файлов будет переименовано.',
+        )
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        names = Post.objects.exclude(image='').exclude(
+            image__isnull=True).order_by().values_list(
+            'image', flat=True).distinct()
+        names = [name for name in names if not storage.is_hashed(name)]
+        missing = [name for name in names if not storage.exists(name)]
+        if options['dry_run']:
+            self.stdout.write(
+                f'Будет переименовано: {len(names) - len(missing)}, '
+                f'файлов нет: {len(missing)}')
+            return
+        converted = set()
+        for name in names:
+            if name in missing:
+                continue
+            with storage.open(name) as content:
+                new_name = storage.save(name, File(content, name))
+            with transaction.atomic():
+                # новая версия — новые ключи карточек со старой ссылкой
+                Post.objects.filter(image=name).update(
+                    image=new_name, version=F('version') + 1)
+            delete_thumbnails(Post(image=name).image, delete_file=False)
+            storage.delete(name)
+            converted.add(new_name)
+        if converted:
+            # ссылки на картинки есть на всех закэшированных страницах
+            feed_cache.bump('names')
+        for name in missing:
+            self.stderr.write(f'Файла нет: {name}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Переименовано: {len(names) - len(missing)}, '
+            f'осталось файлов: {len(converted)}, '
+            f'файлов нет: {len(missing)}'))
@@ -0,0 +1,163 @@
+import re
+import uuid
+from types import SimpleNamespace
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, F
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from posts.consts import COMMENTS_ORDERING, KEYSET_ORDERING
+from posts.models import Comment, Follow, Group, Post, Timeline, User
+from posts.utils import KeysetPaginator
+from posts.views import TIMELINE_ORDERING
+
+# SCAN posts_post / SCAN TABLE posts_post USING COVERING INDEX ...
+SCAN_STEP = re.compile(
+    r'^SCAN (?:TABLE )?(?P<table>\S+)(?P<index> USING .*)?')
+# просмотр промежуточных результатов, а не таблиц
+DERIVED_TABLES = ('subquery', 'CONSTANT')
+
+
+def plan_warnings(sql, plan):
+    """Шаги плана, которые читают таблицу целиком или сортируют."""
+    limited = ' LIMIT ' in sql
+    for step in plan:
+        if 'TEMP B-TREE' in step:
+            yield f'сортировка во временном B-дереве: {step}'
+            continue
+        scan = SCAN_STEP.match(step)
+        if scan is None or scan['table'] in DERIVED_TABLES:
+            continue
+        if scan['index'] is None:
+            yield f'полный просмотр таблицы: {step}'
+        elif not limited:
+            # упорядоченный обход индекса с LIMIT читает только страницу
+            yield f'полный просмотр индекса: {step}'
+
+
+def middle_cursor(queryset, ordering):
+    """Курсор на середину ленты: так разбирается запрос следующей
+    страницы с условием по ключу, а не только первая страница."""
+    fields = [field.lstrip('-') for field in ordering]
+    rows = queryset.order_by(*ordering).values(*fields)
+    total = rows.count()
+    if total < 2:
+        return None
+    row = SimpleNamespace(**rows[total // 2])
+    return KeysetPaginator([], 1, ordering).make_cursor(row)
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = ('Повторяет запросы представлений posts на текущей базе '
+            'и показывает EXPLAIN QUERY PLAN с полными просмотрами '
+            'и временными сортировками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page',
+            help='Номер страницы лент с номерами; без него лента '
+                 'разбирается в своём режиме по умолчанию.',
+        )
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Печатать планы всех запросов, а не только проблемных.',
+        )
+        parser.add_argument(
+            '--fail', action='store_true',
+            help='Завершиться с ошибкой, если найдены проблемные планы.',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN есть только в SQLite.')
+        self.factory = RequestFactory()
+        problems = 0
+        for url, user, cursor in self.sample_requests():
+            page = {'page': options['page']} if options['page'] else {}
+            problems += self.explain(url, user, page, options)
+            if cursor is not None:
+                problems += self.explain(url, user, {'cursor': cursor},
+                                         options)
+        if problems:
+            message = f'Проблемных шагов в планах: {problems}'
+            if options['fail']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('Проблемных планов нет'))
+
+    def sample_requests(self):
+        """Самые тяжёлые образцы каждой ленты из текущих данных и курсор
+        на середину каждой из них."""
+        anonymous = AnonymousUser()
+        yield (reverse('posts:index'), anonymous,
+               middle_cursor(Post.objects.all(), KEYSET_ORDERING))
+        group = Group.objects.annotate(
+            total=Count('posts')).order_by('-total').first()
+        if group is not None:
+            yield (reverse('posts:group_list', args=[group.slug]), anonymous,
+                   middle_cursor(group.posts.all(), KEYSET_ORDERING))
+        author = User.objects.annotate(
+            total=Count('posts')).order_by('-total').first()
+        if author is not None:
+            yield (reverse('posts:profile', args=[author.username]),
+                   anonymous,
+                   middle_cursor(author.posts.all(), KEYSET_ORDERING))
+        post = Post.objects.annotate(
+            total=Count('comments')).order_by('-total').first()
+        if post is not None:
+            yield reverse('posts:post_detail', args=[post.pk]), anonymous, None
+            yield (reverse('posts:post_comments', args=[post.pk]), anonymous,
+                   middle_cursor(Comment.objects.filter(post=post),
+                                 COMMENTS_ORDERING))
+        follow = Follow.objects.values('user').annotate(
+            total=Count('pk')).order_by('-total').first()
+        if follow is not None:
+            timeline = Timeline.objects.filter(user=follow['user']).annotate(
+                feed_date=F('pub_date'), feed_post=F('post'))
+            yield (reverse('posts:follow_index'),
+                   User.objects.get(pk=follow['user']),
+                   middle_cursor(timeline, TIMELINE_ORDERING))
+
+    def explain(self, url, user, params, options):
+        # уникальный параметр, чтобы не попасть в закэшированную страницу
+        request = self.factory.get(
+            url, dict(params, explain=uuid.uuid4().hex))
+        request.user = user
+        request.resolver_match = match = resolve(url)
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            match.func(request, *match.args, **match.kwargs)
+        page = ' '.join(
+            f'{name}={value}' for name, value in params.items()) or '-'
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{match.view_name} {url} {page}: '
+            f'запросов {len(recorder.queries)}'))
+        problems = 0
+        with connection.cursor() as cursor:
+            for sql, params in recorder.queries:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = [row[-1] for row in cursor.fetchall()]
+                found = list(plan_warnings(sql, plan))
+                problems += len(found)
+                if found or options['verbose_plans']:
+                    self.stdout.write(f'  {sql}')
+                    for step in plan:
+                        self.stdout.write(f'    {step}')
+                    for warning in found:
+                        self.stdout.write(
+                            self.style.WARNING(f'    ! {warning}'))
+        return problems
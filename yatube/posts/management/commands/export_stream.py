@@ -0,0 +1,135 @@
+import argparse
+import gzip
+import json
+import os
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from posts.bulk import STAGES
+from posts.consts import EXPORT_CHUNK_SIZE
+from posts.models import User
+
+# поле даты, по которому --since отбирает новые записи; модели без
+# такого поля выгружаются целиком
+SINCE_FIELDS = {
+    'auth.user': 'date_joined',
+    'posts.post': 'pub_date',
+    'posts.comment': 'created',
+}
+# пользователи выгружаются без ключа и указываются по имени, как
+# в dumpdata --natural-primary --natural-foreign
+NATURAL_KEY = 'username'
+
+
+def parse_since(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise argparse.ArgumentTypeError(
+                f'Ожидается дата или время ISO 8601: {value}')
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def isoformat(value):
+    # в отличие от DjangoJSONEncoder, не отбрасывает микросекунды
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} не сериализуется в JSON')
+
+
+def columns(model):
+    """Поле записи -> колонка .values(); ссылки на пользователей
+    заменяются их именами."""
+    result = {}
+    for field in model._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        if field.is_relation and field.related_model is User:
+            result[field.name] = f'{field.name}__{NATURAL_KEY}'
+        else:
+            result[field.name] = field.attname
+    return result
+
+
+class Command(BaseCommand):
+    help = ('Выгружает пользователей, группы, посты, комментарии '
+            'и подписки в NDJSON, по записи dumpdata на строку, не держа '
+            'таблицы в памяти. Результат читает bulk_import.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='Файл выгрузки; с суффиксом .gz сжимается.')
+        parser.add_argument(
+            '--gzip', action='store_true',
+            help='Сжать выгрузку gzip независимо от имени файла.',
+        )
+        parser.add_argument(
+            '--since', type=parse_since,
+            help='Выгрузить только пользователей, посты и комментарии, '
+                 'созданные начиная с этого времени; группы и подписки '
+                 'дат не хранят и выгружаются целиком.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+            help='Сколько строк читать из базы за раз.',
+        )
+
+    def handle(self, *args, **options):
+        started = timezone.now()
+        path = options['path']
+        # незаконченная выгрузка не должна выглядеть законченной
+        partial = f'{path}.part'
+        try:
+            if options['gzip'] or path.endswith('.gz'):
+                output = gzip.open(partial, 'wt', encoding='utf-8')
+            else:
+                output = open(partial, 'w', encoding='utf-8')
+            # одна транзакция — согласованный снимок всех таблиц
+            with output, transaction.atomic():
+                exported = {
+                    label: self.export(label, model, output, options)
+                    for label, model in STAGES.items()
+                }
+            os.replace(partial, path)
+        except OSError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            'Выгружено: ' + ', '.join(
+                f'{label} — {count}' for label, count in exported.items())))
+        self.stdout.write(
+            f'Следующая выгрузка: --since {started.isoformat()}')
+
+    def export(self, label, model, output, options):
+        fields = columns(model)
+        natural = {name for name, column in fields.items()
+                   if column.endswith(f'__{NATURAL_KEY}')}
+        queryset = model.objects.order_by('pk')
+        if options['since'] is not None and label in SINCE_FIELDS:
+            queryset = queryset.filter(
+                **{f'{SINCE_FIELDS[label]}__gte': options['since']})
+        rows = queryset.values('pk', *fields.values()).iterator(
+            chunk_size=options['chunk_size'])
+        count = 0
+        for row in rows:
+            record = dict(model=label)
+            if model is not User:
+                record['pk'] = row['pk']
+            record['fields'] = {
+                name: [row[column]] if name in natural else row[column]
+                for name, column in fields.items()
+            }
+            output.write(json.dumps(
+                record, ensure_ascii=False, default=isoformat) + '\n')
+            count += 1
+        return count
@@ -0,0 +1,235 @@
+import io
+import random
+import time
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from faker import Faker
+from PIL import Image, ImageDraw
+
+from posts.bulk import batch_size, keep_dates, rebuild_derived
+from posts.consts import IMPORT_BATCH_SIZE, IMPORT_TRANSACTION_SIZE
+from posts.models import Comment, Follow, Group, Post, User
+
+# размер и число прямоугольников синтетических картинок
+IMAGE_SIZE = (960, 640)
+IMAGE_SHAPES = 12
+# параметр формы распределения Парето для числа подписок
+FOLLOWS_SHAPE = 2.0
+
+
+def zipf_weights(count, alpha):
+    """Накопленные веса закона Ципфа в случайном порядке: немногие
+    элементы популярны, большинство — почти нет."""
+    weights = [1 / rank ** alpha for rank in range(1, count + 1)]
+    random.shuffle(weights)
+    return list(accumulate(weights))
+
+
+def next_pk(model):
+    # ключи назначаются заранее: bulk_create не возвращает их в SQLite
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, группами, '
+            'постами с картинками, комментариями и подписками '
+            'со степенным распределением популярности.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Среднее число подписок пользователя.',
+        )
+        parser.add_argument(
+            '--alpha', type=float, default=1.0,
+            help='Показатель закона Ципфа для популярности авторов '
+                 'и постов.',
+        )
+        parser.add_argument(
+            '--images', type=int, default=50,
+            help='Сколько разных картинок нарисовать.',
+        )
+        parser.add_argument(
+            '--image-ratio', type=float, default=0.3,
+            help='Доля постов с картинкой.',
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько последних дней распределить посты.',
+        )
+        parser.add_argument('--password', default='dataset')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+            help='Сколько строк вставлять одним INSERT.',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        random.seed(options['seed'])
+        self.fake = Faker('ru_RU')
+        self.fake.seed_instance(options['seed'])
+        self.now = timezone.now()
+        started = time.perf_counter()
+        with keep_dates([User, Post, Comment]):
+            self.users = self.create(User, self.new_users())
+            self.author_weights = zipf_weights(
+                len(self.users), options['alpha'])
+            self.groups = self.create(Group, self.new_groups())
+            self.images = self.draw_images(options['images'])
+            self.post_dates = array('d')
+            self.posts = self.create(Post, self.new_posts())
+            self.post_weights = zipf_weights(
+                len(self.posts), options['alpha'])
+            comments = self.create(Comment, self.new_comments())
+            follows = self.create(Follow, self.new_follows())
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: пользователей {len(self.users)}, '
+            f'групп {len(self.groups)}, постов {len(self.posts)}, '
+            f'комментариев {len(comments)}, подписок {len(follows)}, '
+            f'картинок {len(set(self.images))} '
+            f'за {time.perf_counter() - started:.1f} с'))
+        rebuild_derived(self.stdout)
+        self.stdout.write('Миниатюры создаст команда warm_thumbnails.')
+
+    def create(self, model, objects):
+        """Вставляет объекты пачками транзакций с заранее назначенными
+        ключами и возвращает эти ключи."""
+        pk = next_pk(model)
+        created = []
+        while True:
+            chunk = list(islice(objects, IMPORT_TRANSACTION_SIZE))
+            if not chunk:
+                return created
+            for obj in chunk:
+                obj.pk, pk = pk, pk + 1
+            with transaction.atomic():
+                model.objects.bulk_create(chunk, batch_size=batch_size(
+                    model, self.options['batch_size']))
+            created.extend(obj.pk for obj in chunk)
+
+    def past(self, days):
+        return self.now - timedelta(seconds=random.uniform(0, days * 86400))
+
+    def popular(self, weights):
+        return random.choices(range(len(weights)), cum_weights=weights)[0]
+
+    def new_users(self):
+        # суффикс из будущего ключа делает имена уникальными
+        start = next_pk(User)
+        password = make_password(self.options['password'])
+        for index in range(self.options['users']):
+            yield User(
+                username=f'{self.fake.user_name()}_{start + index}',
+                first_name=self.fake.first_name(),
+                last_name=self.fake.last_name(),
+                email=self.fake.email(),
+                password=password,
+                date_joined=self.past(self.options['days'] * 2),
+            )
+
+    def new_groups(self):
+        start = next_pk(Group)
+        for index in range(self.options['groups']):
+            yield Group(
+                title=f'{self.fake.word().capitalize()} {start + index}',
+                slug=f'group-{start + index}',
+                description=self.fake.sentence(),
+            )
+
+    def new_posts(self):
+        """Популярные авторы пишут чаще; половина постов — в группах."""
+        if not self.users:
+            return
+        for _ in range(self.options['posts']):
+            pub_date = self.past(self.options['days'])
+            self.post_dates.append(pub_date.timestamp())
+            group = image = None
+            if self.groups and random.random() < 0.5:
+                group = random.choice(self.groups)
+            if (self.images
+                    and random.random() < self.options['image_ratio']):
+                image = random.choice(self.images)
+            yield Post(
+                author_id=self.users[self.popular(self.author_weights)],
+                group_id=group,
+                text=self.fake.text(
+                    max_nb_chars=random.choice((200, 600, 1500))),
+                image=image or '',
+                pub_date=pub_date,
+            )
+
+    def new_comments(self):
+        """Комментарии собираются у популярных постов вскоре
+        после публикации."""
+        if not self.posts:
+            return
+        for _ in range(self.options['comments']):
+            index = self.popular(self.post_weights)
+            created = min(self.now.timestamp(), self.post_dates[index]
+                          + random.expovariate(1 / 86400))
+            yield Comment(
+                post_id=self.posts[index],
+                author_id=random.choice(self.users),
+                text=self.fake.sentence(nb_words=random.randint(3, 30)),
+                created=datetime.fromtimestamp(created, timezone.utc),
+            )
+
+    def new_follows(self):
+        """Число подписок — распределение Парето со средним --follows,
+        авторы выбираются по популярности, как и для постов."""
+        scale = self.options['follows'] * (FOLLOWS_SHAPE - 1) / FOLLOWS_SHAPE
+        for follower in range(len(self.users)):
+            wanted = min(round(scale * random.paretovariate(FOLLOWS_SHAPE)),
+                         (len(self.users) - 1) // 2)
+            authors = set()
+            attempts = 0
+            while len(authors) < wanted:
+                attempts += 1
+                if attempts > wanted * 4:
+                    # хвост распределения почти недостижим: добираем
+                    # подписки равномерно
+                    author = random.randrange(len(self.users))
+                else:
+                    author = self.popular(self.author_weights)
+                if author != follower:
+                    authors.add(author)
+            for author in sorted(authors):
+                yield Follow(user_id=self.users[follower],
+                             author_id=self.users[author])
+
+    def draw_images(self, count):
+        """Картинки из случайных прямоугольников; хранилище по хешу
+        содержимого само отбросит совпадающие."""
+        field = Post._meta.get_field('image')
+        names = []
+        for index in range(count):
+            image = Image.new('RGB', IMAGE_SIZE, self.color())
+            draw = ImageDraw.Draw(image)
+            for _ in range(IMAGE_SHAPES):
+                x, y = (random.randrange(side) for side in IMAGE_SIZE)
+                draw.rectangle(
+                    (x, y, x + random.randrange(50, 400),
+                     y + random.randrange(50, 400)), fill=self.color())
+            content = io.BytesIO()
+            image.save(content, 'JPEG', quality=85)
+            names.append(field.storage.save(
+                field.generate_filename(None, f'dataset{index}.jpg'),
+                ContentFile(content.getvalue())))
+        return names
+
+    @staticmethod
+    def color():
+        return tuple(random.randrange(256) for _ in range(3))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from posts import search
+from posts.consts import SEARCH_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс постов и комментариев.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=SEARCH_BATCH_SIZE,
+            help='Сколько постов индексировать за одну транзакцию.',
+        )
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError('Полнотекстовый индекс есть только в SQLite.')
+        total = 0
+        last_id = 0
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_search')
+            while True:
+                with transaction.atomic():
+                    cursor.execute(search.REBUILD_POSTS,
+                                   [last_id, options['batch_size']])
+                    if cursor.rowcount <= 0:
+                        break
+                    total += cursor.rowcount
+                    # у строк комментариев rowid отрицательные
+                    cursor.execute('SELECT max(rowid) FROM posts_search')
+                    first_id, last_id = last_id, cursor.fetchone()[0]
+                    cursor.execute(search.REBUILD_COMMENTS,
+                                   [first_id, last_id])
+            # сливаем сегменты индекса после массовой вставки
+            cursor.execute(
+                "INSERT INTO posts_search (posts_search) VALUES ('optimize')")
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано постов: {total}'))
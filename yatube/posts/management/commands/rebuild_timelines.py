@@ -0,0 +1,56 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.consts import TIMELINE_BATCH_SIZE
+from posts.models import Follow, Post, Timeline, User
+
+
+class Command(BaseCommand):
+    help = 'Заполняет или пересобирает материализованные ленты подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*',
+            help='Пересобрать ленты только этих пользователей.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=TIMELINE_BATCH_SIZE,
+            help='Сколько подписчиков обрабатывать за одну транзакцию.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['usernames']:
+            user_ids = User.objects.filter(
+                username__in=options['usernames']).values_list('id', flat=True)
+        else:
+            # и подписчики, и те, у кого в ленте остались устаревшие записи
+            user_ids = Follow.objects.values_list('user_id', flat=True).union(
+                Timeline.objects.values_list('user_id', flat=True))
+        user_ids = sorted(user_ids)
+        total = 0
+        for start in range(0, len(user_ids), batch_size):
+            total += self.rebuild(user_ids[start:start + batch_size],
+                                  batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересобрано лент: {len(user_ids)}, записей: {total}'))
+
+    @transaction.atomic
+    def rebuild(self, user_ids, batch_size):
+        Timeline.objects.filter(user_id__in=user_ids).delete()
+        rows = Post.objects.filter(
+            author__following__user_id__in=user_ids,
+        ).values_list('author__following__user_id', 'id', 'pub_date')
+        entries = (
+            Timeline(user_id=user_id, post_id=post_id, pub_date=pub_date)
+            for user_id, post_id, pub_date in rows.iterator()
+        )
+        total = 0
+        while True:
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                return total
+            Timeline.objects.bulk_create(batch)
+            total += len(batch)
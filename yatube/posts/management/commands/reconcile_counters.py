@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from posts.consts import COUNTERS_BATCH_SIZE
+from posts.models import AuthorStats, Group, Post, User
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов и комментариев пачками.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=COUNTERS_BATCH_SIZE,
+            help='Сколько строк пересчитывать за одну транзакцию.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        fixed = dict(
+            authors=self.reconcile(
+                User.objects.annotate(actual=Count('posts')),
+                self.fix_authors, batch_size),
+            groups=self.reconcile(
+                Group.objects.annotate(actual=Count('posts')),
+                self.fix_groups, batch_size),
+            posts=self.reconcile(
+                Post.objects.annotate(actual=Count('comments')),
+                self.fix_posts, batch_size),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            'Исправлено счётчиков: ' + ', '.join(
+                f'{name} — {count}' for name, count in fixed.items())))
+
+    def reconcile(self, queryset, fix, batch_size):
+        """Идёт по таблице пачками по первичному ключу, без OFFSET."""
+        fixed = 0
+        last_pk = None
+        queryset = queryset.order_by('pk')
+        while True:
+            batch = queryset
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            rows = list(batch.values_list('pk', 'actual')[:batch_size])
+            if not rows:
+                return fixed
+            with transaction.atomic():
+                fixed += fix(dict(rows))
+            last_pk = rows[-1][0]
+
+    def fix_authors(self, actual):
+        stored = dict(AuthorStats.objects.filter(
+            author_id__in=actual).values_list('author_id', 'posts_count'))
+        AuthorStats.objects.bulk_create(
+            [AuthorStats(author_id=pk) for pk in actual if pk not in stored],
+            ignore_conflicts=True,
+        )
+        drifted = [AuthorStats(author_id=pk, posts_count=count)
+                   for pk, count in actual.items()
+                   if stored.get(pk, 0) != count]
+        AuthorStats.objects.bulk_update(drifted, ['posts_count'])
+        return len(drifted)
+
+    def fix_groups(self, actual):
+        return self.fix(Group, 'posts_count', actual)
+
+    def fix_posts(self, actual):
+        return self.fix(Post, 'comments_count', actual)
+
+    def fix(self, model, field, actual):
+        stored = model.objects.filter(pk__in=actual).values_list('pk', field)
+        drifted = [model(pk=pk, **{field: actual[pk]})
+                   for pk, count in stored if count != actual[pk]]
+        model.objects.bulk_update(drifted, [field])
+        return len(drifted)
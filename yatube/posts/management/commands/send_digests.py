@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.consts import DIGEST_CHUNK_SIZE
+from posts.digests import send_digests
+
+
+class Command(BaseCommand):
+    help = ('Пишет подписчикам, включившим письма, по одному письму '
+            'с новыми постами их авторов. Запускайте периодически, '
+            'например раз в сутки из cron; письма отправит run_workers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=DIGEST_CHUNK_SIZE,
+            help='Скольких подписчиков обрабатывать за одну транзакцию.',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size должен быть положительным.')
+        sent = send_digests(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Написано писем: {sent}'))
@@ -0,0 +1,50 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from posts.consts import THUMBNAIL_WIDTHS
+from posts.models import Post
+from posts.thumbnails import FORMATS, lookup
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает размер вариантов миниатюр с прежней миниатюрой '
+            'наибольшей ширины по всем картинкам постов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько картинок искать в хранилище sorl за раз.',
+        )
+
+    def handle(self, *args, **options):
+        images = Post.objects.exclude(image='').order_by().values_list(
+            'image', flat=True).distinct()
+        batch_size = options['batch_size']
+        totals = dict.fromkeys(
+            [(image_format, width) for image_format in FORMATS
+             for width in THUMBNAIL_WIDTHS], 0)
+        counted = missing = originals = 0
+        names = list(images)
+        for start in range(0, len(names), batch_size):
+            batch = [Post(image=name).image
+                     for name in names[start:start + batch_size]]
+            for name, variants in lookup(batch).items():
+                if len(variants) < len(totals):
+                    missing += 1
+                    continue
+                counted += 1
+                originals += default_storage.size(name)
+                for variant, file in variants.items():
+                    totals[variant] += default_storage.size(file.name)
+        baseline = totals[None, THUMBNAIL_WIDTHS[-1]]
+        self.stdout.write(
+            f'Картинок: {counted}, без полного набора вариантов: {missing}')
+        self.stdout.write(
+            f'Исходные файлы: {originals} байт, прежние миниатюры '
+            f'{THUMBNAIL_WIDTHS[-1]}w: {baseline} байт')
+        for (image_format, width), size in totals.items():
+            saved = 100 * (baseline - size) / baseline if baseline else 0
+            self.stdout.write(
+                f'{image_format or "исходный":>8} {width:>5}w '
+                f'было {baseline:>12} байт, стало {size:>12} байт, '
+                f'экономия {baseline - size:>12} байт ({saved:5.1f}%)')
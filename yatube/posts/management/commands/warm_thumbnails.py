@@ -0,0 +1,36 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from core.pools import process_pool
+from posts.models import Post
+from posts.thumbnails import generate
+
+
+class Command(BaseCommand):
+    help = ('Создаёт миниатюры всех геометрий из шаблонов для картинок '
+            'всех постов в нескольких процессах.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число процессов; 1 — без пула, в текущем процессе.',
+        )
+
+    def handle(self, *args, **options):
+        names = list(Post.objects.exclude(image='').order_by().values_list(
+            'image', flat=True).distinct())
+        workers = options['workers']
+        if workers > 1 and len(names) > 1:
+            with process_pool(workers) as pool:
+                errors = list(pool.map(
+                    generate, names,
+                    chunksize=max(1, len(names) // (workers * 4))))
+        else:
+            errors = [generate(name) for name in names]
+        errors = [error for error in errors if error]
+        for error in errors:
+            self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Картинок обработано: {len(names) - len(errors)}, '
+            f'ошибок: {len(errors)}'))
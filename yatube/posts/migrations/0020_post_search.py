@@ -0,0 +1,78 @@
+# Generated by Django 2.2.16 on 2026-10-18 02:48
+
+import core.fts
+from django.db import migrations, models
+import django.db.models.deletion
+
+COMMENTS = (
+    "coalesce((SELECT group_concat(text, ' ') FROM posts_comment "
+    "WHERE post_id = {}), '')"
+)
+
+CREATE = [
+    'CREATE VIRTUAL TABLE posts_search USING fts5('
+    "text, comments, tokenize = 'unicode61 remove_diacritics 2')",
+    'CREATE TRIGGER posts_search_post_insert AFTER INSERT ON posts_post '
+    'BEGIN INSERT INTO posts_search (rowid, text, comments) '
+    "VALUES (new.id, new.text, ''); END",
+    'CREATE TRIGGER posts_search_post_update AFTER UPDATE OF text '
+    'ON posts_post BEGIN UPDATE posts_search SET text = new.text '
+    'WHERE rowid = new.id; END',
+    'CREATE TRIGGER posts_search_post_delete AFTER DELETE ON posts_post '
+    'BEGIN DELETE FROM posts_search WHERE rowid = old.id; END',
+    'CREATE TRIGGER posts_search_comment_insert AFTER INSERT '
+    'ON posts_comment BEGIN UPDATE posts_search SET comments = '
+    + COMMENTS.format('new.post_id') + ' WHERE rowid = new.post_id; END',
+    'CREATE TRIGGER posts_search_comment_update AFTER UPDATE OF text, post_id '
+    'ON posts_comment BEGIN UPDATE posts_search SET comments = '
+    + COMMENTS.format('posts_search.rowid')
+    + ' WHERE rowid IN (old.post_id, new.post_id); END',
+    'CREATE TRIGGER posts_search_comment_delete AFTER DELETE '
+    'ON posts_comment BEGIN UPDATE posts_search SET comments = '
+    + COMMENTS.format('old.post_id') + ' WHERE rowid = old.post_id; END',
+    'INSERT INTO posts_search (rowid, text, comments) '
+    'SELECT id, text, ' + COMMENTS.format('posts_post.id')
+    + ' FROM posts_post',
+]
+
+DROP = [
+    f'DROP TRIGGER posts_search_{table}_{event}'
+    for table in ('post', 'comment')
+    for event in ('insert', 'update', 'delete')
+] + ['DROP TABLE posts_search']
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        # FTS5 есть только в SQLite; в других базах поиск идёт через LIKE
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_content_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostSearch',
+            fields=[
+                ('post', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search', serialize=False, to='posts.Post')),
+                ('text', models.TextField()),
+                ('comments', models.TextField()),
+                ('document', core.fts.FullTextField(db_column='posts_search')),
+            ],
+            options={
+                'verbose_name': 'поисковый индекс поста',
+                'verbose_name_plural': 'поисковый индекс постов',
+                'db_table': 'posts_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(run(CREATE), run(DROP)),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-18 03:59
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='follow',
+            name='notified',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='Посты автора до этого времени уже были в письмах', verbose_name='Посты отправлены по'),
+        ),
+        migrations.AddField(
+            model_name='follow',
+            name='notify',
+            field=models.BooleanField(default=False, verbose_name='Присылать новые посты на почту'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(condition=models.Q(notify=True), fields=['user'], name='follow_notify_user_idx'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+from importlib import import_module
+
+import core.fts
+from django.db import migrations, models
+import django.db.models.deletion
+
+previous = import_module('posts.migrations.0020_post_search')
+
+# строка поста: rowid — id поста; строка комментария: rowid — минус id
+# комментария, его текст в comments
+CREATE = [
+    'CREATE VIRTUAL TABLE posts_search USING fts5('
+    'text, comments, post UNINDEXED, '
+    "tokenize = 'unicode61 remove_diacritics 2')",
+    'CREATE TRIGGER posts_search_post_insert AFTER INSERT ON posts_post '
+    'BEGIN INSERT INTO posts_search (rowid, text, comments, post) '
+    "VALUES (new.id, new.text, '', new.id); END",
+    'CREATE TRIGGER posts_search_post_update AFTER UPDATE OF text '
+    'ON posts_post BEGIN UPDATE posts_search SET text = new.text '
+    'WHERE rowid = new.id; END',
+    # комментарии поста удаляет ORM, и их строки убирают свои триггеры
+    'CREATE TRIGGER posts_search_post_delete AFTER DELETE ON posts_post '
+    'BEGIN DELETE FROM posts_search WHERE rowid = old.id; END',
+    'CREATE TRIGGER posts_search_comment_insert AFTER INSERT '
+    'ON posts_comment BEGIN INSERT INTO posts_search '
+    "(rowid, text, comments, post) VALUES (-new.id, '', new.text, "
+    'new.post_id); END',
+    'CREATE TRIGGER posts_search_comment_update AFTER UPDATE OF text, post_id '
+    'ON posts_comment BEGIN UPDATE posts_search SET comments = new.text, '
+    'post = new.post_id WHERE rowid = -old.id; END',
+    'CREATE TRIGGER posts_search_comment_delete AFTER DELETE '
+    'ON posts_comment BEGIN DELETE FROM posts_search '
+    'WHERE rowid = -old.id; END',
+    'INSERT INTO posts_search (rowid, text, comments, post) '
+    "SELECT id, text, '', id FROM posts_post",
+    'INSERT INTO posts_search (rowid, text, comments, post) '
+    "SELECT -id, '', text, post_id FROM posts_comment",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0023_post_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='PostSearch',
+        ),
+        migrations.CreateModel(
+            name='PostSearch',
+            fields=[
+                ('id', models.BigIntegerField(db_column='rowid', primary_key=True, serialize=False)),
+                ('post', models.ForeignKey(db_column='post', on_delete=django.db.models.deletion.DO_NOTHING, related_name='search', to='posts.Post')),
+                ('text', models.TextField()),
+                ('comments', models.TextField()),
+                ('rank', models.FloatField()),
+                ('document', core.fts.FullTextField(db_column='posts_search')),
+            ],
+            options={
+                'verbose_name': 'поисковый индекс поста',
+                'verbose_name_plural': 'поисковый индекс постов',
+                'db_table': 'posts_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(previous.run(previous.DROP + CREATE),
+                             previous.run(previous.DROP + previous.CREATE)),
+    ]
@@ -1,8 +1,12 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 from django.db.models import CheckConstraint, F, Q, UniqueConstraint
+from django.utils import timezone
+
+from core.fts import FullTextField
 
 from .consts import COMMENT_LENGTH, POST_LENGTH
+from .storage import content_storage
 
 User = get_user_model()
 
@@ -11,6 +15,11 @@ class Group(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField()
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Число постов',
+        default=0,
+        editable=False,
+    )
 
     def __str__(self):
         return self.title
@@ -47,9 +56,21 @@ class Post(models.Model):
     image = models.ImageField(
         verbose_name='Изображение',
         upload_to='posts/',
+        storage=content_storage,
+        db_index=True,
         blank=True,
         null=True
     )
+    comments_count = models.PositiveIntegerField(
+        verbose_name='Число комментариев',
+        default=0,
+        editable=False,
+    )
+    version = models.PositiveIntegerField(
+        verbose_name='Версия',
+        default=0,
+        editable=False,
+    )
 
     def __str__(self):
         return self.text[:POST_LENGTH]
@@ -58,6 +79,15 @@ class Post(models.Model):
         verbose_name = 'пост'
         verbose_name_plural = 'посты'
         ordering = ('-pub_date',)
+        indexes = [
+            # id — последнее поле ключа курсора лент
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_id_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_id_idx'),
+        ]
 
 
 class Comment(models.Model):
@@ -86,6 +116,11 @@ class Comment(models.Model):
         verbose_name = 'комментарий'
         verbose_name_plural = 'комментарии'
         ordering = ('-created',)
+        indexes = [
+            # id — последнее поле ключа курсора комментариев
+            models.Index(fields=['post', '-created', '-id'],
+                         name='comment_post_created_id_idx'),
+        ]
 
 
 class Follow(models.Model):
@@ -101,6 +136,15 @@ class Follow(models.Model):
         on_delete=models.CASCADE,
         related_name='following',
     )
+    notify = models.BooleanField(
+        verbose_name='Присылать новые посты на почту',
+        default=False,
+    )
+    notified = models.DateTimeField(
+        verbose_name='Посты отправлены по',
+        help_text='Посты автора до этого времени уже были в письмах',
+        default=timezone.now,
+    )
 
     class Meta:
         verbose_name = 'подписка'
@@ -109,3 +153,89 @@ class Follow(models.Model):
             CheckConstraint(name='check_follow', check=~Q(user=F('author'))),
             UniqueConstraint(fields=['user', 'author'], name='unique_follow'),
         ]
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+            models.Index(fields=['user'], condition=Q(notify=True),
+                         name='follow_notify_user_idx'),
+        ]
+
+
+class AuthorStats(models.Model):
+    """Счётчики автора, которые дорого считать на каждом показе."""
+    author = models.OneToOneField(
+        User,
+        verbose_name='автор',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+    )
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Число постов',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'статистика автора'
+        verbose_name_plural = 'статистика авторов'
+
+
+class Timeline(models.Model):
+    """Материализованная лента подписок: запись на каждую пару
+    (подписчик, пост автора, на которого он подписан)."""
+    user = models.ForeignKey(
+        User,
+        verbose_name='подписчик',
+        on_delete=models.CASCADE,
+        related_name='timeline',
+    )
+    post = models.ForeignKey(
+        Post,
+        verbose_name='пост',
+        on_delete=models.CASCADE,
+        related_name='timeline',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'запись ленты'
+        verbose_name_plural = 'записи ленты'
+        constraints = [
+            UniqueConstraint(fields=['user', 'post'], name='unique_timeline'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_date_idx'),
+        ]
+
+
+class PostSearch(models.Model):
+    """Полнотекстовый индекс FTS5 по тексту поста и его комментариям.
+
+    Строка поста (rowid — id поста) хранит его текст, а у каждого
+    комментария своя строка (rowid — минус id комментария) с текстом
+    в comments: новый комментарий индексируется отдельно, не трогая
+    остальные. Столбец post связывает строку с постом, rank — скрытый
+    столбец FTS5 с релевантностью bm25. Таблицу и триггеры, которые
+    держат её в согласии с постами и комментариями, создаёт миграция
+    (только в SQLite).
+    """
+    id = models.BigIntegerField(primary_key=True, db_column='rowid')
+    post = models.ForeignKey(
+        Post,
+        db_column='post',
+        on_delete=models.DO_NOTHING,
+        related_name='search',
+    )
+    text = models.TextField()
+    comments = models.TextField()
+    rank = models.FloatField()
+    document = FullTextField(db_column='posts_search')
+
+    class Meta:
+        managed = False
+        db_table = 'posts_search'
+        verbose_name = 'поисковый индекс поста'
+        verbose_name_plural = 'поисковый индекс постов'
@@ -0,0 +1,85 @@
+"""Полнотекстовый поиск по постам и комментариям (SQLite FTS5).
+
+Индекс posts_search обновляют триггеры из миграции 0024, поэтому он
+согласован и при массовых операциях в обход сигналов. У поста и у
+каждого его комментария в индексе своя строка; пост находится по любой
+из них, а его релевантность — лучшая bm25 среди найденных строк.
+Результаты листаются курсором по (rank, id), фрагменты с найденными
+словами достаются отдельным запросом только для постов страницы.
+"""
+from django.db import connection
+from django.db.models import FloatField, Min, Value
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from core.fts import Snippet, quote_query
+
+from .models import Post, PostSearch
+
+SEARCH_ORDERING = ('rank', 'id')
+# метки найденных слов: символы из области частного использования,
+# которых нет в тексте, — их заменяют на <mark> уже после экранирования
+MARK_START, MARK_END = '\ue000', '\ue001'
+
+REBUILD_POSTS = (
+    'INSERT INTO posts_search (rowid, text, comments, post) '
+    "SELECT id, text, '', id FROM posts_post "
+    'WHERE id > %s ORDER BY id LIMIT %s'
+)
+REBUILD_COMMENTS = (
+    'INSERT INTO posts_search (rowid, text, comments, post) '
+    "SELECT -id, '', text, post_id FROM posts_comment "
+    'WHERE post_id > %s AND post_id <= %s'
+)
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def search_posts(text):
+    """Посты, найденные по тексту запроса, с rank; фрагменты для
+    страницы добавляет snippets."""
+    query = quote_query(text)
+    posts = Post.objects.select_related('author', 'group')
+    if not query:
+        # пустой запрос листается тем же курсором, что и результаты
+        return posts.annotate(rank=Value(0.0, FloatField())).none()
+    if not available():
+        # без FTS5: поиск подстроки, порядок — по id
+        return posts.filter(text__icontains=text).annotate(
+            rank=Value(0.0, FloatField()))
+    # строки поста и его комментариев сворачиваются в одну
+    return posts.filter(search__document__match=query).annotate(
+        rank=Min('search__rank'))
+
+
+def matching(text):
+    """id постов, найденных по тексту запроса, для фильтра pk__in."""
+    return PostSearch.objects.filter(
+        document__match=quote_query(text)).values('post')
+
+
+def snippets(posts, text):
+    """Кладёт в post.snippet фрагмент лучшей найденной строки поста
+    или его комментария с выделенными словами."""
+    posts = list(posts)
+    query = quote_query(text)
+    found = {}
+    if query and available() and posts:
+        rows = PostSearch.objects.filter(
+            document__match=query,
+            post__in=[post.pk for post in posts],
+        ).annotate(
+            snippet=Snippet('document', MARK_START, MARK_END),
+        ).order_by('-rank').values_list('post', 'snippet')
+        # строки от худшей к лучшей: лучшая записывается последней
+        found = dict(rows)
+    for post in posts:
+        post.snippet = highlight(found.get(post.pk, post.text))
+
+
+def highlight(snippet):
+    """Экранирует фрагмент и выделяет найденные слова."""
+    return mark_safe(escape(snippet).replace(MARK_START, '<mark>').replace(
+        MARK_END, '</mark>'))
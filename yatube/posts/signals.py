@@ -0,0 +1,241 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from sorl.thumbnail import delete as delete_thumbnails
+
+from core import jobs
+
+from . import autocomplete, feed_cache
+from .bulk import batch_size
+from .consts import IMAGE_RELEASE_GRACE, TIMELINE_BATCH_SIZE
+from .models import AuthorStats, Comment, Follow, Group, Post, Timeline, User
+
+# поля пользователя, которые выводятся на страницах лент
+SHOWN_USER_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if not created:
+        return
+    followers = Follow.objects.filter(
+        author_id=instance.author_id).values_list('user_id', flat=True)
+    Timeline.objects.bulk_create(
+        (Timeline(user_id=user_id, post=instance, pub_date=instance.pub_date)
+         for user_id in followers.iterator()),
+        batch_size=batch_size(Timeline, TIMELINE_BATCH_SIZE),
+    )
+
+
+@receiver(post_save, sender=Follow)
+def fill_timeline(sender, instance, created, **kwargs):
+    """Добавляет в ленту подписчика все посты нового автора."""
+    if not created:
+        return
+    posts = Post.objects.filter(
+        author_id=instance.author_id).values_list('id', 'pub_date')
+    Timeline.objects.bulk_create(
+        (Timeline(user_id=instance.user_id, post_id=post_id,
+                  pub_date=pub_date)
+         for post_id, pub_date in posts.iterator()),
+        batch_size=batch_size(Timeline, TIMELINE_BATCH_SIZE),
+    )
+
+
+@receiver(post_delete, sender=Follow)
+def trim_timeline(sender, instance, **kwargs):
+    """Убирает из ленты посты автора после отписки."""
+    Timeline.objects.filter(
+        user_id=instance.user_id,
+        post__author_id=instance.author_id,
+    ).delete()
+
+
+def change_author_posts(author_id, delta):
+    stats = AuthorStats.objects.filter(author_id=author_id)
+    if delta < 0:
+        stats = stats.filter(posts_count__gte=-delta)
+    if not stats.update(posts_count=F('posts_count') + delta) and delta > 0:
+        AuthorStats.objects.get_or_create(
+            author_id=author_id, defaults={'posts_count': delta})
+
+
+def change_group_posts(group_id, delta):
+    if group_id is None:
+        return
+    groups = Group.objects.filter(pk=group_id)
+    if delta < 0:
+        groups = groups.filter(posts_count__gte=-delta)
+    groups.update(posts_count=F('posts_count') + delta)
+
+
+@receiver(pre_save, sender=Post)
+def bump_version(sender, instance, **kwargs):
+    """Новая версия поста — новые ключи его закэшированных карточек."""
+    if instance.pk is not None:
+        instance.version += 1
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous(sender, instance, **kwargs):
+    """Запоминает прежние группу и картинку поста, чтобы перенести
+    счётчик и освободить заменённый файл."""
+    if instance.pk is not None:
+        instance._previous_group_id, instance._previous_image = (
+            Post.objects.filter(pk=instance.pk).values_list(
+                'group_id', 'image').first() or (None, ''))
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, **kwargs):
+    if created:
+        change_author_posts(instance.author_id, 1)
+        change_group_posts(instance.group_id, 1)
+        return
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    if previous_group_id != instance.group_id:
+        change_group_posts(previous_group_id, -1)
+        change_group_posts(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, **kwargs):
+    change_author_posts(instance.author_id, -1)
+    change_group_posts(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(
+            comments_count=F('comments_count') + 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id, comments_count__gt=0).update(
+        comments_count=F('comments_count') - 1)
+
+
+def bump_post_feeds(post, group_ids):
+    slugs = Group.objects.filter(
+        pk__in=group_ids - {None}).values_list('slug', flat=True)
+    feed_cache.bump(
+        'all', f'author:{post.author.username}', f'post:{post.pk}',
+        *(f'group:{slug}' for slug in slugs))
+
+
+@receiver(post_save, sender=Post)
+def invalidate_feeds(sender, instance, **kwargs):
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    bump_post_feeds(instance, {instance.group_id, previous_group_id})
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_feeds_on_delete(sender, instance, **kwargs):
+    bump_post_feeds(instance, {instance.group_id})
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_post(sender, instance, **kwargs):
+    feed_cache.bump(f'post:{instance.post_id}')
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_names(sender, instance, created=False, **kwargs):
+    if created:
+        feed_cache.bump(f'group:{instance.slug}')
+    else:
+        feed_cache.bump('names')
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_names(sender, instance, created, update_fields,
+                            **kwargs):
+    """Имена авторов есть на всех страницах, но вход пользователя
+    сохраняет только last_login и ничего не инвалидирует."""
+    if created:
+        feed_cache.bump(f'author:{instance.username}')
+    elif update_fields is None or set(update_fields) & SHOWN_USER_FIELDS:
+        feed_cache.bump('names')
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follows(sender, instance, **kwargs):
+    """Подписки меняют страницы подписчика, но не общие ленты."""
+    feed_cache.bump(f'follows:{instance.user_id}')
+
+
+@jobs.task(max_attempts=3)
+def release_image(name):
+    """Задача очереди: удаляет файл картинки и её миниатюры, когда на
+    файл больше не ссылается ни один пост.
+
+    Проверка ссылок и удаление идут под блокировкой хранилища, которую
+    берёт и сохранение того же файла. Пост, который ещё не зафиксирован,
+    ссылкой не считается, поэтому файл, загруженный позже чем
+    IMAGE_RELEASE_GRACE назад, проверяется снова, когда срок истечёт.
+    Файлы со старыми именами не трогаем: их сначала переименовывает
+    convert_media.
+    """
+    # FieldFile с хранилищем поля, а не хранилищем по умолчанию
+    image = Post(image=name).image
+    storage = image.storage
+    if not storage.is_hashed(name):
+        return
+    with storage.locked(name):
+        if (not storage.exists(name)
+                or Post.objects.filter(image=name).exists()):
+            return
+        age = (timezone.now() - storage.get_modified_time(name)
+               ).total_seconds()
+        if age < IMAGE_RELEASE_GRACE:
+            jobs.enqueue(release_image, name, key=name,
+                         delay=IMAGE_RELEASE_GRACE - age)
+            return
+        delete_thumbnails(image, delete_file=False)
+        storage.delete(name)
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, **kwargs):
+    """Задача ставится в той же транзакции: откат отменит и её."""
+    previous = getattr(instance, '_previous_image', '')
+    if previous and previous != instance.image.name:
+        jobs.enqueue(release_image, previous, key=previous)
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    if instance.image:
+        jobs.enqueue(release_image, instance.image.name,
+                     key=instance.image.name)
+
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, update_fields, **kwargs):
+    """Подсказки обновляются только после фиксации транзакции,
+    чтобы откат не оставил в индексе несуществующего автора."""
+    if update_fields is None or set(update_fields) & SHOWN_USER_FIELDS:
+        transaction.on_commit(
+            lambda: autocomplete.index.put_user(instance))
+
+
+@receiver(post_save, sender=Group)
+def index_group(sender, instance, **kwargs):
+    """Смена названия группы заменяет все её ключи в индексе."""
+    transaction.on_commit(lambda: autocomplete.index.put_group(instance))
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Group)
+def unindex(sender, instance, **kwargs):
+    kind = autocomplete.USER if sender is User else autocomplete.GROUP
+    pk = instance.pk
+    transaction.on_commit(lambda: autocomplete.index.remove(kind, pk))
@@ -0,0 +1,76 @@
+"""Хранилище картинок постов, адресованное содержимым.
+
+Файл называется SHA-256 своего содержимого и лежит в двух уровнях
+подкаталогов по первым символам хеша: posts/ab/cd/abcd….jpg. Одинаковые
+загрузки сохраняются один раз, а файл удаляется, когда на него больше
+не ссылается ни один пост (см. posts.signals.release_image).
+
+Сохранение уже существующего файла и его удаление идут под общей
+блокировкой каталога (locked), а сохранение ещё и обновляет время
+изменения файла: удаление не трогает недавно загруженные файлы, на
+которые может сослаться пост, пока не зафиксированный.
+"""
+import hashlib
+import os
+import posixpath
+import re
+from contextlib import contextmanager
+
+from django.core.files import File, locks
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_NAME = re.compile(r'(?:^|/)([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}')
+LOCK_NAME = '.lock'
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    @staticmethod
+    def is_hashed(name):
+        return HASH_NAME.search(name) is not None
+
+    def hashed_name(self, name, content):
+        digest = content_hash(content)
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(posixpath.dirname(name), digest[:2],
+                              digest[2:4], digest + extension)
+
+    @contextmanager
+    def locked(self, name):
+        """Блокировка каталога файла, общая для всех процессов."""
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, LOCK_NAME), 'ab') as lock_file:
+            locks.lock(lock_file, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(lock_file)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        with self.locked(name):
+            if self.exists(name):
+                # такой файл уже есть — повторная загрузка ничего не
+                # пишет, но откладывает его удаление
+                os.utime(self.path(name))
+                return name
+            return self._save(name, content)
+
+
+content_storage = ContentAddressedStorage()
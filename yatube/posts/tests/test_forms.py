@@ -1,12 +1,22 @@
 import shutil
+import struct
 import tempfile
+import zlib
+from io import BytesIO
+from unittest import mock
 
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
+from ..consts import IMAGE_MAX_PIXELS, IMAGE_MAX_SIDE
+from ..forms import PostForm
+from ..images import ORIENTATION, ingest
 from ..models import Comment, Group, Post, User
+from ..storage import content_hash
 from .consts import (TEST_AUTHOR, TEST_COMMENT, TEST_DESC, TEST_EDIT_TEXT,
                      TEST_IMAGE, TEST_SLUG, TEST_SLUG2, TEST_TEXT, TEST_TEXT2,
                      TEST_TITLE, TEST_TITLE2)
@@ -105,7 +115,10 @@ class PostFormTests(TestCase):
         self.assertEqual(post.author, self.post.author)
         self.assertEqual(post.text, form_data.get('text'))
         self.assertEqual(post.group.id, form_data.get('group'))
-        self.assertEqual(post.image, f'posts/{self.uploaded}')
+        # файл назван по хешу содержимого
+        digest = content_hash(post.image)
+        self.assertEqual(
+            post.image, f'posts/{digest[:2]}/{digest[2:4]}/{digest}.gif')
 
     def test_post_edit_form_guest(self):
         """Гость не может редактировать пост"""
@@ -221,3 +234,77 @@ class PostFormTests(TestCase):
         self.assertNotContains(post_page, form_data.get('text'))
         # Количество комментариев не увеличилось
         self.assertEqual(Comment.objects.count(), comment_count)
+
+
+class ImageIngestTests(TestCase):
+    @staticmethod
+    def jpeg(size, **options):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'JPEG', **options)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(),
+                                  content_type='image/jpeg')
+
+    def clean(self, upload):
+        form = PostForm(data={'text': TEST_TEXT}, files={'image': upload})
+        form.is_valid()
+        return form
+
+    def test_large_jpeg_is_downscaled_rotated_and_stripped(self):
+        exif = Image.Exif()
+        exif[ORIENTATION] = 6  # снято с поворотом на 90°
+        exif[0x010F] = 'Camera'
+        width, height = 6000, 2000
+        form = self.clean(self.jpeg((width, height), exif=exif.tobytes()))
+        image = form.cleaned_data['image']
+        # JPEG распакован в половинном масштабе
+        self.assertLessEqual(image.decoded_bytes, width * height)
+        with Image.open(image) as result:
+            self.assertEqual(max(result.size), IMAGE_MAX_SIDE)
+            self.assertGreater(result.height, result.width)
+            self.assertEqual(dict(result.getexif()), {})
+
+    def test_png_is_stripped_of_exif(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        buffer = BytesIO()
+        Image.new('RGB', (20, 10), 'red').save(
+            buffer, 'PNG', exif=exif.tobytes())
+        form = self.clean(SimpleUploadedFile(
+            'picture.png', buffer.getvalue(), content_type='image/png'))
+        with Image.open(form.cleaned_data['image']) as result:
+            self.assertEqual(result.format, 'PNG')
+            self.assertNotIn('exif', result.info)
+            self.assertEqual(dict(result.getexif()), {})
+
+    def test_large_rgba_png_is_downscaled(self):
+        buffer = BytesIO()
+        Image.new('RGBA', (6000, 3000), (255, 0, 0, 128)).save(buffer, 'PNG')
+        form = self.clean(SimpleUploadedFile(
+            'picture.png', buffer.getvalue(), content_type='image/png'))
+        self.assertTrue(form.is_valid(), form.errors)
+        with Image.open(form.cleaned_data['image']) as result:
+            self.assertEqual(result.size, (IMAGE_MAX_SIDE, 1280))
+
+    def test_large_png_is_refused_before_decoding(self):
+        # только заголовок PNG: RGBA 7000×7000 в пределе пикселей,
+        # но распаковка заняла бы около 196 МБ
+        side = 7000
+        self.assertLessEqual(side * side, IMAGE_MAX_PIXELS)
+
+        def chunk(kind, data=b''):
+            return (struct.pack('>I', len(data)) + kind + data
+                    + struct.pack('>I', zlib.crc32(kind + data)))
+
+        png = b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack(
+            '>IIBBBBB', side, side, 8, 6, 0, 0, 0)) + chunk(b'IDAT') + chunk(
+                b'IEND')
+        upload = SimpleUploadedFile('big.png', png, content_type='image/png')
+        with self.assertRaises(ValidationError) as error:
+            ingest(upload)
+        self.assertEqual(error.exception.code, 'image_too_large')
+
+    def test_image_over_pixel_limit_is_rejected(self):
+        with mock.patch('posts.images.IMAGE_MAX_PIXELS', 100):
+            form = self.clean(self.jpeg((20, 10)))
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
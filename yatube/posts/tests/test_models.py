@@ -1,8 +1,27 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
 
-from ..consts import POST_LENGTH
-from ..models import Group, Post, User
-from .consts import TEST_DESC, TEST_SLUG, TEST_TEXT, TEST_TITLE
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.models import Job
+
+from ..consts import IMAGE_RELEASE_GRACE, POST_LENGTH
+from ..dumps import DumpError, iter_array, iter_records
+from ..models import (AuthorStats, Comment, Follow, Group, Post, Timeline,
+                      User)
+from .consts import (TEST_COMMENT, TEST_DESC, TEST_IMAGE, TEST_SLUG,
+                     TEST_TEXT, TEST_TITLE)
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
 class PostModelTests(TestCase):
@@ -46,3 +65,232 @@ class PostModelTests(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     self.post._meta.get_field(field).help_text, expected_value)
+
+
+class CountersTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='leo')
+        cls.group = Group.objects.create(
+            title=TEST_TITLE,
+            slug=TEST_SLUG,
+            description=TEST_DESC,
+        )
+
+    def assertCounters(self, author_posts, group_posts):
+        self.user.stats.refresh_from_db()
+        self.group.refresh_from_db()
+        self.assertEqual(self.user.stats.posts_count, author_posts)
+        self.assertEqual(self.group.posts_count, group_posts)
+
+    def test_counters_follow_posts_and_comments(self):
+        """Счётчики меняются при создании, переносе и удалении"""
+        post = Post.objects.create(
+            author=self.user, text=TEST_TEXT, group=self.group)
+        Post.objects.create(author=self.user, text=TEST_TEXT)
+        self.assertCounters(author_posts=2, group_posts=1)
+        comment = Comment.objects.create(
+            post=post, author=self.user, text=TEST_COMMENT)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        post.group = None
+        post.save()
+        self.assertCounters(author_posts=2, group_posts=0)
+        post.delete()
+        self.assertCounters(author_posts=1, group_posts=0)
+
+    def test_reconcile_counters_command(self):
+        """reconcile_counters исправляет рассинхронизацию"""
+        post = Post.objects.create(
+            author=self.user, text=TEST_TEXT, group=self.group)
+        Comment.objects.create(post=post, author=self.user, text=TEST_COMMENT)
+        AuthorStats.objects.all().delete()
+        Group.objects.update(posts_count=5)
+        Post.objects.update(comments_count=0)
+        call_command('reconcile_counters', batch_size=1, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertCounters(author_posts=1, group_posts=1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentStorageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='leo')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, name='small.gif'):
+        post = Post(author=self.user, text=TEST_TEXT)
+        post.image.save(name, ContentFile(TEST_IMAGE), save=False)
+        post.save()
+        return post
+
+    def release(self):
+        call_command('run_workers', '--workers', '1', '--once',
+                     stdout=StringIO())
+
+    @mock.patch('posts.signals.IMAGE_RELEASE_GRACE', 0)
+    def test_same_upload_is_stored_once(self):
+        first = self.create_post('small.gif')
+        second = self.create_post('repost.gif')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.storage.is_hashed(first.image.name))
+        path = first.image.path
+        first.delete()
+        self.release()
+        # файл нужен второму посту
+        self.assertTrue(os.path.exists(path))
+        second.delete()
+        self.release()
+        self.assertFalse(os.path.exists(path))
+
+    def test_recent_upload_is_released_later(self):
+        post = self.create_post()
+        path = post.image.path
+        post.delete()
+        self.release()
+        self.assertTrue(os.path.exists(path))
+        job = Job.objects.get(status=Job.QUEUED)
+        self.assertEqual(job.key, post.image.name)
+        self.assertGreater(job.run_at, timezone.now())
+
+    def test_upload_in_flight_keeps_file(self):
+        post = self.create_post()
+        path = post.image.path
+        old = time.time() - IMAGE_RELEASE_GRACE - 1
+        os.utime(path, (old, old))
+        post.delete()
+        # та же картинка загружена, но пост с ней ещё не сохранён
+        name = post.image.storage.save(
+            'posts/again.gif', ContentFile(TEST_IMAGE))
+        self.assertEqual(name, post.image.name)
+        self.release()
+        self.assertTrue(os.path.exists(path))
+
+    def test_convert_media_command(self):
+        storage = Post._meta.get_field('image').storage
+        names = [storage._save(f'posts/{name}.gif', ContentFile(TEST_IMAGE))
+                 for name in ('meme', 'meme_copy')]
+        Post.objects.bulk_create(
+            Post(author=self.user, text=TEST_TEXT, image=name)
+            for name in names)
+        call_command('convert_media', stdout=StringIO())
+        images = set(Post.objects.filter(
+            author=self.user).values_list('image', flat=True))
+        self.assertEqual(len(images), 1)
+        image = images.pop()
+        self.assertTrue(storage.is_hashed(image))
+        self.assertTrue(storage.exists(image))
+        for name in names:
+            self.assertFalse(storage.exists(name))
+
+
+class BulkImportTests(TestCase):
+    DUMP = [
+        {'model': 'auth.user', 'fields': {
+            'username': 'leo', 'password': 'august', 'first_name': 'Лев',
+            'date_joined': '2019-10-05T21:37:36.487Z'}},
+        {'model': 'auth.user', 'pk': 7, 'fields': {
+            'username': 'sonya', 'password': '!unusable',
+            'date_joined': '2019-10-05T21:37:36.487Z'}},
+        {'model': 'sessions.session', 'pk': 'x', 'fields': {}},
+        {'model': 'posts.group', 'pk': 3, 'fields': {
+            'title': TEST_TITLE, 'slug': TEST_SLUG,
+            'description': TEST_DESC}},
+        {'model': 'posts.post', 'pk': 10, 'fields': {
+            'text': TEST_TEXT, 'pub_date': '1854-03-14T00:00:00Z',
+            'author': ['leo'], 'group': 3, 'image': ''}},
+        {'model': 'posts.comment', 'pk': 5, 'fields': {
+            'post': 10, 'author': ['sonya'], 'text': TEST_COMMENT,
+            'created': '2022-10-04T16:59:17.880Z'}},
+        {'model': 'posts.follow', 'pk': 1, 'fields': {
+            'user': ['sonya'], 'author': ['leo']}},
+    ]
+
+    def setUp(self):
+        dump = tempfile.NamedTemporaryFile(
+            'w', suffix='.json', encoding='utf-8', delete=False)
+        with dump:
+            json.dump(self.DUMP, dump, ensure_ascii=False, indent=2)
+        self.addCleanup(os.remove, dump.name)
+        self.path = dump.name
+
+    def test_dump_is_read_record_by_record(self):
+        with open(self.path, encoding='utf-8') as dump:
+            records = list(iter_array(dump, chunk_size=7))
+        self.assertEqual(records, self.DUMP)
+        with self.assertRaises(DumpError):
+            list(iter_array(StringIO('[{"model": "auth.user"}')))
+        ndjson = '\n'.join(json.dumps(record) for record in self.DUMP)
+        self.assertEqual(
+            list(iter_records(StringIO(ndjson), chunk_size=7)), self.DUMP)
+        with self.assertRaises(DumpError):
+            list(iter_records(StringIO('{"model": "auth.user"}\n{')))
+
+    def test_bulk_import_command(self):
+        """bulk_import сохраняет даты и ключи дампа и строит
+        производные данные"""
+        out = StringIO()
+        call_command('bulk_import', self.path, '--hash-passwords',
+                     '--workers', '1', '--batch-size', '1',
+                     '--transaction-size', '2', stdout=out)
+        self.assertIn('sessions.session — 1', out.getvalue())
+        leo = User.objects.get(username='leo')
+        self.assertTrue(leo.check_password('august'))
+        self.assertFalse(
+            User.objects.get(username='sonya').has_usable_password())
+        post = Post.objects.get(pk=10)
+        self.assertEqual((post.author, post.group_id, post.pub_date.year),
+                         (leo, 3, 1854))
+        comment = Comment.objects.get(pk=5)
+        self.assertEqual((comment.author.pk, comment.created.year),
+                         (7, 2022))
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(AuthorStats.objects.get(author=leo).posts_count, 1)
+        self.assertTrue(Timeline.objects.filter(user_id=7, post=post))
+        # повторная загрузка не создаёт дублей и не считает их
+        out = StringIO()
+        call_command('bulk_import', self.path, stdout=out)
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertIn('posts.post — 0', out.getvalue())
+        self.assertIn('Уже были в базе: auth.user — 2', out.getvalue())
+        self.assertTrue(User.objects.get(username='leo').check_password(
+            'august'))
+
+    def test_export_stream_round_trip(self):
+        """export_stream выгружает NDJSON, который читает bulk_import,
+        а --since оставляет только новые записи"""
+        call_command('bulk_import', self.path, '--hash-passwords',
+                     '--workers', '1', stdout=StringIO())
+        export = os.path.join(tempfile.mkdtemp(), 'export.ndjson.gz')
+        self.addCleanup(shutil.rmtree, os.path.dirname(export))
+        out = StringIO()
+        call_command('export_stream', export, '--chunk-size', '1',
+                     stdout=out)
+        self.assertIn('posts.follow — 1', out.getvalue())
+        self.assertFalse(os.path.exists(f'{export}.part'))
+        comment = Comment.objects.get()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        call_command('bulk_import', export, stdout=StringIO())
+        self.assertTrue(User.objects.get(username='leo').check_password(
+            'august'))
+        self.assertEqual(Comment.objects.get().created, comment.created)
+        self.assertTrue(Follow.objects.filter(
+            user__username='sonya', author__username='leo'))
+        out = StringIO()
+        call_command('export_stream', export, '--since', '2020-01-01',
+                     stdout=out)
+        self.assertIn('auth.user — 0, posts.group — 1, posts.post — 0, '
+                      'posts.comment — 1', out.getvalue())
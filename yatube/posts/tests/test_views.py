@@ -1,17 +1,37 @@
+import base64
+import json
+import os
 import shutil
 import tempfile
+from io import StringIO
+from unittest import mock
 
 from django import forms
 from django.conf import settings
+from django.core import mail
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models import F
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from sorl.thumbnail import get_thumbnail
 
-from ..consts import LIMIT_POSTS
-from ..models import Comment, Follow, Group, Post, User
-from .consts import (TEST_COMMENT, TEST_DESC, TEST_IMAGE, TEST_SLUG, TEST_TEXT,
-                     TEST_TITLE)
+from core import jobs
+from core.models import Job
+from core.query_budget import query_budget
+
+from .. import autocomplete, follows, thumbnails
+from ..consts import LIMIT_COMMENTS, LIMIT_POSTS, THUMBNAIL_WIDTHS
+from ..models import (Comment, Follow, Group, Post, PostSearch, Timeline,
+                      User)
+from ..utils import KeysetPaginator, NumberedPaginator, card_key
+from .consts import (TEST_COMMENT, TEST_DESC, TEST_EDIT_TEXT, TEST_IMAGE,
+                     TEST_SLUG, TEST_TEXT, TEST_TEXT2, TEST_TITLE,
+                     TEST_TITLE2)
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -130,9 +150,7 @@ class PostPagesTests(TestCase):
             response.context.get('form').fields.get('text'),
             form_fields.get('text')
         )
-        self.assertTrue(
-            response.context.get('comments').get(text=self.comment)
-        )
+        self.assertIn(self.comment, response.context.get('comments'))
 
     def test_post_create_edit_correct_context(self):
         responses = [
@@ -163,6 +181,91 @@ class PostPagesTests(TestCase):
                 self.post_asserts(post, expected, self.post.image)
                 self.assertEqual(post_count, 1)
 
+    def test_post_edit_queues_thumbnails(self):
+        with mock.patch('posts.thumbnails.queue') as queue:
+            self.authorized_client.post(
+                self.urls['post_edit'],
+                {'text': TEST_EDIT_TEXT, 'group': self.group.pk},
+            )
+        queue.assert_called_once_with(self.post)
+
+    def test_thumbnails_are_generated_by_job_queue(self):
+        thumbnails.queue(self.post)
+        thumbnails.queue(self.post)
+        job = Job.objects.get()
+        self.assertEqual(job.key, self.post.image.name)
+        call_command('run_workers', '--workers', '1', '--once',
+                     stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        post = Post.objects.get(pk=self.post.pk)
+        thumbnails.prefetch([post])
+        self.assertIsNotNone(post.thumbnail)
+
+    def test_unreadable_image_fails_generation(self):
+        self.assertIsNotNone(thumbnails.generate('posts/missing.gif'))
+
+    def test_warm_thumbnails_command(self):
+        shutil.rmtree(os.path.join(TEMP_MEDIA_ROOT, 'cache'),
+                      ignore_errors=True)
+        out = StringIO()
+        call_command('warm_thumbnails', '--workers', '1', stdout=out)
+        self.assertIn('ошибок: 0', out.getvalue())
+        self.assertTrue(os.listdir(os.path.join(TEMP_MEDIA_ROOT, 'cache')))
+
+    def test_thumbnails_prefetched_in_one_lookup(self):
+        self.assertIsNone(thumbnails.generate(self.post.image.name))
+        thumbnail = get_thumbnail(
+            self.post.image, '960x339', crop='center', upscale=True)
+        cache.clear()
+        post = Post.objects.get(pk=self.post.pk)
+        with self.assertNumQueries(1):
+            thumbnails.prefetch([post])
+        self.assertEqual(post.thumbnail.url, thumbnail.url)
+        for width in THUMBNAIL_WIDTHS:
+            self.assertIn(f' {width}w', post.srcset)
+        with self.assertNumQueries(0):
+            thumbnails.prefetch([post])
+        response = self.authorized_client.get(self.urls['post_detail'])
+        self.assertContains(response, f'srcset="{post.srcset}"')
+
+    def test_thumbnail_savings_command(self):
+        thumbnails.generate(self.post.image.name)
+        out = StringIO()
+        call_command('thumbnail_savings', stdout=out)
+        self.assertIn('Картинок: 1', out.getvalue())
+        original = os.path.getsize(
+            os.path.join(TEMP_MEDIA_ROOT, self.post.image.name))
+        self.assertIn(f'Исходные файлы: {original} байт', out.getvalue())
+        self.assertRegex(out.getvalue(), r'480w было +\d+ байт, стало +\d+')
+
+    def test_missing_thumbnail_is_queued_once(self):
+        post = Post.objects.create(
+            author=self.user,
+            text=TEST_TEXT2,
+            image=SimpleUploadedFile('other.gif', TEST_IMAGE, 'image/gif'),
+        )
+        urls = (self.urls['profile'], reverse(
+            'posts:post_detail', kwargs={'post_id': post.pk}))
+        # показ страницы сам миниатюр не создаёт
+        with mock.patch.object(thumbnails, 'get_thumbnail') as thumbnail:
+            for url in urls * 2:
+                response = self.authorized_client.get(url)
+                self.assertContains(response, f'src="{post.image.url}"')
+        thumbnail.assert_not_called()
+        self.assertEqual(Job.objects.filter(
+            name=jobs.name_of(thumbnails.generate_job),
+            key=post.image.name).count(), 1)
+        # карточка с исходной картинкой кэшируется ненадолго
+        self.assertIsNotNone(cache.get(card_key(post, 'profile')))
+
+    def test_unreadable_image_renders_original(self):
+        Post.objects.create(
+            author=self.user, text=TEST_TEXT2, image='posts/missing.gif')
+        response = self.authorized_client.get(self.urls['profile'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'src="/media/posts/missing.gif"')
+
 
 class PaginatorTests(TestCase):
     @classmethod
@@ -208,37 +311,475 @@ class PaginatorTests(TestCase):
                 self.assertEqual(
                     len(response_2_page.context.get('page_obj')), 1)
 
+    def test_paginator_keyset(self):
+        """Курсорная паджинация проходит ленту без пропусков и COUNT(*)"""
+        expected = list(Post.objects.order_by('-pub_date', '-id'))
+        # страница курсорной ленты — один запрос без COUNT(*) и OFFSET
+        with self.assertNumQueries(1):
+            page = KeysetPaginator(Post.objects.all(), LIMIT_POSTS).page(None)
+        self.assertEqual(list(page), expected[:LIMIT_POSTS])
+        for url in self.urls:
+            with self.subTest(url=url):
+                first_page = self.authorized_client.get(
+                    url + '?cursor=').context.get('page_obj')
+                self.assertEqual(list(first_page), expected[:LIMIT_POSTS])
+                self.assertFalse(first_page.has_previous())
+                second_page = self.authorized_client.get(
+                    f'{url}?cursor={first_page.next_cursor}'
+                ).context.get('page_obj')
+                self.assertEqual(list(second_page), expected[LIMIT_POSTS:])
+                self.assertFalse(second_page.has_next())
+                previous_page = self.authorized_client.get(
+                    f'{url}?cursor={second_page.previous_cursor}'
+                ).context.get('page_obj')
+                self.assertEqual(list(previous_page), expected[:LIMIT_POSTS])
+
+    def test_feeds_open_in_cursor_mode(self):
+        """Ленты по умолчанию курсорные и ссылаются на следующую страницу
+        курсором, без COUNT(*)"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.authorized_client.get(url)
+                page_obj = response.context.get('page_obj')
+                self.assertTrue(page_obj.is_keyset)
+                self.assertContains(
+                    response, f'?cursor={page_obj.next_cursor}')
+                self.assertFalse(any('COUNT(' in query['sql']
+                                     for query in queries))
+
+    def test_numbered_pages_continue_with_cursor(self):
+        """Номерная страница после порога ведёт дальше по курсору"""
+        expected = list(Post.objects.order_by('-pub_date', '-id'))
+        with mock.patch('posts.utils.KEYSET_AFTER_PAGE', 1):
+            for url in self.urls:
+                with self.subTest(url=url):
+                    response = self.authorized_client.get(url + '?page=1')
+                    cursor = response.context.get('page_obj').next_cursor
+                    self.assertContains(response, f'?cursor={cursor}')
+                    next_page = self.authorized_client.get(
+                        f'{url}?cursor={cursor}').context.get('page_obj')
+                    self.assertEqual(list(next_page), expected[LIMIT_POSTS:])
+
+    def test_paginator_keyset_equal_dates(self):
+        """При равных датах курсор различает посты по id"""
+        Post.objects.update(pub_date=timezone.now())
+        expected = list(Post.objects.order_by('-pub_date', '-id'))
+        paginator = KeysetPaginator(Post.objects.all(), 4)
+        pages = [paginator.page(None)]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual([post for page in pages for post in page], expected)
+        previous = paginator.page(pages[2].previous_cursor)
+        self.assertEqual(list(previous), expected[4:8])
+
+    def test_comments_load_more(self):
+        """Комментарии поста выводятся пачками, следующая приходит
+        фрагментом по курсору"""
+        post = Post.objects.create(author=self.user, text=TEST_TEXT)
+        for i in range(LIMIT_COMMENTS + 1):
+            Comment.objects.create(
+                post=post, author=self.user, text=f'{TEST_COMMENT}{i}')
+        expected = list(post.comments.order_by('-created', '-id'))
+        response = self.authorized_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.id}))
+        comments = response.context.get('comments')
+        self.assertEqual(list(comments), expected[:LIMIT_COMMENTS])
+        self.assertTrue(comments.has_next())
+        fragment = self.authorized_client.get(
+            reverse('posts:post_comments', kwargs={'post_id': post.id}),
+            {'cursor': comments.next_cursor})
+        self.assertTemplateUsed(fragment, 'posts/includes/comments.html')
+        self.assertEqual(
+            list(fragment.context.get('comments')), expected[LIMIT_COMMENTS:])
+        self.assertNotContains(fragment, 'data-fragment')
+        self.assertEqual(self.authorized_client.get(reverse(
+            'posts:post_comments', kwargs={'post_id': 0})).status_code, 404)
+
+    def test_tampered_cursor_opens_first_page(self):
+        """Подделанный курсор не ломает страницу, а открывает первую"""
+        post = Post.objects.create(author=self.user, text=TEST_TEXT)
+        urls = (reverse('posts:index'),
+                reverse('posts:search') + '?q=Тестовый',
+                reverse('posts:post_comments', kwargs={'post_id': post.id}),
+                reverse('posts:follow_index'),
+                reverse('api:index'))
+        tampered = (['x', 1], [{'a': 1}, 1], ['2020-01-01T00:00:00', 'abc'],
+                    [None, None], ['2020-01-01T00:00:00', 10 ** 30], 'x')
+        for values in tampered:
+            raw = json.dumps(dict(v=values, r=False)).encode()
+            cursor = base64.urlsafe_b64encode(raw).decode()
+            for url in urls:
+                with self.subTest(url=url, values=values):
+                    separator = '&' if '?' in url else '?'
+                    response = self.authorized_client.get(
+                        f'{url}{separator}cursor={cursor}')
+                    self.assertEqual(response.status_code, 200)
+
+    def test_paginator_elided_page_range(self):
+        """Номера страниц сокращаются многоточием"""
+        paginator = NumberedPaginator(range(LIMIT_POSTS * 20), LIMIT_POSTS)
+        self.assertEqual(
+            list(paginator.get_elided_page_range(10)),
+            [1, 2, paginator.ELLIPSIS, 7, 8, 9, 10, 11, 12, 13,
+             paginator.ELLIPSIS, 19, 20]
+        )
+
 
 class CacheTests(TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
         cls.user = User.objects.create_user(username='leo')
+        cls.group = Group.objects.create(
+            title=TEST_TITLE,
+            slug=TEST_SLUG,
+            description=TEST_DESC,
+        )
         cls.post = Post.objects.create(
             author=cls.user,
             text=TEST_TEXT,
         )
         cls.urls = {
-            'index': reverse('posts:index')
+            'index': reverse('posts:index'),
+            'group_list': reverse(
+                'posts:group_list', kwargs={'slug': cls.group.slug}),
+            'profile': reverse(
+                'posts:profile', kwargs={'username': cls.user}),
+            'post_detail': reverse(
+                'posts:post_detail', kwargs={'post_id': cls.post.id}),
         }
 
     def setUp(self):
-        self.authorized_client = Client()
-        self.authorized_client.force_login(self.user)
+        self.guest_client = Client()
+        cache.clear()
 
     def test_cache_index_page(self):
-        first_response = self.authorized_client.get(self.urls['index'])
-        self.post.delete()
-        second_response = self.authorized_client.get(self.urls['index'])
-        # контент первого запроса должен быть равен контенту второго
-        # т.к. кэш не очищен, хотя пост удалён
+        first_response = self.guest_client.get(self.urls['index'])
+        # изменение в обход событий не видно, пока страница в кэше
+        Post.objects.filter(pk=self.post.pk).update(text=TEST_EDIT_TEXT)
+        second_response = self.guest_client.get(self.urls['index'])
         self.assertEqual(first_response.content, second_response.content)
-        cache.clear()
-        third_response = self.authorized_client.get(self.urls['index'])
-        # контент первого запроса не должен быть равен контенту третьего
-        # т.к. пост удалён и кэш очищен
+        # удаление поста меняет поколение ленты, и кэш сразу устаревает
+        Post.objects.get(pk=self.post.pk).delete()
+        third_response = self.guest_client.get(self.urls['index'])
         self.assertNotEqual(first_response.content, third_response.content)
 
+    def test_new_post_invalidates_related_pages(self):
+        """Новый пост в группе сбрасывает кэш ленты, группы и автора"""
+        for url in self.urls.values():
+            self.guest_client.get(url)
+        Post.objects.create(author=self.user, text=TEST_TEXT2,
+                            group=self.group)
+        for name in ('index', 'group_list', 'profile'):
+            with self.subTest(name=name):
+                self.assertContains(
+                    self.guest_client.get(self.urls[name]), TEST_TEXT2)
+        # число постов автора на странице поста тоже обновилось
+        self.assertContains(
+            self.guest_client.get(self.urls['post_detail']),
+            'Всего постов автора: 2'
+        )
+
+    def test_comment_invalidates_post_detail(self):
+        self.guest_client.get(self.urls['post_detail'])
+        Comment.objects.create(
+            post=self.post, author=self.user, text=TEST_COMMENT)
+        self.assertContains(
+            self.guest_client.get(self.urls['post_detail']), TEST_COMMENT)
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='leo')
+        cls.group = Group.objects.create(
+            title=TEST_TITLE,
+            slug=TEST_SLUG,
+            description=TEST_DESC,
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text=TEST_TEXT,
+            group=cls.group,
+        )
+        cls.urls = {
+            'index': reverse('posts:index'),
+            'group_list': reverse(
+                'posts:group_list', kwargs={'slug': cls.group.slug}),
+            'profile': reverse(
+                'posts:profile', kwargs={'username': cls.user}),
+            'post_detail': reverse(
+                'posts:post_detail', kwargs={'post_id': cls.post.id}),
+        }
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def test_unchanged_pages_return_304(self):
+        """Повторный запрос с валидаторами не выполняет запросов страницы"""
+        urls = dict(self.urls, follow_index=reverse('posts:follow_index'))
+        for name, url in urls.items():
+            with self.subTest(name=name):
+                response = self.authorized_client.get(url)
+                with self.assertNumQueries(3):
+                    response = self.authorized_client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since_is_ignored(self):
+        """Правка старого поста не меняет дату ленты, поэтому ответ
+        по одной дате был бы устаревшим"""
+        response = self.guest_client.get(self.urls['index'])
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.post.text = TEST_EDIT_TEXT
+        self.post.save()
+        response = self.guest_client.get(
+            self.urls['index'],
+            HTTP_IF_MODIFIED_SINCE='Thu, 01 Jan 2099 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_changes_return_200(self):
+        changes = {
+            'index': lambda: Post.objects.create(
+                author=self.user, text=TEST_TEXT2),
+            'group_list': lambda: Post.objects.filter(
+                pk=self.post.pk).first().save(),
+            'profile': lambda: Group.objects.filter(
+                pk=self.group.pk).first().save(),
+            'post_detail': lambda: Comment.objects.create(
+                post=self.post, author=self.user, text=TEST_COMMENT),
+        }
+        for name, change in changes.items():
+            with self.subTest(name=name):
+                response = self.guest_client.get(self.urls[name])
+                change()
+                response = self.guest_client.get(
+                    self.urls[name], HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        guest_etag = self.guest_client.get(self.urls['index'])['ETag']
+        response = self.authorized_client.get(
+            self.urls['index'], HTTP_IF_NONE_MATCH=guest_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_superuser(
+            username='leo', email='leo@example.com', password='pass')
+        cls.posts = Post.objects.bulk_create(
+            Post(author=cls.user, text=f'Котики и <b>собаки</b> {i}')
+            for i in range(LIMIT_POSTS + 3))
+        cls.post = Post.objects.create(author=cls.user, text=TEST_TEXT)
+        Comment.objects.create(
+            post=cls.post, author=cls.user, text='Пушистый котик')
+        cls.url = reverse('posts:search')
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def test_search_finds_posts_and_comments(self):
+        response = self.guest_client.get(self.url, {'q': 'пушист'})
+        self.assertEqual(list(response.context['page_obj']), [self.post])
+        self.assertContains(response, '<mark>Пушистый</mark>')
+
+    def test_search_is_keyset_paginated_and_escaped(self):
+        response = self.guest_client.get(self.url, {'q': 'собаки'})
+        page_obj = response.context['page_obj']
+        self.assertEqual(len(page_obj), LIMIT_POSTS)
+        self.assertContains(response, '&lt;b&gt;<mark>собаки</mark>')
+        response = self.guest_client.get(
+            self.url, {'q': 'собаки', 'cursor': page_obj.next_cursor})
+        found = list(page_obj) + list(response.context['page_obj'])
+        self.assertEqual(len(set(found)), LIMIT_POSTS + 3)
+
+    def test_index_follows_edits_and_deletes(self):
+        post = Post.objects.filter(text__startswith='Котики').first()
+        post.text = 'Ежи'
+        post.save()
+        response = self.guest_client.get(self.url, {'q': 'ежи'})
+        self.assertEqual(list(response.context['page_obj']), [post])
+        post.delete()
+        response = self.guest_client.get(self.url, {'q': 'ежи'})
+        self.assertEqual(len(response.context['page_obj']), 0)
+
+    def test_comments_are_indexed_as_own_rows(self):
+        comment = Comment.objects.create(
+            post=self.post, author=self.user, text='Рыжий котик')
+        self.assertEqual(PostSearch.objects.filter(post=self.post).count(),
+                         3)
+        # пост с совпадением в тексте и в двух комментариях — один раз
+        response = self.guest_client.get(self.url, {'q': 'котик'})
+        self.assertEqual(list(response.context['page_obj']).count(
+            self.post), 1)
+        comment.text = 'Рыжая лиса'
+        comment.save()
+        response = self.guest_client.get(self.url, {'q': 'лиса'})
+        self.assertEqual(list(response.context['page_obj']), [self.post])
+        comment.delete()
+        response = self.guest_client.get(self.url, {'q': 'лиса'})
+        self.assertEqual(len(response.context['page_obj']), 0)
+
+    def test_empty_query_finds_nothing(self):
+        response = self.guest_client.get(self.url)
+        self.assertEqual(len(response.context['page_obj']), 0)
+
+    def test_operators_in_query_are_literal(self):
+        response = self.guest_client.get(self.url, {'q': 'котики OR "'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_search_uses_index(self):
+        client = Client()
+        client.force_login(self.user)
+        response = client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'пушистый'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.post])
+
+    def test_rebuild_search_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_search')
+        out = StringIO()
+        call_command('rebuild_search', '--batch-size', '5', stdout=out)
+        self.assertIn(f'Проиндексировано постов: {len(self.posts) + 1}',
+                      out.getvalue())
+        response = self.guest_client.get(self.url, {'q': 'пушистый'})
+        self.assertEqual(list(response.context['page_obj']), [self.post])
+
+
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(
+            username='leo', first_name='Лев', last_name='Толстой')
+        cls.group = Group.objects.create(
+            title='Ёжики в тумане', slug='hedgehogs', description=TEST_DESC)
+        cls.url = reverse('posts:autocomplete')
+
+    def setUp(self):
+        self.guest_client = Client()
+        cache.clear()
+
+    def suggest(self, query):
+        response = self.guest_client.get(self.url, {'q': query})
+        return [(item['type'], item['value'])
+                for item in response.json()['results']]
+
+    def test_prefix_matches_names_and_groups(self):
+        self.assertEqual(self.suggest('Толс'), [('user', 'leo')])
+        self.assertEqual(self.suggest('лев т'), [('user', 'leo')])
+        self.assertEqual(self.suggest('ежики'), [('group', 'hedgehogs')])
+        self.assertEqual(self.suggest('тум'), [('group', 'hedgehogs')])
+        self.assertEqual(self.suggest('l'), [('user', 'leo')])
+        self.assertEqual(self.suggest(''), [])
+        response = self.guest_client.get(self.url, {'q': 'leo'})
+        self.assertEqual(response.json()['results'][0]['url'],
+                         reverse('posts:profile', args=['leo']))
+
+    def test_index_is_warmed_before_first_request(self):
+        autocomplete.index.warm()
+        with query_budget(0):
+            self.assertEqual(self.suggest('Толс'), [('user', 'leo')])
+
+    def test_warm_without_database_defers_build(self):
+        with mock.patch.object(autocomplete.index, 'rebuild',
+                               side_effect=DatabaseError):
+            autocomplete.index.warm()
+        self.assertEqual(self.suggest('Толс'), [('user', 'leo')])
+
+    def test_answer_without_queries_once_built(self):
+        self.suggest('leo')
+        with query_budget(0):
+            self.assertEqual(self.suggest('hedge'),
+                             [('group', 'hedgehogs')])
+
+    @mock.patch('posts.signals.transaction.on_commit',
+                lambda callback: callback())
+    def test_signals_update_index_incrementally(self):
+        self.suggest('leo')
+        group = Group.objects.create(
+            title='Коты', slug='cats', description=TEST_DESC)
+        self.user.last_name = 'Николаевич'
+        self.user.save()
+        with query_budget(0):
+            self.assertEqual(self.suggest('кот'), [('group', 'cats')])
+            self.assertEqual(self.suggest('никол'), [('user', 'leo')])
+            self.assertEqual(self.suggest('толст'), [])
+        group.delete()
+        with query_budget(0):
+            self.assertEqual(self.suggest('кот'), [])
+
+    def test_missed_change_rebuilds_index(self):
+        self.suggest('leo')
+        # изменение из другого процесса: в базе и в поколении,
+        # но не в индексе этого процесса
+        Group.objects.create(title='Коты', slug='cats',
+                             description=TEST_DESC)
+        cache.incr(autocomplete.GENERATION_KEY)
+        self.assertEqual(self.suggest('кот'), [('group', 'cats')])
+
+    def test_autocomplete_stats_command(self):
+        out = StringIO()
+        call_command('autocomplete_stats', stdout=out)
+        self.assertIn('Пользователей: 1, групп: 1', out.getvalue())
+        self.assertIn('КиБ', out.getvalue())
+
+
+class PostCardCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='leo')
+        cls.group = Group.objects.create(
+            title=TEST_TITLE,
+            slug=TEST_SLUG,
+            description=TEST_DESC,
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text=TEST_TEXT,
+            group=cls.group,
+        )
+        cls.url = reverse('posts:group_list', kwargs={'slug': cls.group.slug})
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def test_card_is_rendered_once(self):
+        """Карточка поста берётся из кэша при повторном показе"""
+        self.authorized_client.get(self.url)
+        post = Post.objects.select_related('author', 'group').get()
+        key = card_key(post, 'feed')
+        cache.set(key, 'из кэша')
+        response = self.authorized_client.get(self.url)
+        self.assertContains(response, 'из кэша')
+
+    def test_card_changes_with_post_and_group(self):
+        """Правка поста и переименование группы меняют ключ карточки"""
+        self.guest_client.get(self.url)
+        self.post.text = TEST_EDIT_TEXT
+        self.post.save()
+        self.assertContains(self.guest_client.get(self.url), TEST_EDIT_TEXT)
+        self.group.title = TEST_TITLE2
+        self.group.save()
+        self.assertContains(
+            self.guest_client.get(self.url),
+            f'все записи группы: {TEST_TITLE2}'
+        )
+
 
 class FollowTests(TestCase):
     @classmethod
@@ -299,3 +840,213 @@ class FollowTests(TestCase):
         self.assertContains(response_follow_user, new_post)
         # проверяем, что новый пост не появился у неподписанного пользователя
         self.assertNotContains(response_unfollow_user, new_post)
+
+    def test_timeline_fan_out(self):
+        """Лента подписок заполняется и чистится при подписке и отписке"""
+        timeline = Timeline.objects.filter(user=self.user_jon)
+        self.authorized_client_1.get(self.urls['follow'])
+        new_post = Post.objects.create(author=self.user, text='Новый пост')
+        self.assertEqual(
+            set(timeline.values_list('post', flat=True)),
+            {self.post.id, new_post.id}
+        )
+        new_post.delete()
+        self.assertEqual(timeline.count(), 1)
+        self.authorized_client_1.get(self.urls['unfollow'])
+        self.assertFalse(timeline.exists())
+
+    def test_rebuild_timelines_command(self):
+        """Команда rebuild_timelines восстанавливает ленты по подпискам"""
+        Follow.objects.create(user=self.user_jon, author=self.user)
+        Timeline.objects.all().delete()
+        call_command('rebuild_timelines', stdout=StringIO())
+        response = self.authorized_client_1.get(self.urls['index'])
+        self.assertEqual(list(response.context['page_obj']), [self.post])
+
+    def test_follow_set_cache(self):
+        """Подписки берутся из кэша и обновляются при подписке,
+        отписке и переключении писем"""
+        def follow_set():
+            # новый объект: follows.get запоминает множество на объекте
+            return follows.get(User.objects.get(pk=self.user_jon.pk))
+
+        self.assertNotIn(self.user.pk, follow_set())
+        self.authorized_client_1.get(self.urls['follow'])
+        self.assertIn(self.user.pk, follow_set())
+        user = User.objects.get(pk=self.user_jon.pk)
+        follows.get(user)
+        with self.assertNumQueries(0):
+            self.assertEqual(follows.get(user).among(
+                [self.user.pk, self.user_jon.pk]), {self.user.pk})
+        self.authorized_client_1.get(reverse(
+            'posts:profile_notify', kwargs={'username': self.user}))
+        self.assertIn(self.user.pk, follow_set().notify)
+        self.authorized_client_1.get(self.urls['unfollow'])
+        self.assertFalse(follow_set())
+
+    def test_follow_with_stale_follow_set(self):
+        """Подписка, которой нет в устаревшем множестве, не дублируется"""
+        follows.get(User.objects.get(pk=self.user_jon.pk))
+        # bulk_create не шлёт сигналов, и закэшированное множество пусто
+        Follow.objects.bulk_create(
+            [Follow(user=self.user_jon, author=self.user)])
+        response = self.authorized_client_1.get(self.urls['follow'])
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Follow.objects.filter(
+            user=self.user_jon, author=self.user).count(), 1)
+
+    def test_pages_read_follows_from_cache(self):
+        """С тёплым кэшем страницы не запрашивают подписки из базы"""
+        self.authorized_client_1.get(self.urls['follow'])
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': TEST_SLUG}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            self.urls['index'],
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.authorized_client_1.get(url)
+                with CaptureQueriesContext(connection) as queries:
+                    self.authorized_client_1.get(url)
+                self.assertFalse([query for query in queries
+                                  if 'posts_follow' in query['sql']])
+        response = self.authorized_client_1.get(reverse('posts:index'))
+        self.assertContains(response, 'Вы подписаны на автора')
+
+    def test_new_posts_digest(self):
+        """Включившие письма подписчики получают одно письмо с постами,
+        вышедшими после включения"""
+        self.authorized_client_1.get(self.urls['follow'])
+        self.authorized_client_1.get(reverse(
+            'posts:profile_notify', kwargs={'username': self.user}))
+        user_sam = User.objects.create_user(
+            username='sam', email='sam@example.com')
+        Follow.objects.create(user=user_sam, author=self.user)
+        User.objects.filter(pk=self.user_jon.pk).update(
+            email='jon@example.com')
+        Post.objects.create(author=self.user, text='Первый новый')
+        Post.objects.create(author=self.user, text='Второй новый')
+        call_command('send_digests', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        digest = mail.outbox[0]
+        self.assertEqual(digest.to, ['jon@example.com'])
+        self.assertIn('Первый новый', digest.body)
+        self.assertIn('Второй новый', digest.body)
+        self.assertNotIn(TEST_TEXT, digest.body)
+        # посты уже были в письме и второй раз не придут
+        call_command('send_digests', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.authorized_client_1.get(reverse(
+            'posts:profile_mute', kwargs={'username': self.user}))
+        Post.objects.create(author=self.user, text='Третий новый')
+        call_command('send_digests', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Создаём полную страницу постов разных авторов с комментариями"""
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='leo')
+        cls.group = Group.objects.create(
+            title=TEST_TITLE,
+            slug=TEST_SLUG,
+            description=TEST_DESC,
+        )
+        authors = [User.objects.create_user(username=f'author{i}')
+                   for i in range(LIMIT_POSTS)]
+        for author in authors:
+            Follow.objects.create(user=cls.user, author=author)
+            cls.post = Post.objects.create(
+                author=author, text=TEST_TEXT, group=cls.group)
+        for author in authors:
+            Comment.objects.create(
+                post=cls.post, author=author, text=TEST_COMMENT)
+        cls.urls = {
+            'posts:index': reverse('posts:index'),
+            'posts:group_list': reverse(
+                'posts:group_list', kwargs={'slug': cls.group.slug}),
+            'posts:profile': reverse(
+                'posts:profile', kwargs={'username': cls.post.author}),
+            'posts:post_detail': reverse(
+                'posts:post_detail', kwargs={'post_id': cls.post.id}),
+            'posts:post_comments': reverse(
+                'posts:post_comments', kwargs={'post_id': cls.post.id}),
+            'posts:follow_index': reverse('posts:follow_index'),
+        }
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def test_views_fit_query_budget(self):
+        """Число запросов не зависит от числа постов на странице"""
+        for view_name, url in self.urls.items():
+            with self.subTest(view_name=view_name):
+                with query_budget(settings.QUERY_BUDGETS[view_name]):
+                    self.authorized_client.get(url)
+
+    def test_explain_views_command(self):
+        """explain_views разбирает планы запросов каждой ленты"""
+        out = StringIO()
+        call_command('explain_views', verbose_plans=True, stdout=out)
+        for view_name in self.urls:
+            with self.subTest(view_name=view_name):
+                self.assertIn(view_name, out.getvalue())
+        self.assertIn('post_author_pub_date_id_idx', out.getvalue())
+        # и страница ленты после курсора
+        self.assertIn('posts:index / cursor=', out.getvalue())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class BenchmarkTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command('generate_dataset', users=30, groups=3, posts=60,
+                     comments=40, follows=4, images=2, stdout=StringIO())
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_generate_dataset_command(self):
+        """generate_dataset создаёт связанные данные и ленты подписок"""
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Post.objects.count(), 60)
+        self.assertEqual(Comment.objects.count(), 40)
+        self.assertTrue(Post.objects.exclude(image=''))
+        self.assertFalse(Follow.objects.filter(user=F('author')))
+        self.assertTrue(Timeline.objects.exists())
+        comment = Comment.objects.select_related('post').first()
+        self.assertGreaterEqual(comment.created, comment.post.pub_date)
+
+    def test_benchmark_urls_command(self):
+        """benchmark_urls проходит все URL и сравнивает с базовым прогоном"""
+        output = os.path.join(TEMP_MEDIA_ROOT, 'baseline.json')
+        call_command('benchmark_urls', repeat=2, warmup=0, output=output,
+                     stdout=StringIO())
+        with open(output, encoding='utf-8') as baseline:
+            results = json.load(baseline)['results']
+        self.assertEqual(results['posts:index [anonymous]']['status'], 200)
+        self.assertEqual(results['posts:follow_index [user]']['status'], 200)
+        self.assertEqual(results['posts:search [user]']['status'], 200)
+        self.assertIn('about:tech [anonymous]', results)
+        self.assertIn('users:reset_confirm [anonymous]', results)
+        self.assertEqual(results['api:follow_index [user]']['status'], 200)
+        for result in results.values():
+            self.assertLessEqual(result['p50'], result['p99'])
+        follows = Follow.objects.count()
+        out = StringIO()
+        call_command('benchmark_urls', repeat=2, warmup=0, baseline=output,
+                     threshold=10 ** 6, fail=True, stdout=out)
+        self.assertIn('Регрессий нет', out.getvalue())
+        # подписки и комментарии из прогонов откатываются
+        self.assertEqual(Follow.objects.count(), follows)
@@ -0,0 +1,198 @@
+"""Генерация миниатюр картинок постов заранее, а не при первом показе.
+
+У каждой картинки есть варианты нескольких ширин (THUMBNAIL_WIDTHS) в
+формате sorl по умолчанию и, если Pillow собран с его поддержкой, в WebP.
+Для страницы постов варианты ищутся в хранилище ключей sorl одной
+пачкой (prefetch), а шаблон выводит их в srcset. Варианты создаёт
+фоновая задача, поставленная при сохранении поста, или warm_thumbnails.
+Пока их нет, страница показывает исходный файл и ставит задачу в
+очередь; сама она миниатюр не создаёт.
+"""
+import hashlib
+import logging
+
+from django.core.cache import cache
+from PIL import features
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import (DummyImageFile, ImageFile,
+                                   deserialize_image_file)
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.models import KVStore
+
+from core import jobs
+
+from .consts import (THUMBNAIL_OPTIONS, THUMBNAIL_QUEUE_TIMEOUT,
+                     THUMBNAIL_RATIO, THUMBNAIL_WIDTHS)
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+WEBP = 'WEBP'
+QUEUED_KEY = 'thumbnail_queued:{}'
+# формат None — формат sorl по умолчанию, запасной для браузеров без WebP
+FORMATS = (None, WEBP) if features.check('webp') else (None,)
+
+
+def variant(image_format, width):
+    """Геометрия и опции sorl варианта миниатюры."""
+    options = dict(THUMBNAIL_OPTIONS)
+    if image_format:
+        options['format'] = image_format
+    return f'{width}x{round(width * THUMBNAIL_RATIO)}', options
+
+
+# (формат, ширина) -> (геометрия, опции sorl)
+VARIANTS = {
+    (image_format, width): variant(image_format, width)
+    for image_format in FORMATS
+    for width in THUMBNAIL_WIDTHS
+}
+
+
+def saved(thumbnail):
+    """Нечитаемый исходник sorl не считает ошибкой: возвращает заглушку
+    или несохранённый файл без размеров."""
+    return (not isinstance(thumbnail, DummyImageFile)
+            and default.kvstore.get(thumbnail) is not None)
+
+
+def generate(name):
+    """Создаёт все миниатюры картинки; возвращает текст ошибки или None."""
+    # FieldFile, чтобы ключи sorl считались с хранилищем поля
+    image = Post(image=name).image
+    try:
+        for geometry, options in VARIANTS.values():
+            if not saved(get_thumbnail(image, geometry, **options)):
+                raise ValueError('картинку не удалось прочитать')
+    except Exception as error:
+        logger.exception('Не удалось создать миниатюры %s', name)
+        return f'{name}: {error}'
+    return None
+
+
+@jobs.task(max_attempts=3)
+def generate_job(name):
+    """Задача очереди: при ошибке обработчик повторит её позже."""
+    error = generate(name)
+    if error is not None:
+        raise RuntimeError(error)
+
+
+def queue(post):
+    """Ставит миниатюры картинки поста в очередь фоновых задач.
+
+    Задача записывается в той же транзакции, что и пост, поэтому
+    обработчик увидит и пост, и файл; пока она ждёт, повторно та же
+    картинка в очередь не встаёт.
+    """
+    if not post.image:
+        return
+    jobs.enqueue(generate_job, post.image.name, key=post.image.name)
+
+
+def queue_missing(names):
+    """Ставит в очередь миниатюры картинок одним INSERT при показе
+    страницы.
+
+    Метка в кэше на THUMBNAIL_QUEUE_TIMEOUT избавляет следующие показы
+    от запроса к базе; задачу, которая уже ждёт, ключ и так не даст
+    поставить второй раз. Упавшая после всех попыток картинка встанет
+    снова, когда истечёт метка.
+    """
+    keys = {QUEUED_KEY.format(hashlib.md5(name.encode()).hexdigest()): name
+            for name in names}
+    queued = cache.get_many(list(keys))
+    names = {key: name for key, name in keys.items() if key not in queued}
+    if not names:
+        return
+    jobs.enqueue_many(generate_job, {name: [name] for name in names.values()})
+    cache.set_many(dict.fromkeys(names, True), THUMBNAIL_QUEUE_TIMEOUT)
+
+
+def thumbnail_file(image, geometry, options):
+    """Файл миниатюры без обращения к хранилищу: имя вычисляется так же,
+    как в ThumbnailBackend.get_thumbnail."""
+    backend = default.backend
+    source = ImageFile(image)
+    options = dict(options)
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return ImageFile(name, default.storage)
+
+
+def lookup(images):
+    """{имя картинки: {(формат, ширина): ImageFile}} для сохранённых
+    вариантов — одним get_many к кэшу sorl и одним запросом к базе для
+    промахов; отсутствующие варианты тоже кэшируются."""
+    keys = {
+        add_prefix(thumbnail_file(image, geometry, options).key):
+            (image.name, variant)
+        for image in images
+        for variant, (geometry, options) in VARIANTS.items()
+    }
+    found = {image.name: {} for image in images}
+    if not keys:
+        return found
+    store = default.kvstore.cache
+    values = store.get_many(list(keys))
+    missing = [key for key in keys if key not in values]
+    if missing:
+        rows = dict(KVStore.objects.filter(
+            key__in=missing).values_list('key', 'value'))
+        # отсутствие запоминается, как в самом sorl: созданная миниатюра
+        # перезапишет ключ через kvstore.set
+        known = {key: rows.get(key, EMPTY_VALUE) for key in missing}
+        store.set_many(known, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(known)
+    for key, (name, variant) in keys.items():
+        value = values.get(key, EMPTY_VALUE)
+        if value != EMPTY_VALUE:
+            found[name][variant] = deserialize_image_file(value)
+    return found
+
+
+def srcset(files):
+    return ', '.join(f'{file.url} {file.width}w' for file in files)
+
+
+def prefetch(posts):
+    """Кладёт в пост миниатюру наибольшей ширины (post.thumbnail) и
+    srcset вариантов в запасном формате и в WebP.
+
+    Если каких-то вариантов ещё нет, post.thumbnail — None, шаблон
+    показывает исходный файл, post.thumbnail_pending истинно, а картинка
+    ставится в очередь через queue_missing.
+    """
+    posts = list(posts)
+    for post in posts:
+        post.thumbnail = None
+        post.thumbnail_pending = False
+        post.srcset = post.webp_srcset = ''
+    with_image = [post for post in posts if post.image]
+    found = lookup([post.image for post in with_image])
+    pending = []
+    for post in with_image:
+        variants = found[post.image.name]
+        if len(variants) < len(VARIANTS):
+            post.thumbnail_pending = True
+            pending.append(post.image.name)
+            continue
+        fallback = [variants[None, width] for width in THUMBNAIL_WIDTHS]
+        post.thumbnail = fallback[-1]
+        post.srcset = srcset(fallback)
+        if WEBP in FORMATS:
+            post.webp_srcset = srcset(
+                variants[WEBP, width] for width in THUMBNAIL_WIDTHS)
+    if pending:
+        queue_missing(pending)
+    return posts
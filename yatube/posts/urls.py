@@ -43,6 +43,21 @@ urlpatterns = [
         views.add_comment,
         name='add_comment',
     ),
+    path(
+        'posts/<int:post_id>/comments/',
+        views.post_comments,
+        name='post_comments',
+    ),
+    path(
+        'search/',
+        views.post_search,
+        name='search'
+    ),
+    path(
+        'autocomplete/',
+        views.suggest,
+        name='autocomplete'
+    ),
     path(
         'follow/',
         views.follow_index,
@@ -58,4 +73,14 @@ urlpatterns = [
         views.profile_unfollow,
         name='profile_unfollow'
     ),
+    path(
+        'profile/<str:username>/notify/',
+        views.profile_notify,
+        name='profile_notify'
+    ),
+    path(
+        'profile/<str:username>/mute/',
+        views.profile_mute,
+        name='profile_mute'
+    ),
 ]
@@ -1,9 +1,258 @@
-from django.core.paginator import Paginator
+import base64
+import binascii
+import hashlib
+import json
+from datetime import datetime
 
-from .consts import LIMIT_POSTS
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 
+from . import thumbnails
+from .consts import (COMMENTS_ORDERING, KEYSET_AFTER_PAGE, KEYSET_ORDERING,
+                     LIMIT_COMMENTS, LIMIT_POSTS, PAGINATOR_ON_EACH_SIDE,
+                     PAGINATOR_ON_ENDS,
+                     POST_CARD_TEMPLATES, POST_CARD_TIMEOUT, POSTS_KEYSET,
+                     THUMBNAIL_PENDING_TIMEOUT)
+from .models import Comment
 
-def get_page_context(request, queryset):
-    paginator = Paginator(queryset, LIMIT_POSTS)
-    page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+
+class NumberedPaginator(Paginator):
+    """Классический паджинатор с сокращённым списком номеров страниц."""
+    ELLIPSIS = '…'
+
+    def get_elided_page_range(self, number=1, *,
+                              on_each_side=PAGINATOR_ON_EACH_SIDE,
+                              on_ends=PAGINATOR_ON_ENDS):
+        """Номера страниц вокруг текущей и по краям, остальное — ELLIPSIS."""
+        number = self.validate_number(number)
+        if self.num_pages <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+        if number > (1 + on_each_side + on_ends) + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < (self.num_pages - on_each_side - on_ends) - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(self.num_pages - on_ends + 1, self.num_pages + 1)
+        else:
+            yield from range(number + 1, self.num_pages + 1)
+
+
+class KeysetPage(Page):
+    """Страница курсорной паджинации: без номера и без COUNT(*)."""
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        super().__init__(object_list, None, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<KeysetPage of %s items>' % len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return self.paginator.make_cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.paginator.make_cursor(self.object_list[0], reverse=True)
+
+
+class KeysetPaginator(Paginator):
+    """Курсорный паджинатор по набору полей, по умолчанию (pub_date, id).
+
+    Курсор хранит значения ключа крайнего объекта страницы, поэтому
+    следующая страница выбирается условием WHERE по индексу, а не OFFSET.
+    """
+
+    def __init__(self, object_list, per_page, ordering=KEYSET_ORDERING):
+        super().__init__(object_list, per_page)
+        self.ordering = tuple(ordering)
+        self.fields = tuple(field.lstrip('-') for field in self.ordering)
+
+    def key(self, obj):
+        """Значения полей ключа у объекта страницы."""
+        return [getattr(obj, field) for field in self.fields]
+
+    def make_cursor(self, obj, reverse=False):
+        values = self.key(obj)
+        data = dict(
+            v=[value.isoformat() if isinstance(value, datetime) else value
+               for value in values],
+            r=reverse,
+        )
+        raw = json.dumps(data, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def key_fields(self):
+        """Поля модели или аннотаций, по которым строится ключ."""
+        query = self.object_list.query
+        opts = self.object_list.model._meta
+        return [query.annotations[name].output_field
+                if name in query.annotations else opts.get_field(name)
+                for name in self.fields]
+
+    def parse_cursor(self, cursor):
+        """Возвращает (values, reverse) или None для битого курсора.
+
+        Значения приводятся к типам полей ключа: курсор приходит
+        от клиента и может быть подделан.
+        """
+        if not cursor:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            data = json.loads(raw.decode())
+            values, reverse = data['v'], bool(data['r'])
+            if (not isinstance(values, list)
+                    or len(values) != len(self.fields)
+                    or None in values):
+                return None
+            values = [field.to_python(value)
+                      for field, value in zip(self.key_fields(), values)]
+        except (binascii.Error, ValueError, TypeError, KeyError,
+                ValidationError):
+            return None
+        # SQLite хранит только 64-битные целые
+        if any(isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63
+               for value in values):
+            return None
+        return values, reverse
+
+    def _seek_filter(self, values, reverse):
+        """Строки после курсора: (a, b) < (x, y) записывается как
+        a <= x AND (a < x OR b < y). Нестрогое условие по первому полю
+        база ищет по индексу диапазоном и читает его в порядке ключа;
+        с одним OR на верхнем уровне SQLite объединяла бы ветви и
+        сортировала результат во временном B-дереве."""
+        condition = None
+        for field, order, value in reversed(
+                list(zip(self.fields, self.ordering, values))):
+            lookup = 'gt' if order.startswith('-') == reverse else 'lt'
+            after = Q(**{f'{field}__{lookup}': value})
+            if condition is not None:
+                after = Q(**{f'{field}__{lookup}e': value}) & (
+                    after | condition)
+            condition = after
+        return condition
+
+    def page(self, cursor):
+        parsed = self.parse_cursor(cursor)
+        queryset = self.object_list
+        reverse = False
+        if parsed is not None:
+            values, reverse = parsed
+            queryset = queryset.filter(self._seek_filter(values, reverse))
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            )
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            if not has_more:
+                # дошли до начала ленты — отдаём полную первую страницу
+                return self.page(None)
+            rows.reverse()
+            return KeysetPage(rows, self, has_next=True, has_previous=True)
+        return KeysetPage(rows, self, has_next=has_more,
+                          has_previous=parsed is not None)
+
+    def get_page(self, cursor):
+        return self.page(cursor)
+
+
+def get_page_context(request, queryset, keyset=POSTS_KEYSET,
+                     ordering=KEYSET_ORDERING):
+    """Страница ленты: курсорная, если в запросе есть cursor или лента
+    курсорная по умолчанию, и классическая с номерами по параметру page.
+
+    Номерная страница начиная с KEYSET_AFTER_PAGE ведёт на следующую
+    по курсору (page_obj.next_cursor): OFFSET растёт с номером страницы.
+    """
+    cursor = request.GET.get('cursor')
+    number = request.GET.get('page')
+    keyset_paginator = KeysetPaginator(queryset, LIMIT_POSTS, ordering)
+    if cursor is not None or (keyset and number is None):
+        return keyset_paginator.get_page(cursor)
+    paginator = NumberedPaginator(queryset.order_by(*ordering), LIMIT_POSTS)
+    page_obj = paginator.get_page(number)
+    page_obj.elided_page_range = list(
+        paginator.get_elided_page_range(page_obj.number))
+    page_obj.next_cursor = None
+    if page_obj.has_next() and page_obj.number >= KEYSET_AFTER_PAGE:
+        page_obj.next_cursor = keyset_paginator.make_cursor(page_obj[-1])
+    return page_obj
+
+
+def get_comments_page(request, post_id):
+    """Пачка комментариев поста от курсора из запроса: размер страницы
+    поста не зависит от числа комментариев, а авторы приходят тем же
+    запросом через JOIN."""
+    paginator = KeysetPaginator(
+        Comment.objects.filter(post_id=post_id).select_related('author'),
+        LIMIT_COMMENTS, COMMENTS_ORDERING)
+    return paginator.get_page(request.GET.get('cursor'))
+
+
+def card_key(post, variant):
+    """Ключ карточки: версия поста и отпечаток имён автора и группы,
+    которые карточка показывает, — их смена тоже даёт новый ключ."""
+    author, group = post.author, post.group
+    shown = (author.username, author.first_name, author.last_name,
+             group.slug if group else '', group.title if group else '')
+    fingerprint = hashlib.md5('\x1f'.join(shown).encode()).hexdigest()
+    created = int(post.pub_date.timestamp() * 1000000)
+    return (f'post_card:{variant}:{post.pk}:{created}:{post.version}:'
+            f'{fingerprint}')
+
+
+def attach_cards(page_obj, variant='feed'):
+    """Кладёт в post.card готовый HTML карточки для каждого поста страницы.
+
+    Карточки не зависят от пользователя, поэтому берутся из общего кэша
+    одним get_many, а отрисовываются только отсутствующие.
+    """
+    posts = {card_key(post, variant): post for post in page_obj}
+    cards = cache.get_many(list(posts))
+    missing = {key: post for key, post in posts.items() if key not in cards}
+    thumbnails.prefetch(missing.values())
+    rendered, pending = {}, {}
+    for key, post in missing.items():
+        cards[key] = render_to_string(
+            POST_CARD_TEMPLATES[variant], {'post': post})
+        # карточка с исходной картинкой живёт недолго: миниатюры скоро
+        # появятся, а ключ карточки от них не зависит
+        if post.thumbnail_pending:
+            pending[key] = cards[key]
+        else:
+            rendered[key] = cards[key]
+    for key, post in posts.items():
+        post.card = mark_safe(cards[key])
+    if rendered:
+        cache.set_many(rendered, POST_CARD_TIMEOUT)
+    if pending:
+        cache.set_many(pending, THUMBNAIL_PENDING_TIMEOUT)
+    return page_obj
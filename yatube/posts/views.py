@@ -1,58 +1,137 @@
 from django.contrib.auth.decorators import login_required
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.utils import timezone
+from django.utils.http import urlencode
 
-from . import utils
+from . import autocomplete, feed_cache, follows, search, thumbnails, utils
+from .consts import AUTOCOMPLETE_LIMIT
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Comment, Follow, Group, Post, Timeline, User
 
+TIMELINE_ORDERING = ('-feed_date', '-feed_post')
 
-@cache_page(1, key_prefix='index_page')
+
+def latest_post(posts):
+    """Валидаторы ленты: дата и id самой свежей записи; при равных датах
+    подойдёт любая из них — новый пост всё равно меняет поколение."""
+    return posts.order_by('-pub_date').values_list(
+        'pub_date', 'id').first() or (None,)
+
+
+def post_state(request, post_id):
+    """Валидаторы поста: время последнего комментария, версия правки
+    и счётчик постов автора, который выводится на странице."""
+    # коррелированный подзапрос читает один элемент индекса комментариев
+    # вместо группировки всех комментариев поста
+    last_comment = Comment.objects.filter(
+        post=OuterRef('pk')).order_by('-created').values('created')[:1]
+    return Post.objects.filter(pk=post_id).annotate(
+        modified=Coalesce(Subquery(last_comment), 'pub_date'),
+    ).values_list(
+        'modified', 'version', 'author__stats__posts_count').first()
+
+
+@feed_cache.conditional_feed(
+    lambda: ('all', 'names'),
+    lambda request: latest_post(Post.objects.all()))
+@feed_cache.cache_feed(lambda: ('all', 'names'))
 def index(request):
-    posts = Post.objects.all()
-    page_obj = utils.get_page_context(request, posts)
+    posts = Post.objects.select_related('author', 'group')
+    page_obj = utils.attach_cards(utils.get_page_context(request, posts))
     template = 'posts/index.html'
     if request.user.is_authenticated:
-        follower = request.user.follower.exists()
-        context = dict(page_obj=page_obj, follower=follower)
+        follow_set = follows.get(request.user)
+        context = dict(page_obj=page_obj, follower=bool(follow_set),
+                       following=follow_set.among(
+                           post.author_id for post in page_obj))
         return render(request, template, context)
     context = dict(page_obj=page_obj)
     return render(request, template, context)
 
 
+@feed_cache.conditional_feed(
+    lambda slug: (f'group:{slug}', 'names'),
+    lambda request, slug: latest_post(
+        Post.objects.filter(group__slug=slug)))
+@feed_cache.cache_feed(lambda slug: (f'group:{slug}', 'names'))
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    page_obj = utils.get_page_context(request, posts)
-    context = dict(group=group, page_obj=page_obj)
+    posts = group.posts.select_related('author')
+    page_obj = utils.attach_cards(utils.get_page_context(request, posts))
+    following = follows.get(request.user).among(
+        post.author_id for post in page_obj)
+    context = dict(group=group, page_obj=page_obj, following=following)
     template = 'posts/group_list.html'
     return render(request, template, context)
 
 
+@feed_cache.conditional_feed(
+    lambda username: (f'author:{username}', 'names'),
+    lambda request, username: latest_post(
+        Post.objects.filter(author__username=username)))
+@feed_cache.cache_feed(lambda username: (f'author:{username}', 'names'))
 def profile(request, username):
     user = request.user
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
-    page_obj = utils.get_page_context(request, posts)
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username)
+    posts = author.posts.select_related('group')
+    page_obj = utils.attach_cards(
+        utils.get_page_context(request, posts), 'profile')
     template = 'posts/profile.html'
     context = dict(author=author,
                    page_obj=page_obj,
                    following=False)
-    if user.is_authenticated and author.following.filter(user=user):
-        context.update(following=True)
-        return render(request, template, context)
+    follow_set = follows.get(user)
+    if author.pk in follow_set:
+        context.update(following=True,
+                       notify=author.pk in follow_set.notify)
     return render(request, template, context)
 
 
+@feed_cache.conditional_feed(
+    lambda post_id: (f'post:{post_id}', 'names'), post_state)
+@feed_cache.cache_feed(feed_cache.post_scopes)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), pk=post_id)
+    thumbnails.prefetch([post])
     form = CommentForm()
-    comments = post.comments.all()
+    comments = utils.get_comments_page(request, post.pk)
     template = 'posts/post_detail.html'
     context = dict(post=post, form=form, comments=comments)
     return render(request, template, context)
 
 
+@feed_cache.cache_feed(lambda post_id: (f'post:{post_id}', 'names'))
+def post_comments(request, post_id):
+    """Следующая пачка комментариев для кнопки «Показать ещё»."""
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    comments = utils.get_comments_page(request, post_id)
+    context = dict(post=post, comments=comments)
+    return render(request, 'posts/includes/comments.html', context)
+
+
+def post_search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = utils.get_page_context(
+        request, search.search_posts(query),
+        keyset=True, ordering=search.SEARCH_ORDERING)
+    search.snippets(page_obj, query)
+    context = dict(page_obj=page_obj, query=query,
+                   extra_query=urlencode({'q': query}) + '&')
+    return render(request, 'posts/search.html', context)
+
+
+def suggest(request):
+    """Подсказки авторов и групп по началу имени в JSON."""
+    query = request.GET.get('q', '')
+    results = autocomplete.index.search(query, AUTOCOMPLETE_LIMIT)
+    return JsonResponse(dict(query=query, results=results))
+
+
 @login_required
 def post_create(request):
     form = PostForm(
@@ -62,6 +141,7 @@ def post_create(request):
         post = form.save(False)
         post.author = request.user
         post.save()
+        thumbnails.queue(post)
         return redirect('posts:profile', request.user)
     return render(request, 'posts/post_create.html', {'form': form})
 
@@ -76,7 +156,7 @@ def post_edit(request, post_id):
         files=request.FILES or None,
         instance=post)
     if form.is_valid():
-        form.save()
+        thumbnails.queue(form.save())
         return redirect('posts:post_detail', post_id)
     context = dict(form=form, is_edit=True, post_id=post_id)
     return render(request, 'posts/post_create.html', context)
@@ -104,10 +184,24 @@ def add_comment(request, post_id):
 
 
 @login_required
+@feed_cache.conditional_feed(
+    lambda: ('all', 'names'),
+    lambda request: Timeline.objects.filter(user=request.user).order_by(
+        '-pub_date', '-post_id').values_list('pub_date', 'post_id').first()
+    or (None,))
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-    page_obj = utils.get_page_context(request, posts)
-    follower = request.user.follower.exists()
+    # читаем материализованную ленту диапазоном по её индексу
+    posts = Post.objects.filter(timeline__user=request.user).select_related(
+        'author', 'group'
+    ).annotate(
+        feed_date=F('timeline__pub_date'),
+        feed_post=F('timeline__post'),
+    ).order_by(*TIMELINE_ORDERING)
+    # COUNT(*) ленты одного подписчика — диапазон индекса timeline,
+    # поэтому её первые страницы с номерами, а дальше — курсор
+    page_obj = utils.attach_cards(utils.get_page_context(
+        request, posts, keyset=False, ordering=TIMELINE_ORDERING))
+    follower = bool(follows.get(request.user))
     template = 'posts/follow.html'
     context = dict(page_obj=page_obj, follower=follower)
     return render(request, template, context)
@@ -117,8 +211,9 @@ def follow_index(request):
 def profile_follow(request, username):
     user = request.user
     author = get_object_or_404(User, username=username)
-    if user != author and not user.follower.filter(author=author):
-        Follow.objects.create(user=user, author=author)
+    # множество из кэша могло устареть: повторная подписка не ошибка
+    if user != author and author.pk not in follows.get(user):
+        Follow.objects.get_or_create(user=user, author=author)
     template = 'posts:profile'
     return redirect(template, username=username)
 
@@ -129,3 +224,26 @@ def profile_unfollow(request, username):
                       author__username=username).delete()
     template = 'posts:profile'
     return redirect(template, username=username)
+
+
+def set_notify(request, username, notify):
+    """Включает или выключает письма о новых постах автора; посты,
+    вышедшие до включения, в письма не попадут."""
+    follow = get_object_or_404(Follow, user=request.user,
+                               author__username=username)
+    if follow.notify != notify:
+        # save, а не update: сигнал меняет поколение подписок
+        follow.notify = notify
+        follow.notified = timezone.now()
+        follow.save(update_fields=['notify', 'notified'])
+    return redirect('posts:profile', username=username)
+
+
+@login_required
+def profile_notify(request, username):
+    return set_notify(request, username, True)
+
+
+@login_required
+def profile_mute(request, username):
+    return set_notify(request, username, False)
@@ -10,7 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -46,11 +50,13 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'core.apps.CoreConfig',
     'about.apps.AboutConfig',
+    'api.apps.ApiConfig',
     'sorl.thumbnail',
     'debug_toolbar',
 ]
 
 MIDDLEWARE = [
+    'core.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,6 +64,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.query_budget.QueryBudgetMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
@@ -70,7 +77,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.timing.TimedTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -139,18 +146,80 @@ LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
 # LOGOUT_REDIRECT_URL = 'posts:index'
 
-#  подключаем движок filebased.EmailBackend
-EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+# письма ставятся в очередь core.Email и отправляются фоновой задачей
+EMAIL_BACKEND = 'core.mail.OutboxBackend'
+#  очередь отправляет письма через движок filebased.EmailBackend
+OUTBOX_EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 # указываем директорию, в которую будут складываться файлы писем
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
+# сколько писем очередь забирает за раз; после скольких неудачных
+# попыток письмо больше не отправляется (меньше JOB_MAX_ATTEMPTS, чтобы
+# одно плохое письмо не исчерпало попытки задачи раньше себя); сколько
+# хранить отправленные письма, с
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 3
+OUTBOX_KEEP_SENT = 7 * 24 * 60 * 60
+# адрес сайта для ссылок в письмах, которые пишутся вне запроса
+SITE_URL = 'http://127.0.0.1:8000'
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# тесты (manage.py test и pytest) получают свой временный кэш: их
+# cache.clear() не должен стирать общий кэш работающего сайта
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+CACHE_DIR = os.path.join(BASE_DIR, 'cache')
+if TESTING:
+    CACHE_DIR = tempfile.mkdtemp(prefix='yatube-cache-')
+    atexit.register(shutil.rmtree, CACHE_DIR, True)
+
+# LRU в памяти процесса поверх общего для всех процессов SQLite-файла
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 5,
+            # счётчики поколений всегда читаются из общего уровня
+            'L1_SKIP_PREFIXES': ('feed_generation',
+                                 'autocomplete_generation'),
+        },
     }
 }
+
+# бюджет SQL-запросов на одно обращение к представлению (core.query_budget);
+# первый запрос после сессии — валидаторы условного GET
+QUERY_BUDGETS = {
+    'posts:index': 6,
+    'posts:group_list': 6,
+    'posts:profile': 7,
+    'posts:post_detail': 6,
+    'posts:post_comments': 4,
+    'posts:follow_index': 6,
+    'posts:search': 3,
+    # после построения индекса подсказок — только сессия и пользователь
+    'posts:autocomplete': 2,
+    # JSON API: те же валидаторы и страница, но без карточек и шаблонов
+    'api:index': 4,
+    'api:group_list': 5,
+    'api:profile': 5,
+    'api:follow_index': 3,
+    'api:post_detail': 5,
+}
+QUERY_BUDGET_RAISE = False
+
+# как часто процесс сохраняет замеры Server-Timing в core.ViewTiming, с
+SERVER_TIMING_FLUSH_INTERVAL = 10
+
+# очередь фоновых задач core.jobs: попыток по умолчанию; пауза перед
+# первым повтором и её предел, с; через сколько секунд задача молчащего
+# обработчика считается упавшей; сколько хранить выполненные задачи, с
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 10
+JOB_RETRY_MAX_DELAY = 60 * 60
+JOB_TIMEOUT = 15 * 60
+JOB_KEEP_DONE = 24 * 60 * 60
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
 
 application = get_wsgi_application()
+
+# тяжёлые индексы строятся при старте процесса, а не в первом запросе
+from posts.autocomplete import index  # noqa: E402
+
+index.warm()